@@ -0,0 +1,201 @@
+import struct
+
+# tiny encoder for building guest test programs; offsets are in bytes
+
+def d_form(opcode, rt, ra, d):
+  return (opcode << 26) | (rt << 21) | (ra << 16) | (d & 0xFFFF)
+
+def x_form(rt, ra, rb, xo, rc=0):
+  return (31 << 26) | (rt << 21) | (ra << 16) | (rb << 11) | (xo << 1) | rc
+
+def spr_field(spr):
+  return ((spr & 0x1F) << 5) | (spr >> 5)
+
+def li(rt, si):
+  return d_form(14, rt, 0, si)
+
+def addi(rt, ra, si):
+  return d_form(14, rt, ra, si)
+
+def lis(rt, si):
+  return d_form(15, rt, 0, si)
+
+def add(rt, ra, rb, oe=0, rc=0):
+  return x_form(rt, ra, rb, 266 | (oe << 9), rc)
+
+def or_(ra, rs, rb):
+  return x_form(rs, ra, rb, 444)
+
+def mr(ra, rs):
+  return or_(ra, rs, rs)
+
+def cmpwi(crf, ra, si):
+  return d_form(11, crf << 2, ra, si)
+
+def cmplwi(crf, ra, ui):
+  return d_form(10, crf << 2, ra, ui)
+
+def cmpw(crf, ra, rb):
+  return x_form(crf << 2, ra, rb, 0)
+
+def cmplw(crf, ra, rb):
+  return x_form(crf << 2, ra, rb, 32)
+
+def lwz(rt, d, ra):
+  return d_form(32, rt, ra, d)
+
+def stw(rs, d, ra):
+  return d_form(36, rs, ra, d)
+
+def stwu(rs, d, ra):
+  return d_form(37, rs, ra, d)
+
+def stb(rs, d, ra):
+  return d_form(38, rs, ra, d)
+
+def lbz(rt, d, ra):
+  return d_form(34, rt, ra, d)
+
+def lbzu(rt, d, ra):
+  return d_form(35, rt, ra, d)
+
+def stbu(rs, d, ra):
+  return d_form(39, rs, ra, d)
+
+def lwarx(rt, ra, rb):
+  return x_form(rt, ra, rb, 20)
+
+def stwcx(rs, ra, rb):
+  return x_form(rs, ra, rb, 150, 1)
+
+def b(offset, lk=0, aa=0):
+  return (18 << 26) | (offset & 0x3FFFFFC) | (aa << 1) | lk
+
+def bl(offset):
+  return b(offset, 1)
+
+def bc(bo, bi, offset, lk=0):
+  return (16 << 26) | (bo << 21) | (bi << 16) | (offset & 0xFFFC) | lk
+
+def bdnz(offset):
+  return bc(16, 0, offset)
+
+def beq(crf, offset):
+  return bc(12, (crf << 2) | 2, offset)
+
+def bne(crf, offset):
+  return bc(4, (crf << 2) | 2, offset)
+
+def blt(crf, offset):
+  return bc(12, crf << 2, offset)
+
+def bge(crf, offset):
+  return bc(4, crf << 2, offset)
+
+def blr():
+  return 0x4E800020
+
+def bcctr(bo, bi, lk=0):
+  return (19 << 26) | (bo << 21) | (bi << 16) | (528 << 1) | lk
+
+def bctr():
+  return bcctr(20, 0)
+
+def bctrl():
+  return bcctr(20, 0, 1)
+
+def mfspr(rt, spr):
+  return (31 << 26) | (rt << 21) | (spr_field(spr) << 11) | (339 << 1)
+
+def mtspr(spr, rs):
+  return (31 << 26) | (rs << 21) | (spr_field(spr) << 11) | (467 << 1)
+
+def mfcr(rt):
+  return x_form(rt, 0, 0, 19)
+
+def mtcrf(crm, rs):
+  return (31 << 26) | (rs << 21) | (crm << 12) | (144 << 1)
+
+def mcrf(crfd, crfs):
+  return (19 << 26) | (crfd << 23) | (crfs << 18)
+
+def mflr(rt):
+  return mfspr(rt, 8)
+
+def mtlr(rs):
+  return mtspr(8, rs)
+
+def mtctr(rs):
+  return mtspr(9, rs)
+
+def vx(xo, vd, va, vb):
+  return (4 << 26) | (vd << 21) | (va << 16) | (vb << 11) | xo
+
+def va_form(xo, vd, va, vb, vc):
+  return (4 << 26) | (vd << 21) | (va << 16) | (vb << 11) | (vc << 6) | xo
+
+def vx128(opcode, xo, vd, va, vb):
+  # 7-bit register numbers, the high bits scattered into the low half
+  return ((opcode << 26) | ((vd & 0x1F) << 21) | ((va & 0x1F) << 16) | ((vb & 0x1F) << 11)
+    | ((va >> 6) << 10) | (((va >> 5) & 1) << 5) | ((vd >> 5) << 2) | (vb >> 5) | xo)
+
+def lvx(vd, ra, rb):
+  return x_form(vd, ra, rb, 103)
+
+def stvx(vs, ra, rb):
+  return x_form(vs, ra, rb, 231)
+
+def lvx128(vd, ra, rb):
+  return (4 << 26) | ((vd & 0x1F) << 21) | (ra << 16) | (rb << 11) | ((vd >> 5) << 2) | 0x0C3
+
+def stvx128(vs, ra, rb):
+  return (4 << 26) | ((vs & 0x1F) << 21) | (ra << 16) | (rb << 11) | ((vs >> 5) << 2) | 0x1C3
+
+def vaddfp(vd, va, vb):
+  return vx(10, vd, va, vb)
+
+def vadduwm(vd, va, vb):
+  return vx(128, vd, va, vb)
+
+def vxor(vd, va, vb):
+  return vx(1220, vd, va, vb)
+
+def vspltw(vd, vb, uimm):
+  return vx(652, vd, uimm, vb)
+
+def vspltisw(vd, simm):
+  return vx(908, vd, simm & 0x1F, 0)
+
+def vcfsx(vd, vb, uimm):
+  return vx(842, vd, uimm, vb)
+
+def vcmpequw(vd, va, vb, rc=0):
+  return vx(134 | (rc << 10), vd, va, vb)
+
+def vmaddfp(vd, va, vc, vb):
+  return va_form(46, vd, va, vb, vc)
+
+def vperm(vd, va, vb, vc):
+  return va_form(43, vd, va, vb, vc)
+
+def vaddfp128(vd, va, vb):
+  return vx128(5, 0x010, vd, va, vb)
+
+def vmulfp128(vd, va, vb):
+  return vx128(5, 0x090, vd, va, vb)
+
+def vmaddfp128(vd, va, vb):
+  return vx128(5, 0x0D0, vd, va, vb)
+
+def vmsum4fp128(vd, va, vb):
+  return vx128(5, 0x1D0, vd, va, vb)
+
+def vpermwi128(vd, vb, perm):
+  return ((6 << 26) | ((vd & 0x1F) << 21) | ((perm & 0x1F) << 16) | ((vb & 0x1F) << 11)
+    | ((perm >> 5) << 6) | ((vd >> 5) << 2) | (vb >> 5) | 0x210)
+
+def sc():
+  return 0x44000002
+
+def assemble(words):
+  return b''.join(struct.pack('>I', word) for word in words)
@@ -0,0 +1,194 @@
+import io
+import os
+import time
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from core import *
+from xex import XEX
+from predecode import load_predecoded, Predecoded
+from cover import Coverage
+
+COPY_CHUNK = 0x100000
+
+JOB_STATUS = {
+  StopReason.Returned: 'returned',
+  StopReason.Budget: 'limit',
+  StopReason.Timeout: 'timeout',
+  StopReason.Fault: 'fault',
+}
+
+class Job:
+  def __init__(self, entry, gpr=None, limit=None, name=None, seconds=None) -> None:
+    self.entry = entry
+    self.gpr = gpr or {} # register number -> initial value
+    self.limit = limit
+    self.seconds = seconds
+    self.name = name
+
+class JobResult:
+  def __init__(self, index, job, status, context, instructions, seconds, error=None, coverage=None) -> None:
+    self.index = index
+    self.name = job.name
+    self.entry = job.entry
+    self.status = status # returned, limit, timeout, fault or error
+    self.context = context
+    self.instructions = instructions
+    self.seconds = seconds
+    self.error = error
+    self.coverage = coverage # Coverage of this job alone when the batch records it
+
+  @property
+  def value(self):
+    return self.context.gpr[3] if self.context is not None else None
+
+  def as_dict(self):
+    return {
+      'index': self.index,
+      'name': self.name,
+      'entry': hex(self.entry),
+      'status': self.status,
+      'r3': hex(self.value) if self.value is not None else None,
+      'instructions': self.instructions,
+      'seconds': self.seconds,
+      'error': self.error,
+    }
+
+class SharedImage:
+  # the loaded image is copied once into a shared memory block; workers map
+  # their pages straight from it instead of unpickling a copy each
+  def __init__(self, xex: XEX) -> None:
+    size = len(xex.image)
+    self.memory = SharedMemory(create=True, size=max(size, 1))
+    for start in range(0, size, COPY_CHUNK):
+      chunk = xex.image[start:start+COPY_CHUNK]
+      self.memory.buf[start:start+len(chunk)] = chunk
+
+    self.size = size
+    # decoded once here, every worker maps the same file
+    predecoded = load_predecoded(xex, create=True)
+    self.predecode = None if predecoded is None else (predecoded.path, predecoded.start)
+    self.layout = {
+      'base_address': xex.base_address,
+      'entry_point': xex.entry_point,
+      'sections': xex.sections,
+      'libraries': xex.libraries,
+    }
+
+  @property
+  def name(self):
+    return self.memory.name
+
+  def close(self):
+    self.memory.close()
+    self.memory.unlink()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+# one vm per worker process, reset from its snapshot before every job
+worker = None
+
+class Worker:
+  def __init__(self, name, size, layout, predecode=None, coverage=False) -> None:
+    self.memory = SharedMemory(name=name)
+    xex = XEX()
+    xex.__dict__.update(layout)
+    xex.image = self.memory.buf[:size]
+
+    self.vm = VirtualMachine(xex)
+    if predecode is not None:
+      self.vm.predecode = Predecoded.open(*predecode)
+    if coverage:
+      self.vm.coverage = Coverage.for_vm(self.vm)
+    self.start = self.vm.snapshot()
+
+  def run(self, index, job: Job):
+    vm = self.vm
+    vm.restore(self.start)
+    vm.tracer.sink = io.StringIO()
+    vm.context.iar = job.entry >> 2
+    vm.context.lr = 0
+    vm.instructions = 0
+    if vm.coverage is not None:
+      vm.coverage.clear()
+
+    started = time.perf_counter()
+    error = None
+    try:
+      reason = vm.execute(job.limit, job.seconds, job.gpr)
+      status = JOB_STATUS.get(reason, reason.name.lower())
+      if reason is StopReason.Fault:
+        error = vm.fault
+    except Exception as e:
+      status = 'error'
+      error = f'{type(e).__name__}: {e}'
+
+    coverage = vm.coverage.copy() if vm.coverage is not None else None
+    return JobResult(index, job, status, vm.context.copy(), vm.instructions, time.perf_counter() - started, error, coverage)
+
+def init_worker(name, size, layout, predecode, coverage):
+  global worker
+  worker = Worker(name, size, layout, predecode, coverage)
+
+def run_job(task):
+  return worker.run(*task)
+
+def run_batch(xex: XEX, jobs, workers=None, coverage=False):
+  # yields a JobResult per job in completion order, each carrying the code
+  # it covered when `coverage` is set
+  with SharedImage(xex) as image:
+    with Pool(workers or os.cpu_count(), init_worker, (image.name, image.size, image.layout, image.predecode, coverage)) as pool:
+      yield from pool.imap_unordered(run_job, enumerate(jobs))
+
+def load_jobs(path, limit):
+  import json
+  with open(path) as f:
+    entries = json.load(f)
+
+  jobs = []
+  for entry in entries:
+    address = entry['entry']
+    jobs.append(Job(
+      int(address, 0) if isinstance(address, str) else address,
+      {int(number): int(value, 0) if isinstance(value, str) else value for number, value in entry.get('gpr', {}).items()},
+      entry.get('limit', limit),
+      entry.get('name'),
+      entry.get('seconds'),
+    ))
+  return jobs
+
+if __name__ == '__main__':
+  import argparse
+  import json
+
+  parser = argparse.ArgumentParser(description='run many guest functions of one xex across processes')
+  parser.add_argument('path', help='xex image')
+  parser.add_argument('jobs', nargs='?', help='json list of {"entry", "gpr", "limit", "seconds", "name"}')
+  parser.add_argument('--functions', action='store_true', help='one job per function found by cfg.analyze_xex')
+  parser.add_argument('--workers', type=int)
+  parser.add_argument('--limit', type=int, default=1000000, help='default instruction limit per job')
+  parser.add_argument('--gpr', action='append', default=[], metavar='N=VALUE', help='initial register for jobs from --functions')
+  parser.add_argument('--coverage', metavar='PATH', help='write the code every job covered as drcov')
+  args = parser.parse_args()
+
+  xex = XEX(args.path)
+  jobs = load_jobs(args.jobs, args.limit) if args.jobs else []
+  if args.functions:
+    from cfg import analyze_xex
+    gpr = {int(n): int(v, 0) for n, v in (item.split('=') for item in args.gpr)}
+    jobs += [Job(address, gpr, args.limit, f'sub_{address:08x}') for address in sorted(analyze_xex(xex).functions)]
+  if not jobs:
+    jobs = [Job(xex.entry_point, limit=args.limit, name='entry')]
+
+  merged = None
+  for result in run_batch(xex, jobs, args.workers, args.coverage is not None):
+    print(json.dumps(result.as_dict()), flush=True)
+    if result.coverage is not None:
+      merged = result.coverage if merged is None else merged.merge(result.coverage)
+
+  if merged is not None:
+    merged.module = args.path
+    merged.write_drcov(args.coverage)
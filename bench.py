@@ -0,0 +1,624 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import asm
+from core import *
+from main import TEST_DATA
+from tracing import Level
+from translator import BlockTranslator
+
+CODE_BASE = 0x82000000
+ENGINES = ('interp', 'blocks', 'interp+lazy', 'blocks+lazy')
+
+def words_of(data):
+  return [int.from_bytes(data[i:i+4], 'big') for i in range(0, len(data) - 3, 4)]
+
+def decode_ctypes(value):
+  # the decode path before the format table: a ctypes union per step
+  inst = Instruction()
+  inst.value = value
+  entry = DISPATCH[inst.bits.opcode]
+  if entry is None:
+    return None
+  if entry.__class__ is list:
+    bundle = Bundle31() if inst.bits.opcode == 31 else Bundle19()
+    bundle.value = value
+    entry = entry[(((bundle.bits.sub | (bundle.bits.oe << 9)) if inst.bits.opcode == 31 else bundle.bits.sub) << 1) | (value & 1)]
+    if entry is None:
+      return None
+  handler, unpacker = entry
+  fmt = FORMAT_TABLE[unpacker.__name__[len('unpack_'):]].union
+  return handler, unpack_ctypes(fmt, value)
+
+def measure(fn, words, repeat):
+  start = time.perf_counter()
+  for _ in range(repeat):
+    for value in words:
+      fn(value)
+  return (time.perf_counter() - start) / (repeat * len(words))
+
+def bench_decode(repeat=2000):
+  words = words_of(TEST_DATA)
+  table = measure(decode, words, repeat)
+  legacy = measure(decode_ctypes, words, repeat)
+  print(f'decode (table):  {table * 1e9:8.1f} ns/word')
+  print(f'decode (ctypes): {legacy * 1e9:8.1f} ns/word')
+  print(f'speedup:         {legacy / table:8.2f}x')
+
+# synthetic guest programs, each a loop of `count` iterations ending in a blr
+# back to the host; r3 holds a result both engines have to agree on
+
+def alu_loop(count):
+  return [
+    asm.li(4, count),
+    asm.mtctr(4),
+    asm.li(3, 0),
+    asm.li(5, 3),
+    # loop:
+    asm.add(3, 3, 5),
+    asm.addi(6, 6, 1),
+    asm.or_(7, 6, 3),
+    asm.add(8, 7, 5),
+    asm.cmpw(0, 3, 8),
+    asm.bdnz(-20),
+    asm.blr(),
+  ]
+
+def memory_loop(count):
+  return [
+    asm.li(4, count),
+    asm.mtctr(4),
+    asm.li(3, 0),
+    # loop:
+    asm.stw(3, 0x10, 1),
+    asm.lwz(5, 0x10, 1),
+    asm.addi(3, 5, 1),
+    asm.stw(3, 0x14, 1),
+    asm.stb(3, 0x18, 1),
+    asm.bdnz(-20),
+    asm.blr(),
+  ]
+
+def branch_loop(count):
+  return [
+    asm.li(4, count),
+    asm.mtctr(4),
+    asm.li(3, 0),
+    # loop:
+    asm.addi(3, 3, 1),
+    asm.cmplwi(6, 3, 7),
+    asm.blt(6, 8),
+    asm.li(3, 0),
+    # skip:
+    asm.cmpwi(1, 3, 3),
+    asm.beq(1, 8),
+    asm.b(4),
+    # next:
+    asm.bdnz(-28),
+    asm.blr(),
+  ]
+
+def call_chain(count):
+  return [
+    asm.mflr(12),
+    asm.li(4, count),
+    asm.mtctr(4),
+    asm.li(3, 0),
+    # loop:
+    asm.bl(16),
+    asm.bdnz(-4),
+    asm.mtlr(12),
+    asm.blr(),
+    # first: a non-leaf function
+    asm.mflr(11),
+    asm.bl(16),
+    asm.mtlr(11),
+    asm.addi(3, 3, 1),
+    asm.blr(),
+    # second: a leaf
+    asm.addi(3, 3, 1),
+    asm.blr(),
+  ]
+
+def vector_loop(count):
+  return [
+    asm.li(4, count),
+    asm.mtctr(4),
+    asm.li(3, 0),
+    asm.li(6, 0x20),
+    asm.vspltisw(1, 1),
+    asm.vcfsx(1, 1, 0),
+    asm.stvx(1, 1, 6),
+    # loop:
+    asm.lvx128(100, 1, 6),
+    asm.vmaddfp128(100, 1, 1),
+    asm.vaddfp128(101, 100, 1),
+    asm.vpermwi128(102, 101, 0x1B),
+    asm.stvx128(100, 1, 6),
+    asm.addi(3, 3, 1),
+    asm.bdnz(-24),
+    asm.blr(),
+  ]
+
+def idiom_loop(count):
+  # the pairs interpret() fuses: a prologue, address formation, compare+branch
+  return [
+    asm.li(4, count),
+    asm.mtctr(4),
+    asm.li(3, 0),
+    # loop:
+    asm.mflr(12),
+    asm.stw(12, -8, 1),
+    asm.lis(5, 0x8200),
+    asm.addi(5, 5, 0x10),
+    asm.add(3, 3, 5),
+    asm.cmplwi(0, 3, 0x1000),
+    asm.bge(0, 8),
+    asm.addi(3, 3, 2),
+    # next:
+    asm.bdnz(-32),
+    asm.blr(),
+  ]
+
+WORKLOADS = {
+  'alu': alu_loop,
+  'memory': memory_loop,
+  'branch': branch_loop,
+  'calls': call_chain,
+  'vector': vector_loop,
+  'idioms': idiom_loop,
+}
+
+def make_vm(code, engine):
+  vm = VirtualMachine(None)
+  vm.load(code, CODE_BASE)
+  if engine.startswith('blocks'):
+    vm.translator = BlockTranslator(vm)
+  vm.lazy_flags = engine.endswith('+lazy')
+  return vm
+
+def run_once(vm):
+  vm.context.iar = CODE_BASE // 4
+  vm.context.lr = 0
+  vm.instructions = 0
+  start = time.perf_counter()
+  vm.execute()
+  return time.perf_counter() - start
+
+def bench_workload(name, engine, count, repeat):
+  code = asm.assemble(WORKLOADS[name](count))
+
+  start = time.perf_counter()
+  vm = make_vm(code, engine)
+  startup = time.perf_counter() - start
+
+  # the first run pays for decoding and translation, the best of the rest is steady state
+  cold = run_once(vm)
+  warm = min(run_once(vm) for _ in range(repeat))
+
+  tracemalloc.start()
+  run_once(make_vm(code, engine))
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return {
+    'name': name,
+    'engine': engine,
+    'instructions': vm.instructions,
+    'cold_seconds': cold,
+    'seconds': warm,
+    'ips': vm.instructions / warm,
+    'startup_seconds': startup,
+    'peak_bytes': peak,
+    'result': vm.context.gpr[3],
+  }
+
+# one representative word per handler; registers are set up so that every
+# load and store lands on the stack
+HANDLER_SAMPLES = {
+  cmpli: asm.cmplwi(0, 3, 5),
+  cmpi: asm.cmpwi(0, 3, 5),
+  li: asm.addi(3, 3, 1),
+  lis: asm.lis(6, 1),
+  bc: asm.bc(20, 0, 8),
+  sc: asm.sc(),
+  b: asm.b(8),
+  mcrf: asm.mcrf(1, 0),
+  bclr: asm.blr(),
+  cmp: asm.cmpw(0, 3, 4),
+  mfcr: asm.mfcr(6),
+  cmpl: asm.cmplw(0, 3, 4),
+  mtcrf: asm.mtcrf(0xFF, 7),
+  add: asm.add(6, 3, 4),
+  mfspr: asm.mflr(6),
+  or_mr: asm.or_(6, 3, 4),
+  mtspr: asm.mtctr(4),
+  lwz: asm.lwz(6, 0x10, 1),
+  stw: asm.stw(3, 0x10, 1),
+  stwu: asm.stwu(3, 0, 5),
+  stb: asm.stb(3, 0x10, 1),
+  lbz: asm.d_form(34, 6, 1, 0x10),
+  lhz: asm.d_form(40, 6, 1, 0x10),
+  ld: asm.d_form(58, 6, 1, 0x10),
+  lwzx: asm.x_form(6, 1, 4, 23),
+  stwx: asm.x_form(3, 1, 4, 151),
+  lvx: asm.lvx128(100, 1, 0),
+  stvx: asm.stvx(2, 1, 0),
+  vaddfp: asm.vaddfp128(100, 101, 102),
+  vmaddfp: asm.vmaddfp(2, 3, 4, 5),
+  vmsum4fp128: asm.vmsum4fp128(100, 101, 102),
+  vperm: asm.vperm(2, 3, 4, 5),
+  vpermwi128: asm.vpermwi128(100, 101, 0x1B),
+  vspltw: asm.vspltw(2, 3, 1),
+  vcmpequw: asm.vcmpequw(2, 3, 4, 1),
+}
+
+def bench_handlers(repeat=20000):
+  vm = VirtualMachine(None)
+  vm.memory.discard(STACK_BASE, STACK_SIZE)
+  gpr = vm.context.gpr
+  gpr[1] = gpr[5] = STACK_BASE + STACK_SIZE // 2
+  gpr[3], gpr[4], gpr[7] = 2, 3, 0x20000000
+
+  results = {}
+  for handler, value in HANDLER_SAMPLES.items():
+    results[f'decode/{handler.__name__}'] = measure(decode, [value], repeat)
+
+    _, val = decode(value)
+    start = time.perf_counter()
+    for _ in range(repeat):
+      vm.context.lr = CODE_BASE // 4
+      handler(val, vm)
+    results[f'handler/{handler.__name__}'] = (time.perf_counter() - start) / repeat
+
+  # typed accessors against the slice-and-convert path the handlers used before
+  memory = vm.memory
+  address = gpr[1] + 0x10
+  for name, fn in (
+    ('access/read_from_bytes', lambda: int.from_bytes(memory.read(address, 4), 'big')),
+    ('access/load_u32', lambda: memory.load_u32(address)),
+    ('access/write_to_bytes', lambda: memory.write(address, (0x12345678).to_bytes(4, 'big'))),
+    ('access/store_u32', lambda: memory.store_u32(address, 0x12345678)),
+  ):
+    start = time.perf_counter()
+    for _ in range(repeat):
+      fn()
+    results[name] = (time.perf_counter() - start) / repeat
+
+  results['decode/test_data'] = measure(decode, words_of(TEST_DATA), repeat // 100)
+  results['decode/test_data_ctypes'] = measure(decode_ctypes, words_of(TEST_DATA), repeat // 100)
+  return results
+
+def bench_snapshot(repeat=200):
+  # resetting to a starting state: restore after a run that dirtied the stack
+  # and some heap pages, against building a new vm
+  code = asm.assemble(memory_loop(16))
+  vm = make_vm(code, 'interp')
+  snapshot = vm.snapshot()
+  elapsed = 0
+  for _ in range(repeat):
+    run_once(vm)
+    for offset in range(0, 0x8000, PAGE_SIZE):
+      vm.memory.write(HEAP_BASE + offset, b'\xff')
+    start = time.perf_counter()
+    vm.restore(snapshot)
+    elapsed += time.perf_counter() - start
+
+  start = time.perf_counter()
+  for _ in range(repeat):
+    make_vm(code, 'interp')
+  return {'snapshot/restore': elapsed / repeat, 'snapshot/new_vm': (time.perf_counter() - start) / repeat}
+
+def guest_memcpy():
+  # byte loop the way a naive CRT copies: r3 destination, r4 source, r5 size
+  return [
+    asm.cmpwi(0, 5, 0),
+    asm.beq(0, 28),
+    asm.mtctr(5),
+    asm.addi(6, 3, -1),
+    asm.addi(4, 4, -1),
+    # loop:
+    asm.lbzu(7, 1, 4),
+    asm.stbu(7, 1, 6),
+    asm.bdnz(-8),
+    asm.blr(),
+  ]
+
+def bench_natives(size=1024, repeat=20):
+  # the guest copy loop against the native it is detected as and hooked with
+  from natives import install_crt
+  vm = make_vm(asm.assemble(guest_memcpy()), 'interp')
+  source, destination = HEAP_BASE, HEAP_BASE + 0x10000
+  vm.memory.write(source, bytes(range(256)) * (size // 256))
+
+  def copy():
+    vm.memory.write(destination, bytes(size))
+    gpr = vm.context.gpr
+    gpr[3], gpr[4], gpr[5] = destination, source, size
+    run_once(vm)
+    assert vm.memory.read(destination, size) == vm.memory.read(source, size)
+
+  results = {}
+  for name in ('guest', 'native'):
+    if name == 'native':
+      found = install_crt(vm, [CODE_BASE])
+      if found.get(CODE_BASE) != 'memcpy':
+        print(f'warning: guest memcpy detected as {found}')
+    start = time.perf_counter()
+    for _ in range(repeat):
+      copy()
+    results[f'memcpy_{size}/{name}'] = (time.perf_counter() - start) / repeat
+  return results
+
+def bench_fusion(count=5000, repeat=5):
+  # per instruction cost of the plain interpreter with and without fused
+  # pairs, on the loops that have them
+  results = {}
+  for name in ('branch', 'idioms'):
+    code = asm.assemble(WORKLOADS[name](count))
+    outcome = {}
+    for fusion in (False, True):
+      vm = make_vm(code, 'interp')
+      vm.fusion = fusion
+      seconds = min(run_once(vm) for _ in range(repeat))
+      outcome[fusion] = (vm.instructions, vm.context.gpr[3], vm.context.cr)
+      results[f'fusion/{name}_{"on" if fusion else "off"}'] = seconds / vm.instructions
+    if outcome[False] != outcome[True]:
+      print(f'warning: fusion changes the outcome of {name}: {outcome}')
+  return results
+
+def bench_recorder(count=2000):
+  # per instruction cost of the memory workload plain, under the binary
+  # recorder and under the text tracer writing to memory
+  import io
+  import os
+  import tempfile
+  from recorder import TraceRecorder
+  code = asm.assemble(memory_loop(count))
+  results = {}
+  for name in ('interp', 'recorded', 'traced'):
+    vm = make_vm(code, 'interp')
+    path = os.path.join(tempfile.mkdtemp(), 'bench.trc')
+    recorder = TraceRecorder(path)
+    if name == 'recorded':
+      recorder.attach(vm)
+    elif name == 'traced':
+      vm.tracer = Tracer(Category.ALL, Level.DEBUG, sink=io.StringIO())
+    seconds = run_once(vm)
+    recorder.close()
+    os.remove(path)
+    results[f'record/{name}'] = seconds / vm.instructions
+  return results
+
+def atomic_increment():
+  # r3 counter, r4 iterations; the taken branch between the lwarx and the
+  # stwcx. lets a quantum end there, so reservations do get lost
+  return [
+    asm.mtctr(4),
+    # loop:
+    asm.lwarx(5, 0, 3),
+    asm.b(4),
+    asm.addi(5, 5, 1),
+    asm.stwcx(5, 0, 3),
+    asm.bne(0, -16),
+    asm.bdnz(-20),
+    asm.blr(),
+  ]
+
+def bench_scheduler(threads=4, count=2000, quantum=64):
+  # guest threads sharing one atomic counter, per instruction cost
+  from scheduler import Scheduler
+  vm = make_vm(asm.assemble(atomic_increment()), 'interp')
+  counter = HEAP_BASE
+  vm.context.iar = CODE_BASE // 4
+  vm.context.gpr[3], vm.context.gpr[4] = counter, count
+  scheduler = Scheduler(vm, quantum)
+  for _ in range(threads - 1):
+    scheduler.create_thread(CODE_BASE, (counter, count))
+  start = time.perf_counter()
+  scheduler.run()
+  seconds = time.perf_counter() - start
+  if vm.memory.load_u32(counter) != threads * count:
+    print(f'warning: atomic counter is {vm.memory.load_u32(counter)}, expected {threads * count}')
+  return {f'scheduler/{threads}_threads': seconds / vm.instructions}
+
+def bench_predecode(size=0x40000):
+  # per word cost of decoding a cold code section, by fetch and decode and
+  # from a saved predecode table, on an image of the workloads' code
+  import os
+  import tempfile
+  from xex import XEX, Section, SECTION_CODE
+  from predecode import load_predecoded
+  code = b''.join(asm.assemble(WORKLOADS[name](100)) for name in WORKLOADS)
+  image = (code * (size // len(code) + 1))[:size]
+  directory = tempfile.mkdtemp()
+  xex = XEX()
+  xex.base_address = xex.entry_point = CODE_BASE
+  xex.image = xex.data = image
+  xex.sections = [Section(CODE_BASE, size, SECTION_CODE)]
+  xex.path = os.path.join(directory, 'bench.xex')
+
+  start = time.perf_counter()
+  predecoded = load_predecoded(xex, create=True)
+  results = {'predecode/build': (time.perf_counter() - start) / (size // 4)}
+  for name in ('decode', 'predecoded'):
+    vm = VirtualMachine(xex)
+    if name == 'decode':
+      vm.predecode = None
+    start = time.perf_counter()
+    for address in range(CODE_BASE, CODE_BASE + size, 4):
+      vm.decode_at(address)
+    results[f'predecode/{name}'] = (time.perf_counter() - start) / (size // 4)
+  os.remove(predecoded.path)
+  os.rmdir(directory)
+  return results
+
+def bench_symbols(count=50000, hot=4096, lookups=200000, seed=1):
+  # per lookup cost of naming addresses against a large symbol map: cold
+  # binary searches, and a trace-like stream over a hot set through the cache
+  from symbols import SymbolMap
+  rng = random.Random(seed)
+  starts = sorted(rng.sample(range(CODE_BASE, CODE_BASE + 0x02000000, 4), count))
+  symbols = SymbolMap((start, f'sub_{start:08x}', None) for start in starts)
+  addresses = [rng.randrange(CODE_BASE, CODE_BASE + 0x02000000) for _ in range(hot)]
+  stream = [rng.choice(addresses) for _ in range(lookups)]
+
+  start = time.perf_counter()
+  for address in stream:
+    symbols.format(address)
+  cold = time.perf_counter() - start
+  start = time.perf_counter()
+  for address in stream:
+    symbols.symbolize(address)
+  cached = time.perf_counter() - start
+  return {'symbols/search': cold / lookups, 'symbols/cached': cached / lookups}
+
+def bench_coverage(count=5000, repeat=5):
+  # per instruction cost of the plain interpreter with and without the
+  # coverage bitmap and edge counts, on the branchiest loops
+  from cover import Coverage
+  results = {}
+  for name in ('branch', 'calls'):
+    code = asm.assemble(WORKLOADS[name](count))
+    for covered in (False, True):
+      vm = make_vm(code, 'interp')
+      if covered:
+        vm.coverage = Coverage.for_vm(vm)
+      seconds = min(run_once(vm) for _ in range(repeat))
+      results[f'coverage/{name}_{"on" if covered else "off"}'] = seconds / vm.instructions
+  return results
+
+# differential check of lazy flags: random straight-line programs full of
+# compares, adds with oe/rc and every kind of cr/xer reader, run eagerly and
+# lazily on both engines
+
+FLAG_VALUES = [0, 1, 2, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFF, 0x7FFF, 0xFFFFFFFFFFFFFFFF]
+
+def random_flag_program(rng, length):
+  reg = lambda: rng.randrange(3, 13)
+  crf = lambda: rng.randrange(8)
+  makers = [
+    lambda: asm.cmpwi(crf(), reg(), rng.randrange(0x8000)),
+    lambda: asm.cmplwi(crf(), reg(), rng.randrange(0x10000)),
+    lambda: asm.cmpw(crf(), reg(), reg()),
+    lambda: asm.cmplw(crf(), reg(), reg()),
+    lambda: asm.add(reg(), reg(), reg(), rng.randrange(2), rng.randrange(2)),
+    lambda: asm.add(reg(), reg(), reg(), rng.randrange(2), rng.randrange(2)),
+    lambda: asm.mfcr(reg()),
+    lambda: asm.mtcrf(rng.randrange(0x100), reg()),
+    lambda: asm.mcrf(crf(), crf()),
+    lambda: asm.mfspr(reg(), 1),
+    lambda: asm.mtspr(1, reg()),
+    # skips the next instruction on a random cr bit
+    lambda: asm.bc(rng.choice((4, 12)), rng.randrange(32), 8),
+    lambda: asm.li(reg(), rng.randrange(0x8000)),
+  ]
+  # the li pads a trailing bc so it never skips the blr
+  return [rng.choice(makers)() for _ in range(length)] + [asm.li(0, 0), asm.blr()]
+
+def check_lazy_flags(programs=300, length=48, seed=1):
+  rng = random.Random(seed)
+  failures = 0
+  for index in range(programs):
+    code = asm.assemble(random_flag_program(rng, length))
+    start = [rng.choice(FLAG_VALUES) if rng.random() < 0.7 else rng.getrandbits(32) for _ in range(32)]
+    xer = rng.choice((0, XER_SO, XER_CA))
+
+    states = {}
+    for engine in ENGINES:
+      vm = make_vm(code, engine)
+      vm.context.gpr[:] = start
+      vm.context.xer = xer
+      run_once(vm)
+      states[engine] = vm.context
+
+    reference = states['interp']
+    for engine, context in states.items():
+      if context != reference:
+        failures += 1
+        print(f'program {index}: {engine} differs in {", ".join(context.diff(reference))}')
+  print(f'lazy flags: {programs} programs, {failures} mismatches')
+  return failures == 0
+
+def bench_startup(repeat=200):
+  start = time.perf_counter()
+  for _ in range(repeat):
+    vm = VirtualMachine(None)
+    vm.load(TEST_DATA, 0)
+  return (time.perf_counter() - start) / repeat
+
+def run_suite(engines, count, repeat, micro=True):
+  report = {
+    'timestamp': time.time(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'count': count,
+    'workloads': [bench_workload(name, engine, count, repeat) for name in WORKLOADS for engine in engines],
+    'startup_seconds': bench_startup(),
+    'micro': {**bench_handlers(), **bench_snapshot(), **bench_natives(), **bench_fusion(), **bench_recorder(), **bench_scheduler(), **bench_predecode(), **bench_symbols(), **bench_coverage()} if micro else {},
+  }
+  return report
+
+def print_report(report, baseline=None):
+  old = {}
+  if baseline is not None:
+    old = {(w['name'], w['engine']): w for w in baseline['workloads']}
+
+  print(f'{"workload":10} {"engine":12} {"insns":>10} {"Minsn/s":>9} {"cold ms":>9} {"startup us":>11} {"peak KiB":>9}')
+  for w in report['workloads']:
+    line = f'{w["name"]:10} {w["engine"]:12} {w["instructions"]:10} {w["ips"] / 1e6:9.3f} {w["cold_seconds"] * 1e3:9.2f} {w["startup_seconds"] * 1e6:11.1f} {w["peak_bytes"] / 1024:9.1f}'
+    previous = old.get((w['name'], w['engine']))
+    if previous is not None:
+      line += f'  {w["ips"] / previous["ips"]:6.2f}x'
+    print(line)
+
+  # both engines have to compute the same thing
+  results = {}
+  for w in report['workloads']:
+    results.setdefault(w['name'], set()).add(w['result'])
+  for name, values in results.items():
+    if len(values) > 1:
+      print(f'warning: engines disagree on {name}: {sorted(map(hex, values))}')
+
+  print(f'\nvm startup (TEST_DATA): {report["startup_seconds"] * 1e6:.1f} us')
+
+  old_micro = baseline['micro'] if baseline is not None else {}
+  for key, seconds in report['micro'].items():
+    line = f'{key:32} {seconds * 1e9:9.1f} ns'
+    if key in old_micro:
+      line += f'  {old_micro[key] / seconds:6.2f}x'
+    print(line)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='guest execution benchmarks')
+  parser.add_argument('--engine', choices=ENGINES + ('all',), default='all')
+  parser.add_argument('--iterations', type=int, default=20000, help='loop count of each workload (at most 0x7fff with li)')
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--no-micro', action='store_true', help='skip the decode and handler microbenchmarks')
+  parser.add_argument('--json', metavar='PATH', help='write the report as json')
+  parser.add_argument('--compare', metavar='PATH', help='show speedups against an earlier json report')
+  parser.add_argument('--check-flags', action='store_true', help='only run the lazy flags differential check')
+  args = parser.parse_args(argv)
+
+  if args.check_flags:
+    sys.exit(0 if check_lazy_flags() else 1)
+
+  engines = ENGINES if args.engine == 'all' else (args.engine,)
+  report = run_suite(engines, args.iterations, args.repeat, not args.no_micro)
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+  print_report(report, baseline)
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
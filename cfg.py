@@ -0,0 +1,246 @@
+import numpy as np
+from bisect import bisect_right
+from core import *
+
+# mflr r12 / stw r12,-8(r1), the start of every non-leaf function in the test data
+PROLOGUE = (0x7D8802A6, 0x9181FFF8)
+# lwz r12,-8(r1) / mtlr r12, restoring lr before the blr
+EPILOGUE = (0x8181FFF8, 0x7D8803A6)
+
+EDGE_FALLTHROUGH = 0
+EDGE_BRANCH = 1
+EDGE_TAKEN = 2
+
+class CodeView:
+  # word access to the code sections of an image without going through a vm
+  def __init__(self) -> None:
+    self.ranges = []
+
+  def add(self, address, data):
+    words = np.frombuffer(data, dtype='>u4', count=len(data) // 4)
+    self.ranges.append((address, address + len(words) * 4, words))
+    self.ranges.sort(key=lambda r: r[0])
+
+  @classmethod
+  def from_xex(cls, xex):
+    view = cls()
+    for section in xex.sections:
+      if section.kind == SECTION_CODE:
+        offset = section.address - xex.base_address
+        view.add(section.address, xex.image[offset:offset+section.size])
+    return view
+
+  def contains(self, address):
+    return self.find(address) is not None
+
+  def find(self, address):
+    for start, end, words in self.ranges:
+      if start <= address < end:
+        return start, words
+    return None
+
+  def word(self, address):
+    found = self.find(address)
+    if found is None:
+      return None
+    start, words = found
+    return int(words[(address - start) >> 2])
+
+class BasicBlock:
+  __slots__ = ('start', 'end', 'successors')
+
+  def __init__(self, start, end, successors) -> None:
+    self.start = start
+    self.end = end
+    self.successors = successors # list of (address, edge kind)
+
+class Function:
+  def __init__(self, address) -> None:
+    self.address = address
+    self.blocks = {}
+    self.calls = set()
+    self.tail_calls = set()
+    self.returns = []
+    self.indirect_calls = [] # bctrl sites, their targets are only known at run time
+    self.indirect_jumps = [] # bctr sites: switch tables, tail calls through pointers
+    self.has_prologue = False
+    self.epilogues = []
+    self.frame_size = 0
+
+  @property
+  def end(self):
+    return max(block.end for block in self.blocks.values()) if self.blocks else self.address
+
+  @property
+  def size(self):
+    return self.end - self.address
+
+  def edges(self):
+    for block in self.blocks.values():
+      for target, kind in block.successors:
+        yield block.start, target, kind
+
+class FunctionIndex:
+  def __init__(self, code: CodeView) -> None:
+    self.code = code
+    self.functions = {}
+    self.decoded = {}
+    self.block_starts = []
+    self.block_owners = []
+
+  def decode(self, address):
+    entry = self.decoded.get(address)
+    if entry is None and address not in self.decoded:
+      value = self.code.word(address)
+      entry = decode(value) if value is not None else None
+      self.decoded[address] = entry
+    return entry
+
+  def scan_prologues(self):
+    # candidate entries that nothing calls directly (vtables, callbacks, ...)
+    found = []
+    first, second = PROLOGUE
+    for start, end, words in self.code.ranges:
+      hits = np.flatnonzero((words[:-1] == first) & (words[1:] == second))
+      found += [start + int(i) * 4 for i in hits]
+    return found
+
+  def discover(self, entries, scan_prologues=True):
+    queue = list(entries)
+    if scan_prologues:
+      queue += self.scan_prologues()
+    known = set(queue)
+
+    while queue:
+      address = queue.pop()
+      if address in self.functions or not self.code.contains(address):
+        continue
+
+      function = self.explore(address, known)
+      self.functions[address] = function
+      for target in function.calls | function.tail_calls:
+        if target not in known:
+          known.add(target)
+          queue.append(target)
+
+    # tail calls can only be told apart from jumps once every entry is known
+    for function in self.functions.values():
+      function.tail_calls &= self.functions.keys()
+
+    self.build_lookup()
+    return self.functions
+
+  def build_lookup(self):
+    blocks = sorted(((block.start, block.end, function) for function in self.functions.values() for block in function.blocks.values()), key=lambda entry: entry[0])
+    self.block_starts = [start for start, _, _ in blocks]
+    self.block_owners = [(end, function) for _, end, function in blocks]
+
+  def explore(self, entry, known):
+    function = Function(entry)
+    leaders = {entry}
+    visited = set()
+    work = [entry]
+
+    # pass 1: find every reachable instruction and every block leader
+    while work:
+      address = work.pop()
+      while address not in visited:
+        decoded = self.decode(address)
+        if decoded is None:
+          break
+
+        visited.add(address)
+        handler, val = decoded
+        if handler is b:
+          target = b_target(val, address)
+          if val.lk:
+            function.calls.add(target)
+          elif target != entry and target in known:
+            function.tail_calls.add(target)
+            break
+          else:
+            leaders.add(target)
+            work.append(target)
+            break
+        elif handler is bc:
+          target = bc_target(val, address)
+          leaders.update((target, address + 4))
+          work += [target, address + 4]
+          break
+        elif handler is bclr:
+          if val.bo & 0b10100 == 0b10100:
+            function.returns.append(address)
+            break
+          leaders.add(address + 4)
+        elif handler is bcctr:
+          if val.lk:
+            function.indirect_calls.append(address)
+          else:
+            function.indirect_jumps.append(address)
+            if val.bo & 0b10000:
+              break
+            leaders.add(address + 4)
+
+        address += 4
+
+    # pass 2: cut the reachable code into blocks at the leaders
+    for start in sorted(leaders & visited):
+      address = start
+      successors = []
+      while True:
+        handler, val = self.decode(address)
+        end = address + 4
+        if handler is b and not val.lk:
+          target = b_target(val, address)
+          if target not in function.tail_calls:
+            successors.append((target, EDGE_BRANCH))
+          break
+        if handler is bc:
+          successors += [(bc_target(val, address), EDGE_TAKEN), (end, EDGE_FALLTHROUGH)]
+          break
+        if handler is bclr:
+          if val.bo & 0b10100 != 0b10100:
+            successors.append((end, EDGE_FALLTHROUGH))
+          break
+        if handler is bcctr and not val.lk:
+          if not (val.bo & 0b10000):
+            successors.append((end, EDGE_FALLTHROUGH))
+          break
+        if end not in visited:
+          break
+        if end in leaders:
+          successors.append((end, EDGE_FALLTHROUGH))
+          break
+        address = end
+
+      function.blocks[start] = BasicBlock(start, end, successors)
+
+    self.match_frame(function)
+    # decoded words are only kept per function so memory stays bounded
+    self.decoded.clear()
+    return function
+
+  def match_frame(self, function):
+    first = self.code.word(function.address)
+    second = self.code.word(function.address + 4)
+    function.has_prologue = (first, second) == PROLOGUE
+    if function.has_prologue:
+      stwu_word = self.code.word(function.address + 8)
+      decoded = decode(stwu_word) if stwu_word is not None else None
+      if decoded is not None and decoded[0] is stwu and decoded[1].ra == 1:
+        function.frame_size = -u16_to_s16(decoded[1].ds)
+
+    for address in function.returns:
+      if (self.code.word(address - 8), self.code.word(address - 4)) == EPILOGUE:
+        function.epilogues.append(address)
+
+  def function_at(self, address):
+    i = bisect_right(self.block_starts, address) - 1
+    if i >= 0 and address < self.block_owners[i][0]:
+      return self.block_owners[i][1]
+    return None
+
+def analyze_xex(xex):
+  index = FunctionIndex(CodeView.from_xex(xex))
+  index.discover([xex.entry_point])
+  return index
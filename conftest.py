@@ -0,0 +1 @@
+# lets the tests import the flat modules at the repository root
@@ -1,569 +1,2271 @@
-from typing import Dict
-import struct
-from registers import Registers, Cr
-from xex import XEX
-from instructions import *
-from enum import Enum, unique, auto
-
-HANDLER_TABLE = {}
-
-def u16_to_s16(value):
-  value &= 0xFFFF
-  if value & 0x8000:
-    return value - 0x10000
-  return value
-
-def u24_to_s24(value):
-  value &= 0xFFFFFF
-  if value & 0x800000:
-    return value - 0x1000000
-  return value
-
-def u32_to_s32(value):
-  value &= 0xFFFFFFFF
-  if value & 0x80000000:
-    return value - 0x100000000
-  return value
-
-def u64_to_s64(value):
-  value &= 0xFFFFFFFFFFFFFFFF
-  if value & 0x8000000000000000:
-    return value - 0x10000000000000000
-  return value
-
-def pyint_to_u32(value):
-  return value & 0xFFFFFFFF
-
-def pyint_to_u64(value):
-  return value & 0xFFFFFFFFFFFFFFFF
-
-@unique
-class IterReason(Enum):
-  IterOk = 0,
-  IterContinue = auto(),
-  IterReturn = auto()
-  
-class VirtualMachine:
-  def __init__(self, xex: XEX) -> None:
-    self.context = Registers()
-    self.stack = bytearray([0x69] * 0xffff) # default size, idk
-    self.data = bytearray()
-    self.executing = bytearray()
-    self.xex = xex
-    pass
-  
-  def write(self, address, off, byte_value, register=None):
-    val = ' '.join([hex(a)[2:] for a in byte_value])
-    print(f'[Write] {hex(address)} + {hex(off)}({hex(address + off)}) = {val}, reg {register}')
-    if register is not None:
-      if register == 1:
-        stack_ptr = self.context.gpr[1] + off
-        self.stack[stack_ptr:stack_ptr+len(byte_value)] = byte_value
-        return
-
-    address += off
-    
-    if address <= len(self.stack):
-      # likely frame pointer or something similar
-      self.stack[address:address+len(byte_value)] = byte_value
-      return
-    
-    xex_base = self.xex.base_address - self.xex.pe_data_offset
-    xex_size = len(self.data)
-    
-    if address >= xex_base and address <= (xex_base + xex_size):
-      offset = self.virtual_to_real(address)
-      self.data[offset:offset+len(byte_value)] = byte_value
-      return
-    
-    b = ' '.join([hex(a)[2:] for a in byte_value])
-    print(f'failed to write, {hex(address)}, {hex(off)}, {b}, {register}')
-    pass
-  
-  def read(self, address, off, size, register=None):
-    print(f'[Read] {hex(address)} + {hex(off)}({hex(address + off)}) for {size} bytes, reg {register}')
-    if register is not None:
-      if register == 1:
-        stack_ptr = self.context.gpr[1] + off
-        return self.stack[stack_ptr:stack_ptr+size] # stack
-      
-    address += off
-    
-    if address <= len(self.stack):
-      # likely frame pointer or something similar
-      return self.stack[address:address+size]
-    
-    xex_base = self.xex.base_address - self.xex.pe_data_offset
-    xex_size = len(self.data)
-    
-    if address >= xex_base and address <= (xex_base + xex_size):
-      offset = self.virtual_to_real(address)
-      return self.data[offset:offset+size]
-    
-    return [0] * size # temp
-  
-  def virtual_to_real(self, virtual):
-    return virtual - self.xex.base_address - self.xex.pe_data_offset
-  
-  def branch_to(self, src, dst):
-    inst = Bx()
-    inst.bits.opcode = 18
-    inst.bits.ll = (dst - src) // 4
-    
-    offset = self.virtual_to_real(src)
-    self.executing[offset:offset+4] = struct.pack('>I', inst.value)
-    pass
-  
-  def execute(self):
-    self.stack = [0] * len(self.stack)
-    self.context.gpr[1] = len(self.stack) // 2
-    
-    while True:
-      iar = self.context.iar * 4
-      buffer = self.executing[iar:iar+4]
-      
-      inst = Instruction()
-      inst.value = int.from_bytes(buffer, 'big')
-      
-      if inst.bits.opcode in HANDLER_TABLE:
-        match HANDLER_TABLE[inst.bits.opcode](buffer, self):
-          case IterReason.IterContinue:
-            continue
-          case IterReason.IterReturn:
-            return
-        
-        self.context.iar += 1
-      else:
-        print(f'opcode {inst.bits.opcode} not setup')
-        break
-
-def cmpi(data, vm: VirtualMachine) -> IterReason:
-  val = Cmpi()
-  val.value = int.from_bytes(data, 'big')
-  
-  for i in range(len(vm.context.cr[val.bits.crfd])):
-    vm.context.cr[val.bits.crfd][i] = False
-    
-  ra = 0
-  ds = 0
-  
-  if val.bits.l:
-    ra = u64_to_s64(vm.context.gpr[val.bits.ra])
-    ds = u64_to_s64(val.bits.ds)
-  else:
-    ra = u32_to_s32(vm.context.gpr[val.bits.ra])
-    ds = u32_to_s32(val.bits.ds)
-    
-  vm.context.cr[val.bits.crfd][Cr.lt] = ra < ds # lt
-  vm.context.cr[val.bits.crfd][Cr.gt] = ra > ds # gt
-  vm.context.cr[val.bits.crfd][Cr.eq] = ra == ds # eq
-  vm.context.cr[val.bits.crfd][Cr.so] = vm.context.xer.so != 0 # so
-  
-  tag = 'cmpdi' if val.bits.l else 'cmpwi'
-  print(f'{tag} cr{val.bits.crfd}, r{val.bits.ra}, {hex(val.bits.ds)}')
-  return IterReason.IterOk
-
-def cmpli(data, vm: VirtualMachine) -> IterReason:
-  val = Cmpli()
-  val.value = int.from_bytes(data, 'big')
-  
-  for i in range(len(vm.context.cr[val.bits.crfd])):
-    vm.context.cr[val.bits.crfd][i] = False
-    
-  ra = 0
-  ds = 0
-  
-  if val.bits.l:
-    ra = pyint_to_u64(vm.context.gpr[val.bits.ra])
-    ds = pyint_to_u64(val.bits.ds)
-  else:
-    ra = pyint_to_u32(vm.context.gpr[val.bits.ra])
-    ds = pyint_to_u32(val.bits.ds)
-    
-  vm.context.cr[val.bits.crfd][Cr.lt] = ra < ds # lt
-  vm.context.cr[val.bits.crfd][Cr.gt] = ra > ds # gt
-  vm.context.cr[val.bits.crfd][Cr.eq] = ra == ds # eq
-  vm.context.cr[val.bits.crfd][Cr.so] = vm.context.xer.so != 0 # so
-  
-  tag = 'cmpldi' if val.bits.l else 'cmplwi'
-  print(f'{tag} cr{val.bits.crfd}, r{val.bits.ra}, {hex(val.bits.ds)}')
-  return IterReason.IterOk
-
-def li(data, vm: VirtualMachine) -> IterReason:
-  val = Li()
-  val.value = int.from_bytes(data, 'big')
-  
-  si = val.bits.si
-  output = si if val.bits.ra == 0 else (vm.context.gpr[val.bits.ra | 0] + si)
-  vm.context.gpr[val.bits.rt] = pyint_to_u32(output)
-
-  if val.bits.ra == 0:
-    print(f'li r{val.bits.rt}, {hex(val.bits.si)}')
-  else:
-    print(f'addi r{val.bits.rt}, r{val.bits.ra | 0}, {hex(val.bits.si)}')
-  return IterReason.IterOk
-
-def lis(data, vm: VirtualMachine) -> IterReason:
-  val = Li()
-  val.value = int.from_bytes(data, 'big')
-  
-  si = pyint_to_u32(val.bits.si)
-  ra = pyint_to_u32(val.bits.ra)
-  
-  if val.bits.ra == 0:
-    vm.context.gpr[val.bits.rt] = si if si else 0
-    print(f'lis r{val.bits.rt}, {hex(val.bits.si if val.bits.si else 0)}')
-  else:
-    vm.context.gpr[val.bits.rt] = (ra if ra else 0) + (si if si else 0)
-    print(f'addic r{val.bits.rt}, r{val.bits.ra | 0}, {hex(val.bits.si if val.bits.si else 0)}')
-
-  return IterReason.IterOk
-
-def sc(data, vm: VirtualMachine) -> IterReason:
-  val = Sc()
-  val.value = int.from_bytes(data, 'big')
-  
-  if val.bits.lev == 2:
-    print(f'TODO: Syscall with index {hex(vm.context.gpr[0])}')
-
-  return IterReason.IterOk
-
-def lwz(data, vm: VirtualMachine) -> IterReason:
-  val = Lwz()
-  val.value = int.from_bytes(data, 'big')
-  
-  vm.context.gpr[val.bits.rt] = pyint_to_u32(int.from_bytes(vm.read(vm.context.gpr[val.bits.ra], val.bits.ds, 4, val.bits.ra), 'little'))
-  
-  offset_fmt = '' if val.bits.ds > 0 else '-'
-  offset_val = abs(val.bits.ds)
-  print(f'lwz r{val.bits.rt}, {offset_fmt}{hex(offset_val)}(r{val.bits.ra}) -> {hex(vm.context.gpr[val.bits.rt])}')
-
-  return IterReason.IterOk
-
-def stwu(data, vm: VirtualMachine) -> IterReason:
-  val = Stwu()
-  val.value = int.from_bytes(data, 'big')
-  
-  if val.bits.ra == 1:
-    # stack
-    current = vm.context.gpr[1]
-    vm.context.gpr[1] += u16_to_s16(val.bits.ds)
-    
-    if vm.context.gpr[1] < 0:
-      # expand stack
-      vm.stack.extend(abs(vm.context.gpr[1]))
-      vm.context.gpr[1] = 0 # bottom of the stack
-      pass
-    
-    vm.write(0, 0, current.to_bytes(8, 'little'), 1)
-    print(f'Stack pointer: {hex(vm.context.gpr[1])}')
-  else:
-    vm.write(vm.context.gpr[val.bits.ra], u16_to_s16(val.bits.ds), vm.context.gpr[val.bits.rt].to_bytes(4, 'little'), val.bits.ra)
-  
-  offset_fmt = '' if u16_to_s16(val.bits.ds) > 0 else '-'
-  offset_val = abs(u16_to_s16(val.bits.ds))
-  print(f'stwu r{val.bits.rt}, {offset_fmt}{hex(offset_val)}(r{val.bits.ra})')
-  return IterReason.IterOk
-
-def stw(data, vm: VirtualMachine) -> IterReason:
-  val = Stw()
-  val.value = int.from_bytes(data, 'big')
-  
-  vm.write(vm.context.gpr[val.bits.ra], u16_to_s16(val.bits.ds), vm.context.gpr[val.bits.rt].to_bytes(4, 'little'), val.bits.ra)
-  
-  offset_fmt = '' if u16_to_s16(val.bits.ds) > 0 else '-'
-  offset_val = abs(u16_to_s16(val.bits.ds))
-  print(f'stw r{val.bits.rt}, {offset_fmt}{hex(offset_val)}(r{val.bits.ra})')
-  return IterReason.IterOk
-
-def stb(data, vm: VirtualMachine) -> IterReason:
-  val = Stb()
-  val.value = int.from_bytes(data, 'big')
-  
-  vm.write(vm.context.gpr[val.bits.ra], u16_to_s16(val.bits.ds), vm.context.gpr[val.bits.rt].to_bytes(1, 'little'), val.bits.ra)
-  
-  offset_fmt = '' if u16_to_s16(val.bits.ds) > 0 else '-'
-  offset_val = abs(u16_to_s16(val.bits.ds))
-  print(f'stb r{val.bits.rt}, {offset_fmt}{hex(offset_val)}(r{val.bits.ra})')
-  return IterReason.IterOk
-
-def b(data, vm: VirtualMachine) -> IterReason:
-  val = Bx()
-  val.value = int.from_bytes(data, 'big')
-  
-  if val.bits.lk:
-    vm.context.lr = vm.context.iar + 1
-    
-  offset = val.bits.ll - 1
-  if val.bits.aa == 0:
-    vm.context.iar += u24_to_s24(offset)
-  else:
-    vm.context.iar = offset
-  
-  key = 'b'
-  if val.bits.aa == 1 and val.bits.lk == 0:
-    key = 'ba'
-  elif val.bits.aa == 0 and val.bits.lk == 1:
-    key = 'bl'
-  elif val.bits.aa == 1 and val.bits.lk == 1:
-    key = 'bla'
-    
-  print(f'{key} {hex(u24_to_s24(offset) * 4)}')  
-  return IterReason.IterOk
-
-def bc(data, vm: VirtualMachine) -> IterReason:
-  val = Bcx()
-  val.value = int.from_bytes(data, 'big')
-  
-  cr_field = val.bits.bi >> 2
-  cr_field_bit = val.bits.bi & 3
-  branch_offset = (val.bits.bd << 2) - 1
-  
-  offset_fmt = '' if u16_to_s16(branch_offset) > 0 else '-'
-  offset_val = abs(u16_to_s16(branch_offset))
-    
-  decrement = False
-  if not (val.bits.bo & 0b00100):
-    vm.context.ctr -= 1
-    decrement = True
-    
-  branch = False
-  if (val.bits.bo & 0b10000):
-    if decrement:
-      branch = True
-    elif (val.bits.bo & 0b00010):
-      branch = vm.context.ctr == 0
-      print(f'bdz cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-    else:
-      branch = vm.context.ctr != 0
-      print(f'bdnz cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-  else:
-    if (val.bits.bo & 0b01000):
-      branch = vm.context.cr[cr_field][cr_field_bit]
-      match cr_field_bit:
-        case 0:
-          print(f'blt cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-        case 1:
-          print(f'bgt cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-        case 2:
-          print(f'beq cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-    else:
-      branch = not (vm.context.cr[cr_field][cr_field_bit])
-      match cr_field_bit:
-        case 0:
-          print(f'bge cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-        case 1:
-          print(f'ble cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-        case 2:
-          print(f'bne cr{cr_field}, {offset_fmt}{hex(offset_val)}')
-  
-  if branch:
-    if val.bits.lk:
-      vm.context.lr = vm.context.iar + 1
-      
-    offset = (branch_offset & 0xFFFF if branch_offset & 0x8000 else branch_offset) // 4
-    vm.context.iar = offset if val.bits.aa else vm.context.iar + offset
-  
-  return IterReason.IterOk
-
-def or_mr(data, vm: VirtualMachine, bundle: Bundle31) -> IterReason:
-  val = Or()
-  val.value = int.from_bytes(data, 'big')
-  
-  vm.context.gpr[val.bits.ra] = vm.context.gpr[val.bits.rs] | vm.context.gpr[val.bits.rb]
-  
-  if val.bits.rb == val.bits.rs:
-    print(f'mr r{val.bits.ra}, r{val.bits.rb}')
-  else:
-    print(f'or r{val.bits.ra}, r{val.bits.rs}, r{val.bits.rb}')
-  
-  return IterReason.IterOk
-
-def cmp(data, vm: VirtualMachine, bundle: Bundle31) -> IterReason:
-  val = Cmp()
-  val.value = int.from_bytes(data, 'big')
-  
-  for i in range(len(vm.context.cr[val.bits.crfd])):
-    vm.context.cr[val.bits.crfd][i] = False
-    
-  ra = 0
-  rb = 0
-  
-  if val.bits.l:
-    ra = u64_to_s64(vm.context.gpr[val.bits.ra])
-    rb = u64_to_s64(vm.context.gpr[val.bits.rb])
-  else:
-    ra = u32_to_s32(vm.context.gpr[val.bits.ra])
-    rb = u32_to_s32(vm.context.gpr[val.bits.rb])
-    
-  vm.context.cr[val.bits.crfd][Cr.lt] = ra < rb # lt
-  vm.context.cr[val.bits.crfd][Cr.gt] = ra > rb # gt
-  vm.context.cr[val.bits.crfd][Cr.eq] = ra == rb # eq
-  vm.context.cr[val.bits.crfd][Cr.so] = vm.context.xer.so != 0 # so
-  
-  tag = 'cmpd' if val.bits.l else 'cmpw'
-  ctrl = '.' if bundle.bits.rc else ''
-  print(f'{tag}{ctrl} cr{val.bits.crfd}, r{val.bits.ra}, r{val.bits.rb}')
-  return IterReason.IterOk
-
-def cmpl(data, vm: VirtualMachine, bundle: Bundle31) -> IterReason:
-  val = Cmpl()
-  val.value = int.from_bytes(data, 'big')
-  
-  for i in range(len(vm.context.cr[val.bits.crfd])):
-    vm.context.cr[val.bits.crfd][i] = False
-    
-  ra = 0
-  rb = 0
-  
-  if val.bits.l:
-    ra = pyint_to_u64(vm.context.gpr[val.bits.ra])
-    rb = pyint_to_u64(vm.context.gpr[val.bits.rb])
-  else:
-    ra = pyint_to_u32(vm.context.gpr[val.bits.ra])
-    rb = pyint_to_u32(vm.context.gpr[val.bits.rb])
-    
-  vm.context.cr[val.bits.crfd][Cr.lt] = ra < rb # lt
-  vm.context.cr[val.bits.crfd][Cr.gt] = ra > rb # gt
-  vm.context.cr[val.bits.crfd][Cr.eq] = ra == rb # eq
-  vm.context.cr[val.bits.crfd][Cr.so] = vm.context.xer.so != 0 # so
-  
-  tag = 'cmpld' if val.bits.l else 'cmplw'
-  ctrl = '.' if bundle.bits.rc else ''
-  print(f'{tag}{ctrl} cr{val.bits.crfd}, r{val.bits.ra}, r{val.bits.rb}')
-  return IterReason.IterOk
-
-def add(data, vm: VirtualMachine, bundle: Bundle31) -> IterReason:
-  val = Addx()
-  val.value = int.from_bytes(data, 'big')
-  
-  ra = pyint_to_u64(vm.context.gpr[val.bits.ra])
-  rb = pyint_to_u64(vm.context.gpr[val.bits.rb])
-  
-  vm.context.gpr[val.bits.rt] = ra + rb
-
-  rt = pyint_to_u64(vm.context.gpr[val.bits.rt])
-  
-  if val.bits.oe:
-    if (ra ^ ~rb) & (ra ^ rt) & 0x80000000:
-      vm.context.xer.so = 1
-      vm.context.xer.ov = 1
-    else:
-      vm.context.xer.ov = 0
-  
-  if val.bits.rc:
-    for i in range(vm.context.cr[0]):
-      vm.context.cr[0][i] = False
-      
-    if vm.context.gpr[val.bits.rt] == 0:
-      vm.context.cr[0][Cr.eq] = True
-    elif (vm.context.gpr[val.bits.rt] & 0x80000000):
-      vm.context.cr[0][Cr.lt] = True
-    else:
-      vm.context.cr[0][Cr.gt] = True
-      
-    vm.context.cr[0][Cr.so] = vm.context.xer.so != 0
-  
-  key = 'add'
-  if val.bits.oe == 0 and val.bits.rc == 1:
-    key = 'add.'
-  elif val.bits.oe == 1 and val.bits.rc == 0:
-    key = 'addo'
-  elif val.bits.oe == 1 and val.bits.rc == 1:
-    key = 'addo.'
-    
-  print(f'{key} r{val.bits.rt}, r{val.bits.ra}, r{val.bits.rb}')
-  return IterReason.IterOk
-
-def mfspr(data, vm: VirtualMachine, bundle: Bundle31) -> IterReason:
-  val = Mfspr()
-  val.value = int.from_bytes(data, 'big')
-  
-  match (((val.bits.spr >> 5) & 0x1F) | (val.bits.spr & 0x1F)):
-    case 1: # xer
-      vm.context.gpr[val.bits.rt] = vm.context.xer.value
-      print(f'mfxer r{val.bits.rt}')
-    case 8: # lr
-      vm.context.gpr[val.bits.rt] = vm.context.lr
-      print(f'mflr r{val.bits.rt}')
-    case 9: # ctr
-      vm.context.gpr[val.bits.rt] = vm.context.ctr
-      print(f'mfctr r{val.bits.rt}')
-  
-  return IterReason.IterOk
-
-def mtspr(data, vm: VirtualMachine, bundle: Bundle31) -> IterReason:
-  val = Mtspr()
-  val.value = int.from_bytes(data, 'big')
-  
-  match (((val.bits.spr >> 5) & 0x1F) | (val.bits.spr & 0x1F)):
-    case 1: # xer
-      vm.context.xer.value = vm.context.gpr[val.bits.rt]
-      print(f'mtxer r{val.bits.rt}')
-    case 8: # lr
-      vm.context.lr = vm.context.gpr[val.bits.rt]
-      print(f'mtlr r{val.bits.rt}')
-    case 9: # ctr
-      vm.context.ctr = vm.context.gpr[val.bits.rt]
-      print(f'mtctr r{val.bits.rt}')
-  
-  return IterReason.IterOk
-
-def bclr(data, vm: VirtualMachine, bundle: Bundle19) -> IterReason:
-  if bundle.bits.bo & 0b10100:
-    print('blr')
-    
-    if vm.context.lr == 0:
-      return IterReason.IterReturn
-    
-    vm.context.iar = vm.context.lr
-    return IterReason.IterContinue
-  return IterReason.IterOk
-
-def bundle_31(data, vm: VirtualMachine) -> IterReason:
-  val = Bundle31()
-  val.value = int.from_bytes(data, 'big')
-  
-  match val.bits.sub:
-    case 0:
-      return cmp(data, vm, val)
-    case 32:
-      return cmpl(data, vm, val)
-    case 444:
-      return or_mr(data, vm, val)
-    case 266:
-      return add(data, vm, val)
-    case 339:
-      return mfspr(data, vm, val)
-    case 467:
-      return mtspr(data, vm, val)
-  
-  return IterReason.IterOk
-
-def bundle_19(data, vm: VirtualMachine) -> IterReason:
-  val = Bundle19()
-  val.value = int.from_bytes(data, 'big')
-  
-  print(val.bits.sub)
-  
-  match val.bits.sub:
-    case 16:
-      return bclr(data, vm, val)
-  
-  return IterReason.IterOk
-
-HANDLER_TABLE = {
-  10: cmpli,
-  11: cmpi,
-  14: li,
-  15: lis,
-  16: bc,
-  17: sc,
-  18: b,
-  19: bundle_19,
-  31: bundle_31,
-  32: lwz,
-  36: stw,
-  37: stwu,
-  38: stb,
-}
\ No newline at end of file
+from typing import Dict
+import inspect
+import struct
+import numpy as np
+import time
+from registers import *
+from xex import XEX, SECTION_CODE, SECTION_DATA, SECTION_READONLY
+from instructions import *
+from enum import Enum, unique, auto
+from tracing import Tracer, Category
+from memory import *
+from hle import Kernel
+from cover import EDGE_MASK
+
+STACK_BASE = 0x70000000
+STACK_SIZE = 0x10000
+HEAP_BASE = 0x40000000
+HEAP_SIZE = 0x20000000
+NO_LIMIT = 1 << 63
+# instructions run between wall clock checks when a run has a time limit
+TIME_SLICE = 0x4000
+# plain int: masking with the IntFlag member builds a new enum object per access
+TRACE_MEM = int(Category.MEM)
+
+SECTION_PERMS = {
+  SECTION_CODE: PAGE_READ | PAGE_EXEC,
+  SECTION_DATA: PAGE_RW,
+  SECTION_READONLY: PAGE_READ,
+}
+
+def u16_to_s16(value):
+  value &= 0xFFFF
+  if value & 0x8000:
+    return value - 0x10000
+  return value
+
+def u24_to_s24(value):
+  value &= 0xFFFFFF
+  if value & 0x800000:
+    return value - 0x1000000
+  return value
+
+def u32_to_s32(value):
+  value &= 0xFFFFFFFF
+  if value & 0x80000000:
+    return value - 0x100000000
+  return value
+
+def u64_to_s64(value):
+  value &= 0xFFFFFFFFFFFFFFFF
+  if value & 0x8000000000000000:
+    return value - 0x10000000000000000
+  return value
+
+def pyint_to_u32(value):
+  return value & 0xFFFFFFFF
+
+def pyint_to_u64(value):
+  return value & 0xFFFFFFFFFFFFFFFF
+
+def compare_field(a, b, xer):
+  # cr field nibble for a compare of a against b
+  field = CR_LT if a < b else CR_GT if a > b else CR_EQ
+  return field | CR_SO if xer & XER_SO else field
+
+def format_offset(value):
+  return f"{'' if value > 0 else '-'}{hex(abs(value))}"
+
+def format_write(address, off, byte_value, register):
+  val = ' '.join([hex(a)[2:] for a in byte_value])
+  return f'[Write] {hex(address)} + {hex(off)}({hex(address + off)}) = {val}, reg {register}'
+
+def format_read(address, off, size, register):
+  return f'[Read] {hex(address)} + {hex(off)}({hex(address + off)}) for {size} bytes, reg {register}'
+
+def format_load(address, size, register):
+  return f'[Read] {hex(address)} for {size} bytes, reg {register}'
+
+def format_store(address, size, value, register):
+  value &= (1 << (size * 8)) - 1
+  return f'[Write] {hex(address)} = {value:0{size * 2}x}, reg {register}'
+
+@unique
+class IterReason(Enum):
+  IterOk = 0,
+  IterContinue = auto(),
+  IterReturn = auto(),
+  IterPause = auto() # stop the run with iar left where it should resume
+
+@unique
+class StopReason(Enum):
+  Returned = 0, # blr to lr == 0, back to the host
+  Budget = auto(),
+  Timeout = auto(),
+  Address = auto(), # run_until() reached its address
+  Paused = auto(), # a handler returned IterPause
+  Fault = auto() # undecodable instruction or access violation, see vm.fault
+
+def breakpoint_handler(val, vm) -> IterReason:
+  # planted in the decode cache by run_until(); never part of the guest code
+  return IterReason.IterPause
+
+BREAKPOINT = (breakpoint_handler, None)
+
+class Native:
+  # python replacement for the guest function at `address`: called with the
+  # vm and one argument register per parameter, its result goes to r3
+  __slots__ = ('address', 'name', 'function', 'argc')
+  
+  def __init__(self, address, name, function) -> None:
+    self.address = address
+    self.name = name
+    self.function = function
+    self.argc = len(inspect.signature(function).parameters) - 1
+
+def native_call(val: Native, vm) -> IterReason:
+  # stands in for the first instruction of a hooked function and returns
+  # through lr like its blr would
+  gpr = vm.context.gpr
+  result = val.function(vm, *[value & 0xFFFFFFFF for value in gpr[3:3+val.argc]])
+  if result is not None:
+    gpr[3] = result & 0xFFFFFFFFFFFFFFFF
+  
+  target = vm.context.lr
+  if target == 0:
+    return IterReason.IterReturn
+  vm.context.iar = target
+  return IterReason.IterContinue
+
+class DecodeCache:
+  # decoded (handler, fields) per code offset, valid until that word is written
+  def __init__(self) -> None:
+    self.entries = {}
+    self.hits = 0
+    self.misses = 0
+  
+  def invalidate(self, offset, size):
+    for word in range(offset & ~3, offset + size, 4):
+      self.entries.pop(word, None)
+  
+  def clear(self):
+    self.entries.clear()
+  
+  def __len__(self):
+    return len(self.entries)
+  
+class Snapshot:
+  __slots__ = ('context', 'memory', 'instructions', 'kernel')
+  
+  def __init__(self, context, memory, instructions, kernel=None) -> None:
+    self.context = context
+    self.memory = memory
+    self.instructions = instructions
+    self.kernel = kernel
+  
+class VirtualMachine:
+  def __init__(self, xex: XEX) -> None:
+    self.context = Registers()
+    self.memory = AddressSpace()
+    self.memory.map(STACK_BASE, STACK_SIZE, PAGE_RW)
+    self.memory.map(HEAP_BASE, HEAP_SIZE, PAGE_RW)
+    self.memory.on_code_write = self.invalidate_code
+    self.xex = xex
+    self.decode_cache = DecodeCache()
+    self.translator = None
+    self.tracer = Tracer()
+    self.profiler = None
+    self.recorder = None
+    self.coverage = None # Coverage filled by interpret_covered
+    self.kernel = None
+    self.fault = None # why the last run stopped with StopReason.Fault
+    self.dispatch = DISPATCH
+    self.instructions = 0 # guest instructions executed, updated when a run stops
+    self.hooks = {} # guest address -> Native
+    self.symbols = None # SymbolMap, see use_symbols
+    self.predecode = None # Predecoded table of the image's code, from a cache next to the xex
+    self.fusion = True # interpret() runs common instruction pairs as one handler
+    self.fused_cache = DecodeCache()
+    self.fused = 0 # pairs run fused, on top of the entries interpret() counts
+    self.fusions = [0] * len(FUSION_NAMES)
+    self.breakpoint = None # (address, entry it replaced) while run_until() runs
+    self.block_ran = 0 # instructions run by a translated block that paused part-way
+    
+    if xex is not None and xex.image is not None:
+      self.load_xex(xex)
+    pass
+  
+  def load(self, image, address, perms=PAGE_RWX):
+    self.memory.map(address, len(image), perms, image)
+  
+  def load_xex(self, xex: XEX):
+    # nothing is read from the file here, pages fill in as the guest touches them
+    if not xex.sections:
+      self.load(xex.image, xex.base_address)
+    
+    runs = []
+    for section in xex.sections:
+      if runs and runs[-1][2] == section.kind:
+        runs[-1][1] += section.size
+      else:
+        runs.append([section.address, section.size, section.kind])
+    
+    for address, size, kind in runs:
+      self.memory.map(address, size, SECTION_PERMS.get(kind, PAGE_READ), xex.image, address - xex.base_address)
+    
+    if xex.path is not None:
+      from predecode import load_predecoded
+      self.predecode = load_predecoded(xex)
+    
+    if xex.libraries:
+      self.kernel = Kernel(self, HEAP_BASE, HEAP_SIZE)
+      self.kernel.install(xex)
+    
+    self.context.iar = xex.entry_point // 4
+  
+  def write(self, address, off, byte_value, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address + off, Category.MEM, format_write, address, off, byte_value, register)
+    self.memory.write((address + off) & ADDRESS_MASK, byte_value)
+  
+  def read(self, address, off, size, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address + off, Category.MEM, format_read, address, off, size, register)
+    return self.memory.read((address + off) & ADDRESS_MASK, size)
+  
+  # typed big-endian accessors on top of AddressSpace.load_*/store_*, with
+  # the same MEM tracing as read/write
+  def load_u8(self, address, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_load, address, 1, register)
+    return self.memory.load_u8(address)
+  
+  def load_u16(self, address, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_load, address, 2, register)
+    return self.memory.load_u16(address)
+  
+  def load_s16(self, address, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_load, address, 2, register)
+    return self.memory.load_s16(address)
+  
+  def load_u32(self, address, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_load, address, 4, register)
+    return self.memory.load_u32(address)
+  
+  def load_s32(self, address, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_load, address, 4, register)
+    return self.memory.load_s32(address)
+  
+  def load_u64(self, address, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_load, address, 8, register)
+    return self.memory.load_u64(address)
+  
+  def store_u8(self, address, value, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_store, address, 1, value, register)
+    self.memory.store_u8(address, value)
+  
+  def store_u16(self, address, value, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_store, address, 2, value, register)
+    self.memory.store_u16(address, value)
+  
+  def store_u32(self, address, value, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_store, address, 4, value, register)
+    self.memory.store_u32(address, value)
+  
+  def store_u64(self, address, value, register=None):
+    if self.tracer.mask & TRACE_MEM:
+      self.tracer.emit_at(address, Category.MEM, format_store, address, 8, value, register)
+    self.memory.store_u64(address, value)
+  
+  def branch_to(self, src, dst):
+    inst = Bx()
+    inst.bits.opcode = 18
+    inst.bits.ll = (dst - src) // 4
+    
+    self.memory.write(src, struct.pack('>I', inst.value), force=True)
+    pass
+  
+  def snapshot(self):
+    kernel = self.kernel.save() if self.kernel is not None else None
+    return Snapshot(self.context.copy(), self.memory.snapshot(), self.instructions, kernel)
+  
+  def restore(self, snapshot: Snapshot):
+    # pages written since the snapshot go back (code pages drop their decoded
+    # and translated copies through on_code_write), everything else is kept
+    self.context.load(snapshot.context)
+    self.memory.restore(snapshot.memory)
+    self.instructions = snapshot.instructions
+    if snapshot.kernel is not None:
+      self.kernel.load(snapshot.kernel)
+  
+  @property
+  def lazy_flags(self):
+    return self.dispatch is LAZY_DISPATCH
+  
+  @lazy_flags.setter
+  def lazy_flags(self, enabled):
+    # decoded entries hold handlers, so switching drops everything decoded
+    self.context.flush()
+    self.dispatch = LAZY_DISPATCH if enabled else DISPATCH
+    self.decode_cache.clear()
+    self.fused_cache.clear()
+    if self.translator is not None:
+      self.translator.clear()
+  
+  def invalidate_code(self, offset, size):
+    self.decode_cache.invalidate(offset, size)
+    if self.breakpoint is not None and offset <= self.breakpoint[0] < offset + size:
+      # the guest rewrote the word under the breakpoint: keep it armed, and
+      # the entry it replaced no longer matches memory
+      self.breakpoint = (self.breakpoint[0], None)
+      self.decode_cache.entries[self.breakpoint[0]] = BREAKPOINT
+    # a fused pair starting one word earlier covers the written word too
+    self.fused_cache.invalidate(offset - 4, size + 4)
+    if self.predecode is not None:
+      self.predecode.invalidate(offset, size)
+    if self.translator is not None:
+      self.translator.invalidate(offset, size)
+    if self.recorder is not None:
+      self.recorder.invalidate(offset, size)
+  
+  def hook(self, address, function, name=None):
+    # from now on a call to `address` runs `function` instead of guest code
+    address &= ADDRESS_MASK
+    native = self.hooks[address] = Native(address, name or function.__name__, function)
+    self.invalidate_code(address, 4)
+    return native
+  
+  def unhook(self, address):
+    address &= ADDRESS_MASK
+    if self.hooks.pop(address, None) is not None:
+      self.invalidate_code(address, 4)
+  
+  def decode_at(self, offset):
+    entry = self.decode_cache.entries.get(offset)
+    if entry is None:
+      native = self.hooks.get(offset)
+      if native is not None:
+        entry = self.decode_cache.entries[offset] = (native_call, native)
+        return entry
+      if self.predecode is not None:
+        entry = self.predecode.lookup(self, offset)
+      if entry is None:
+        try:
+          entry = decode(int.from_bytes(self.memory.fetch(offset), 'big'), self.dispatch)
+        except AccessViolation:
+          return None
+      if entry is not None:
+        self.decode_cache.misses += 1
+        self.decode_cache.entries[offset] = entry
+    else:
+      self.decode_cache.hits += 1
+    return entry
+  
+  def decode_fused(self, offset):
+    # the entry at offset, or one fused with the next word's when they form a
+    # known pair; the next word keeps its own entry for branches landing there
+    entry = self.decode_at(offset)
+    if entry is None:
+      return None
+    fuse = FUSIONS.get(entry[0])
+    if fuse is not None:
+      second = self.decode_at(offset + 4)
+      if second is not None:
+        entry = fuse(entry[1], second, offset) or entry
+    self.fused_cache.entries[offset] = entry
+    return entry
+  
+  def fusion_counts(self):
+    # pattern -> times run fused
+    return dict(zip(FUSION_NAMES, self.fusions))
+  
+  def use_symbols(self, symbols):
+    # names addresses in fault texts, trace records and the profiler's report
+    self.symbols = symbols
+    self.tracer.symbols = symbols
+    if self.profiler is not None:
+      self.profiler.symbols = symbols
+  
+  def fault_text(self, text, address=None):
+    if self.symbols is None:
+      return text
+    if address is None:
+      address = (self.context.iar * 4) & ADDRESS_MASK
+    return f'{text} in {self.symbols.symbolize(address)}'
+  
+  def report_undecodable(self, offset):
+    try:
+      value = int.from_bytes(self.memory.fetch(offset), 'big')
+    except AccessViolation as e:
+      self.fault = self.fault_text(str(e), offset)
+      self.tracer.error(self.fault)
+      return
+    opcode = value >> 26
+    if opcode in (19, 31):
+      opcode = f'{opcode}/{(value >> 1) & 0x3FF}'
+    self.fault = self.fault_text(f'opcode {opcode} not setup', offset)
+    self.tracer.error(self.fault)
+  
+  def execute(self, max_instructions=None, max_seconds=None, gpr=None):
+    # fresh, lazily zeroed stack on every run. gpr maps register numbers to
+    # initial values and is applied after the default r1, so it can replace it
+    self.memory.discard(STACK_BASE, STACK_SIZE)
+    self.context.gpr[1] = STACK_BASE + STACK_SIZE // 2
+    for number, value in (gpr or {}).items():
+      self.context.gpr[number] = value & 0xFFFFFFFFFFFFFFFF
+    return self.run(max_instructions, max_seconds)
+  
+  def run(self, max_instructions=None, max_seconds=None):
+    # resumes from the current state. Limits are checked on taken branches, so
+    # a run may overshoot max_instructions by up to one block
+    limit = NO_LIMIT if max_instructions is None else max_instructions
+    if max_seconds is None:
+      return self.run_engine(limit)
+    
+    deadline = time.perf_counter() + max_seconds
+    while True:
+      start = self.instructions
+      reason = self.run_engine(min(limit, TIME_SLICE))
+      limit -= self.instructions - start
+      if reason is not StopReason.Budget:
+        return reason
+      if limit <= 0:
+        return StopReason.Budget
+      if time.perf_counter() >= deadline:
+        return StopReason.Timeout
+  
+  def run_engine(self, limit):
+    self.fault = None
+    try:
+      if self.tracer.active:
+        return self.interpret_traced(limit)
+      elif self.recorder is not None:
+        return self.interpret_recorded(limit)
+      elif self.profiler is not None:
+        return self.interpret_profiled(limit)
+      elif self.coverage is not None:
+        return self.interpret_covered(limit)
+      elif self.translator is not None and self.breakpoint is None:
+        return self.execute_blocks(limit)
+      else:
+        return self.interpret(limit)
+    except AccessViolation as e:
+      self.fault = self.fault_text(str(e))
+      return StopReason.Fault
+  
+  def step(self, count=1):
+    # exactly `count` instructions, one at a time, tracer included
+    tracer = self.tracer
+    for _ in range(count):
+      iar = (self.context.iar * 4) & ADDRESS_MASK
+      entry = self.decode_at(iar)
+      if entry is None:
+        self.report_undecodable(iar)
+        return StopReason.Fault
+      
+      handler, val = entry
+      self.instructions += 1
+      try:
+        reason = handler(val, self)
+      except AccessViolation as e:
+        self.instructions -= 1
+        self.fault = self.fault_text(str(e))
+        return StopReason.Fault
+      
+      category, formatter = FORMATTERS[handler]
+      if tracer.mask & category:
+        tracer.emit_at(iar, category, formatter, val, self)
+      
+      match reason:
+        case IterReason.IterContinue:
+          continue
+        case IterReason.IterReturn:
+          return StopReason.Returned
+        case IterReason.IterPause:
+          return StopReason.Paused
+      
+      self.context.iar += 1
+    return StopReason.Budget
+  
+  def run_until(self, address, max_instructions=None, max_seconds=None):
+    # a breakpoint entry in the decode cache stops the interpreter there, so
+    # no other instruction pays for the check; translated blocks are skipped
+    # but still see code writes
+    address &= ADDRESS_MASK
+    if (self.context.iar * 4) & ADDRESS_MASK == address:
+      reason = self.step()
+      if reason is not StopReason.Budget:
+        return reason
+      if max_instructions is not None:
+        max_instructions -= 1
+    
+    entries = self.decode_cache.entries
+    self.breakpoint = (address, entries.get(address))
+    entries[address] = BREAKPOINT
+    fusion, self.fusion = self.fusion, False
+    try:
+      reason = self.run(max_instructions, max_seconds)
+    finally:
+      self.fusion = fusion
+      saved = self.breakpoint[1]
+      self.breakpoint = None
+      # anything but the breakpoint there was decoded from memory during the run
+      if entries.get(address) is BREAKPOINT:
+        if saved is None:
+          del entries[address]
+        else:
+          entries[address] = saved
+    
+    if reason is StopReason.Paused and (self.context.iar * 4) & ADDRESS_MASK == address:
+      # the breakpoint itself was counted as an instruction
+      self.instructions -= 1
+      return StopReason.Address
+    return reason
+  
+  def execute_blocks(self, limit=NO_LIMIT):
+    blocks = self.translator.blocks
+    executed = 0
+    
+    try:
+      while True:
+        iar = (self.context.iar * 4) & ADDRESS_MASK
+        block = blocks.get(iar)
+        
+        if block is None:
+          block = self.translator.translate(iar)
+          if block is None:
+            self.report_undecodable(iar)
+            return StopReason.Fault
+        
+        start = self.context.iar
+        try:
+          reason = block(self)
+        except AccessViolation:
+          # inlined loads and stores keep iar on the faulting instruction,
+          # which like in the interpreters does not count
+          executed += self.context.iar - start
+          raise
+        
+        match reason:
+          case IterReason.IterContinue:
+            executed += block.length
+            if executed >= limit:
+              return StopReason.Budget
+            continue
+          case IterReason.IterReturn:
+            executed += block.length
+            return StopReason.Returned
+          case IterReason.IterPause:
+            # a handler inside the block leaves its count in block_ran
+            executed += self.block_ran or block.length
+            self.block_ran = 0
+            return StopReason.Paused
+        
+        executed += block.length
+        self.context.iar += 1
+    finally:
+      self.instructions += executed
+  
+  def interpret(self, limit=NO_LIMIT):
+    # fused entries count once in `executed`, their second instruction
+    # goes to self.fused
+    if self.fusion:
+      cache, decode = self.fused_cache, self.decode_fused
+    else:
+      cache, decode = self.decode_cache, self.decode_at
+    entries = cache.entries
+    executed = 0
+    missed = 0
+    fused = self.fused
+    
+    try:
+      while True:
+        iar = (self.context.iar * 4) & ADDRESS_MASK
+        entry = entries.get(iar)
+        
+        if entry is None:
+          missed += 1
+          entry = decode(iar)
+          if entry is None:
+            self.report_undecodable(iar)
+            return StopReason.Fault
+        
+        executed += 1
+        match entry[0](entry[1], self):
+          case IterReason.IterContinue:
+            if executed + self.fused - fused >= limit:
+              return StopReason.Budget
+            continue
+          case IterReason.IterReturn:
+            return StopReason.Returned
+          case IterReason.IterPause:
+            return StopReason.Paused
+        
+        self.context.iar += 1
+    except AccessViolation:
+      # the faulting instruction did not complete
+      executed -= 1
+      raise
+    finally:
+      cache.hits += executed - missed
+      self.instructions += executed + self.fused - fused
+  
+  def interpret_covered(self, limit=NO_LIMIT):
+    # same loop as interpret(), recording each straight run of instructions
+    # when the branch that ends it is taken and counting the edge into the
+    # block it lands in
+    coverage = self.coverage
+    spans = coverage.spans
+    edges = coverage.edges
+    previous = coverage.previous
+    if self.fusion:
+      cache, decode = self.fused_cache, self.decode_fused
+    else:
+      cache, decode = self.decode_cache, self.decode_at
+    entries = cache.entries
+    executed = 0
+    missed = 0
+    fused = self.fused
+    iar = start = (self.context.iar * 4) & ADDRESS_MASK
+    
+    try:
+      while True:
+        iar = (self.context.iar * 4) & ADDRESS_MASK
+        entry = entries.get(iar)
+        
+        if entry is None:
+          missed += 1
+          entry = decode(iar)
+          if entry is None:
+            self.report_undecodable(iar)
+            iar -= 4 # never ran
+            return StopReason.Fault
+        
+        executed += 1
+        match entry[0](entry[1], self):
+          case IterReason.IterContinue:
+            # a fused compare and branch has its branch in the second word
+            spans.add(start << 32 | (iar + 4 if entry[0] in FUSED_BRANCHES else iar))
+            start = (self.context.iar * 4) & ADDRESS_MASK
+            location = ((start >> 2) ^ (start >> 18)) & EDGE_MASK
+            edge = location ^ previous
+            if edges[edge] != 255:
+              edges[edge] += 1
+            previous = location >> 1
+            if executed + self.fused - fused >= limit:
+              start = None # nothing ran past the branch
+              return StopReason.Budget
+            continue
+          case IterReason.IterReturn:
+            return StopReason.Returned
+          case IterReason.IterPause:
+            return StopReason.Paused
+        
+        self.context.iar += 1
+    except AccessViolation:
+      executed -= 1
+      raise
+    finally:
+      # the run the loop stopped in
+      if start is not None:
+        spans.add(start << 32 | iar)
+      coverage.previous = previous
+      cache.hits += executed - missed
+      self.instructions += executed + self.fused - fused
+  
+  def interpret_profiled(self, limit=NO_LIMIT):
+    # same loop as interpret(), feeding the profiler; interpret() itself has no hooks
+    profiler = self.profiler
+    counts = profiler.counts
+    leaders = profiler.leaders
+    jumped = False
+    stop = self.instructions + limit
+    profiler.begin((self.context.iar * 4) & ADDRESS_MASK)
+    
+    try:
+      while True:
+        iar = (self.context.iar * 4) & ADDRESS_MASK
+        entry = self.decode_at(iar)
+        if entry is None:
+          self.report_undecodable(iar)
+          return StopReason.Fault
+        
+        count = counts.get(iar)
+        if count is None:
+          profiler.words[iar] = int.from_bytes(self.memory.fetch(iar), 'big')
+          count = 0
+        counts[iar] = count + 1
+        if jumped:
+          leaders.add(iar)
+        self.instructions += 1
+        
+        handler, val = entry
+        reason = handler(val, self)
+        
+        match reason:
+          case IterReason.IterContinue:
+            jumped = True
+            if handler in LINKING_BRANCHES:
+              if val.lk:
+                profiler.call((self.context.iar * 4) & ADDRESS_MASK)
+              elif handler is bclr:
+                profiler.ret()
+            elif handler is native_call:
+              profiler.ret()
+            if self.instructions >= stop:
+              return StopReason.Budget
+            continue
+          case IterReason.IterReturn:
+            return StopReason.Returned
+          case IterReason.IterPause:
+            return StopReason.Paused
+        
+        jumped = False
+        self.context.iar += 1
+    except AccessViolation:
+      self.instructions -= 1
+      raise
+    finally:
+      profiler.end()
+  
+  def interpret_recorded(self, limit=NO_LIMIT):
+    # same loop as interpret(), handing the recorder every instruction and the
+    # registers it changed; memory writes reach it through memory.on_write
+    recorder = self.recorder
+    context = self.context
+    entries = self.decode_cache.entries
+    stop = self.instructions + limit
+    
+    while True:
+      iar = (context.iar * 4) & ADDRESS_MASK
+      entry = entries.get(iar)
+      if entry is None:
+        entry = self.decode_at(iar)
+        if entry is None:
+          self.report_undecodable(iar)
+          return StopReason.Fault
+      
+      recorder.step(iar)
+      self.instructions += 1
+      gpr = context.gpr
+      before = gpr[:]
+      # with lazy flags cr and xer are stale until resolved, so read them
+      # through the getters to record the same values as an eager run
+      special = (context.lr, context.ctr, context.get_cr(), context.get_xer())
+      
+      handler, val = entry
+      try:
+        reason = handler(val, self)
+      except AccessViolation:
+        self.instructions -= 1
+        raise
+      
+      if gpr != before:
+        recorder.changed(gpr, before)
+      if special != (context.lr, context.ctr, context.get_cr(), context.get_xer()):
+        recorder.changed_special(context, ((special[0] * 4) & ADDRESS_MASK,) + special[1:])
+      
+      match reason:
+        case IterReason.IterContinue:
+          if self.instructions >= stop:
+            return StopReason.Budget
+          continue
+        case IterReason.IterReturn:
+          return StopReason.Returned
+        case IterReason.IterPause:
+          return StopReason.Paused
+      
+      context.iar += 1
+  
+  def interpret_traced(self, limit=NO_LIMIT):
+    # same loop as interpret(), but every instruction goes through the tracer
+    tracer = self.tracer
+    history = tracer.history
+    stop = self.instructions + limit
+    
+    try:
+      while True:
+        iar = (self.context.iar * 4) & ADDRESS_MASK
+        entry = self.decode_at(iar)
+        if entry is None:
+          self.report_undecodable(iar)
+          return StopReason.Fault
+        
+        if history is not None:
+          history.append((iar, entry))
+        self.instructions += 1
+        
+        handler, val = entry
+        reason = handler(val, self)
+        
+        category, formatter = FORMATTERS[handler]
+        if tracer.mask & category:
+          tracer.emit_at(iar, category, formatter, val, self)
+        
+        match reason:
+          case IterReason.IterContinue:
+            if self.instructions >= stop:
+              return StopReason.Budget
+            continue
+          case IterReason.IterReturn:
+            return StopReason.Returned
+          case IterReason.IterPause:
+            return StopReason.Paused
+        
+        self.context.iar += 1
+    except Exception as e:
+      if isinstance(e, AccessViolation):
+        self.instructions -= 1
+      if history is not None:
+        tracer.error('last executed instructions:')
+        tracer.dump()
+      raise
+
+def cmpi(val, vm: VirtualMachine) -> IterReason:
+  ra = 0
+  ds = 0
+  
+  if val.l:
+    ra = u64_to_s64(vm.context.gpr[val.ra])
+  else:
+    ra = u32_to_s32(vm.context.gpr[val.ra])
+  ds = u16_to_s16(val.ds)
+    
+  vm.context.set_cr_field(val.crfd, compare_field(ra, ds, vm.context.xer))
+  
+  return IterReason.IterOk
+
+def fmt_cmpi(val, vm):
+  tag = 'cmpdi' if val.l else 'cmpwi'
+  return f'{tag} cr{val.crfd}, r{val.ra}, {hex(val.ds)}'
+
+def cmpli(val, vm: VirtualMachine) -> IterReason:
+  ra = 0
+  ds = 0
+  
+  if val.l:
+    ra = pyint_to_u64(vm.context.gpr[val.ra])
+    ds = pyint_to_u64(val.ds)
+  else:
+    ra = pyint_to_u32(vm.context.gpr[val.ra])
+    ds = pyint_to_u32(val.ds)
+    
+  vm.context.set_cr_field(val.crfd, compare_field(ra, ds, vm.context.xer))
+  
+  return IterReason.IterOk
+
+def fmt_cmpli(val, vm):
+  tag = 'cmpldi' if val.l else 'cmplwi'
+  return f'{tag} cr{val.crfd}, r{val.ra}, {hex(val.ds)}'
+
+def li(val, vm: VirtualMachine) -> IterReason:
+  si = u16_to_s16(val.si)
+  output = si if val.ra == 0 else (vm.context.gpr[val.ra | 0] + si)
+  vm.context.gpr[val.rt] = pyint_to_u32(output)
+  return IterReason.IterOk
+
+def fmt_li(val, vm):
+  if val.ra == 0:
+    return f'li r{val.rt}, {hex(u16_to_s16(val.si))}'
+  return f'addi r{val.rt}, r{val.ra | 0}, {hex(u16_to_s16(val.si))}'
+
+def lis(val, vm: VirtualMachine) -> IterReason:
+  si = u16_to_s16(val.si) << 16
+  output = si if val.ra == 0 else (vm.context.gpr[val.ra] + si)
+  vm.context.gpr[val.rt] = pyint_to_u32(output)
+  return IterReason.IterOk
+
+def fmt_lis(val, vm):
+  if val.ra == 0:
+    return f'lis r{val.rt}, {hex(val.si)}'
+  return f'addis r{val.rt}, r{val.ra | 0}, {hex(val.si)}'
+
+def sc(val, vm: VirtualMachine) -> IterReason:
+  # import thunks are `sc; blr`, the kernel runs the call and blr returns
+  kernel = vm.kernel
+  if kernel is not None:
+    kernel.syscall()
+    if kernel.blocked:
+      # the call put the thread to sleep: it resumes at the blr, but the
+      # scheduler gets control now
+      kernel.blocked = False
+      vm.context.iar += 1
+      return IterReason.IterPause
+  return IterReason.IterOk
+
+def fmt_sc(val, vm):
+  if vm is not None and vm.kernel is not None:
+    entry = vm.kernel.thunks.get((vm.context.iar * 4) & ADDRESS_MASK)
+    if entry is not None:
+      # formatted after the call ran, so r3 already holds the result
+      return f'sc -> {entry.name} = {hex(vm.context.gpr[3])}'
+  if val.lev == 2 and vm is not None:
+    return f'TODO: Syscall with index {hex(vm.context.gpr[0])}'
+  return f'sc {val.lev}'
+
+# loads and stores. D-forms address (ra|0) + EXTS(d), the update forms write
+# the address back to ra, X-forms use (ra|0) + rb
+
+def d_address(val, gpr):
+  d = (val.ds ^ 0x8000) - 0x8000
+  return ((gpr[val.ra] + d) if val.ra else d) & ADDRESS_MASK
+
+def ds_address(val, gpr):
+  d = ((val.ds << 2) ^ 0x8000) - 0x8000
+  return ((gpr[val.ra] + d) if val.ra else d) & ADDRESS_MASK
+
+def x_address(val, gpr):
+  return ((gpr[val.ra] if val.ra else 0) + gpr[val.rb]) & ADDRESS_MASK
+
+def lwz(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u32(d_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def lwzu(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = d_address(val, gpr)
+  gpr[val.rt] = vm.load_u32(address, val.ra)
+  return IterReason.IterOk
+
+def lbz(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u8(d_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def lbzu(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = d_address(val, gpr)
+  gpr[val.rt] = vm.load_u8(address, val.ra)
+  return IterReason.IterOk
+
+def lhz(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u16(d_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def lhzu(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = d_address(val, gpr)
+  gpr[val.rt] = vm.load_u16(address, val.ra)
+  return IterReason.IterOk
+
+def lha(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = pyint_to_u64(vm.load_s16(d_address(val, gpr), val.ra))
+  return IterReason.IterOk
+
+def lhau(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = d_address(val, gpr)
+  gpr[val.rt] = pyint_to_u64(vm.load_s16(address, val.ra))
+  return IterReason.IterOk
+
+def stw(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u32(d_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def stwu(val, vm: VirtualMachine) -> IterReason:
+  # stwu r1, -n(r1) stores the old stack pointer: read rs before ra moves
+  gpr = vm.context.gpr
+  address = d_address(val, gpr)
+  vm.store_u32(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+def stb(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u8(d_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def stbu(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = d_address(val, gpr)
+  vm.store_u8(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+def sth(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u16(d_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def sthu(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = d_address(val, gpr)
+  vm.store_u16(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+def ld(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u64(ds_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def ldu(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = ds_address(val, gpr)
+  gpr[val.rt] = vm.load_u64(address, val.ra)
+  return IterReason.IterOk
+
+def lwa(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = pyint_to_u64(vm.load_s32(ds_address(val, gpr), val.ra))
+  return IterReason.IterOk
+
+def std(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u64(ds_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def stdu(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = ds_address(val, gpr)
+  vm.store_u64(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+def lwzx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u32(x_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def lwzux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = x_address(val, gpr)
+  gpr[val.rt] = vm.load_u32(address, val.ra)
+  return IterReason.IterOk
+
+def lbzx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u8(x_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def lbzux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = x_address(val, gpr)
+  gpr[val.rt] = vm.load_u8(address, val.ra)
+  return IterReason.IterOk
+
+def lhzx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u16(x_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def lhzux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = x_address(val, gpr)
+  gpr[val.rt] = vm.load_u16(address, val.ra)
+  return IterReason.IterOk
+
+def lhax(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = pyint_to_u64(vm.load_s16(x_address(val, gpr), val.ra))
+  return IterReason.IterOk
+
+def lhaux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = x_address(val, gpr)
+  gpr[val.rt] = pyint_to_u64(vm.load_s16(address, val.ra))
+  return IterReason.IterOk
+
+def lwax(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = pyint_to_u64(vm.load_s32(x_address(val, gpr), val.ra))
+  return IterReason.IterOk
+
+def ldx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  gpr[val.rt] = vm.load_u64(x_address(val, gpr), val.ra)
+  return IterReason.IterOk
+
+def ldux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = gpr[val.ra] = x_address(val, gpr)
+  gpr[val.rt] = vm.load_u64(address, val.ra)
+  return IterReason.IterOk
+
+def stwx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u32(x_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def stwux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = x_address(val, gpr)
+  vm.store_u32(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+def stbx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u8(x_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def stbux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = x_address(val, gpr)
+  vm.store_u8(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+def sthx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u16(x_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def sthux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = x_address(val, gpr)
+  vm.store_u16(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+def stdx(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  vm.store_u64(x_address(val, gpr), gpr[val.rt], val.ra)
+  return IterReason.IterOk
+
+def stdux(val, vm: VirtualMachine) -> IterReason:
+  gpr = vm.context.gpr
+  address = x_address(val, gpr)
+  vm.store_u64(address, gpr[val.rt], val.ra)
+  gpr[val.ra] = address
+  return IterReason.IterOk
+
+# load and reserve / store conditional. Each thread holds at most one
+# reservation in its Registers; the scheduler drops it whenever it switches
+# threads, so a stwcx. only succeeds if no other thread ran since the lwarx
+def lwarx(val, vm: VirtualMachine) -> IterReason:
+  ctx = vm.context
+  address = x_address(val, ctx.gpr)
+  ctx.reserve = address & RESERVE_MASK
+  ctx.gpr[val.rt] = vm.load_u32(address, val.ra)
+  return IterReason.IterOk
+
+def ldarx(val, vm: VirtualMachine) -> IterReason:
+  ctx = vm.context
+  address = x_address(val, ctx.gpr)
+  ctx.reserve = address & RESERVE_MASK
+  ctx.gpr[val.rt] = vm.load_u64(address, val.ra)
+  return IterReason.IterOk
+
+def store_conditional(val, vm, store):
+  # cr0 is EQ when the store happened, SO copied from xer either way
+  ctx = vm.context
+  address = x_address(val, ctx.gpr)
+  field = CR_SO if ctx.get_xer() & XER_SO else 0
+  if ctx.reserve == address & RESERVE_MASK:
+    store(address, ctx.gpr[val.rt], val.ra)
+    field |= CR_EQ
+  ctx.reserve = None
+  ctx.set_cr_field(0, field)
+  return IterReason.IterOk
+
+def stwcx(val, vm: VirtualMachine) -> IterReason:
+  return store_conditional(val, vm, vm.store_u32)
+
+def stdcx(val, vm: VirtualMachine) -> IterReason:
+  return store_conditional(val, vm, vm.store_u64)
+
+def fmt_stwcx(val, vm):
+  return fmt_x_form('stwcx.', val)
+
+def fmt_stdcx(val, vm):
+  return fmt_x_form('stdcx.', val)
+
+def fmt_lwz(val, vm):
+  text = fmt_d_form('lwz', val)
+  if vm is not None:
+    text += f' -> {hex(vm.context.gpr[val.rt])}'
+  return text
+
+def fmt_stwu(val, vm):
+  return fmt_d_form('stwu', val)
+
+def fmt_stw(val, vm):
+  return fmt_d_form('stw', val)
+
+def fmt_stb(val, vm):
+  return fmt_d_form('stb', val)
+
+def fmt_d_form(name, val):
+  return f'{name} r{val.rt}, {format_offset((val.ds ^ 0x8000) - 0x8000)}(r{val.ra})'
+
+def fmt_ds_form(name, val):
+  return f'{name} r{val.rt}, {format_offset(((val.ds << 2) ^ 0x8000) - 0x8000)}(r{val.ra})'
+
+def fmt_x_form(name, val):
+  return f'{name} r{val.rt}, r{val.ra}, r{val.rb}'
+
+def memory_formatter(name, form):
+  def fmt_memory(val, vm):
+    return form(name, val)
+  return fmt_memory
+
+# text form of the remaining loads and stores, formatters built from these below
+MEMORY_FORMS = {
+  lwzu: fmt_d_form, lbz: fmt_d_form, lbzu: fmt_d_form, lhz: fmt_d_form,
+  lhzu: fmt_d_form, lha: fmt_d_form, lhau: fmt_d_form, stbu: fmt_d_form,
+  sth: fmt_d_form, sthu: fmt_d_form,
+  ld: fmt_ds_form, ldu: fmt_ds_form, lwa: fmt_ds_form, std: fmt_ds_form, stdu: fmt_ds_form,
+  lwzx: fmt_x_form, lwzux: fmt_x_form, lbzx: fmt_x_form, lbzux: fmt_x_form,
+  lhzx: fmt_x_form, lhzux: fmt_x_form, lhax: fmt_x_form, lhaux: fmt_x_form,
+  lwax: fmt_x_form, ldx: fmt_x_form, ldux: fmt_x_form, stwx: fmt_x_form,
+  stwux: fmt_x_form, stbx: fmt_x_form, stbux: fmt_x_form, sthx: fmt_x_form,
+  sthux: fmt_x_form, stdx: fmt_x_form, stdux: fmt_x_form, lwarx: fmt_x_form,
+  ldarx: fmt_x_form,
+}
+
+def b_target(val, address):
+  # byte address a b/bl at `address` lands on
+  offset = u24_to_s24(val.ll) << 2
+  return pyint_to_u32(offset if val.aa else address + offset)
+
+def bc_target(val, address):
+  offset = u16_to_s16(val.bd << 2)
+  return pyint_to_u32(offset if val.aa else address + offset)
+
+def branch_condition(bo, bi, context: Registers):
+  # BO/BI test shared by bc and bclr, decrementing ctr when BO asks for it
+  if not (bo & 0b00100):
+    context.ctr -= 1
+    if ((context.ctr & 0xFFFFFFFF) != 0) == bool(bo & 0b00010):
+      return False
+  
+  if bo & 0b10000:
+    return True
+  return context.get_cr_bit(bi) == ((bo >> 3) & 1)
+
+def b(val, vm: VirtualMachine) -> IterReason:
+  if val.lk:
+    vm.context.lr = vm.context.iar + 1
+  
+  vm.context.iar = b_target(val, vm.context.iar * 4) >> 2
+  return IterReason.IterContinue
+
+def fmt_b(val, vm):
+  key = 'b'
+  if val.aa == 1 and val.lk == 0:
+    key = 'ba'
+  elif val.aa == 0 and val.lk == 1:
+    key = 'bl'
+  elif val.aa == 1 and val.lk == 1:
+    key = 'bla'
+    
+  return f'{key} {hex(u24_to_s24(val.ll) * 4)}'
+
+def bc(val, vm: VirtualMachine) -> IterReason:
+  if not branch_condition(val.bo, val.bi, vm.context):
+    return IterReason.IterOk
+  
+  if val.lk:
+    vm.context.lr = vm.context.iar + 1
+  
+  vm.context.iar = bc_target(val, vm.context.iar * 4) >> 2
+  return IterReason.IterContinue
+
+BC_TRUE = ['blt', 'bgt', 'beq', 'bso']
+BC_FALSE = ['bge', 'ble', 'bne', 'bns']
+
+def bc_mnemonic(bo, bi):
+  if not (bo & 0b00100):
+    return 'bdz' if bo & 0b00010 else 'bdnz'
+  if bo & 0b10000:
+    return 'b'
+  return (BC_TRUE if bo & 0b01000 else BC_FALSE)[bi & 3]
+
+def fmt_bc(val, vm):
+  key = bc_mnemonic(val.bo, val.bi) + ('l' if val.lk else '')
+  return f'{key} cr{val.bi >> 2}, {format_offset(u16_to_s16(val.bd << 2))}'
+
+def or_mr(val, vm: VirtualMachine) -> IterReason:
+  vm.context.gpr[val.ra] = vm.context.gpr[val.rs] | vm.context.gpr[val.rb]
+  return IterReason.IterOk
+
+def fmt_or_mr(val, vm):
+  if val.rb == val.rs:
+    return f'mr r{val.ra}, r{val.rb}'
+  return f'or r{val.ra}, r{val.rs}, r{val.rb}'
+
+def cmp(val, vm: VirtualMachine) -> IterReason:
+  ra = 0
+  rb = 0
+  
+  if val.l:
+    ra = u64_to_s64(vm.context.gpr[val.ra])
+    rb = u64_to_s64(vm.context.gpr[val.rb])
+  else:
+    ra = u32_to_s32(vm.context.gpr[val.ra])
+    rb = u32_to_s32(vm.context.gpr[val.rb])
+    
+  vm.context.set_cr_field(val.crfd, compare_field(ra, rb, vm.context.xer))
+  return IterReason.IterOk
+
+def fmt_cmp(val, vm):
+  tag = 'cmpd' if val.l else 'cmpw'
+  ctrl = '.' if val.rc else ''
+  return f'{tag}{ctrl} cr{val.crfd}, r{val.ra}, r{val.rb}'
+
+def cmpl(val, vm: VirtualMachine) -> IterReason:
+  ra = 0
+  rb = 0
+  
+  if val.l:
+    ra = pyint_to_u64(vm.context.gpr[val.ra])
+    rb = pyint_to_u64(vm.context.gpr[val.rb])
+  else:
+    ra = pyint_to_u32(vm.context.gpr[val.ra])
+    rb = pyint_to_u32(vm.context.gpr[val.rb])
+    
+  vm.context.set_cr_field(val.crfd, compare_field(ra, rb, vm.context.xer))
+  return IterReason.IterOk
+
+def fmt_cmpl(val, vm):
+  tag = 'cmpld' if val.l else 'cmplw'
+  ctrl = '.' if val.rc else ''
+  return f'{tag}{ctrl} cr{val.crfd}, r{val.ra}, r{val.rb}'
+
+def add(val, vm: VirtualMachine) -> IterReason:
+  ra = pyint_to_u64(vm.context.gpr[val.ra])
+  rb = pyint_to_u64(vm.context.gpr[val.rb])
+  
+  vm.context.gpr[val.rt] = ra + rb
+
+  rt = pyint_to_u64(vm.context.gpr[val.rt])
+  
+  if val.oe:
+    if vm.context.lazy_xer is not None:
+      vm.context.resolve_xer()
+    if add_overflows(ra, rb, rt):
+      vm.context.xer |= XER_SO | XER_OV
+    else:
+      vm.context.xer &= ~XER_OV
+  
+  if val.rc:
+    if vm.context.gpr[val.rt] == 0:
+      field = CR_EQ
+    elif (vm.context.gpr[val.rt] & 0x80000000):
+      field = CR_LT
+    else:
+      field = CR_GT
+      
+    vm.context.set_cr_field(0, field | CR_SO if vm.context.xer & XER_SO else field)
+  
+  return IterReason.IterOk
+
+def fmt_add(val, vm):
+  key = 'add'
+  if val.oe == 0 and val.rc == 1:
+    key = 'add.'
+  elif val.oe == 1 and val.rc == 0:
+    key = 'addo'
+  elif val.oe == 1 and val.rc == 1:
+    key = 'addo.'
+    
+  return f'{key} r{val.rt}, r{val.ra}, r{val.rb}'
+
+# lazy-flag variants: they store the operands and leave the cr field or the
+# xer update to whoever reads it, see Registers.resolve_cr
+
+def cmpi_lazy(val, vm: VirtualMachine) -> IterReason:
+  ctx = vm.context
+  if ctx.lazy_xer is not None:
+    ctx.resolve_xer()
+  if val.l:
+    ctx.lazy_cr[val.crfd] = (u64_to_s64(ctx.gpr[val.ra]), u16_to_s16(val.ds), ctx.xer & XER_SO)
+  else:
+    ctx.lazy_cr[val.crfd] = (u32_to_s32(ctx.gpr[val.ra]), u16_to_s16(val.ds), ctx.xer & XER_SO)
+  return IterReason.IterOk
+
+def cmpli_lazy(val, vm: VirtualMachine) -> IterReason:
+  ctx = vm.context
+  if ctx.lazy_xer is not None:
+    ctx.resolve_xer()
+  mask = 0xFFFFFFFFFFFFFFFF if val.l else 0xFFFFFFFF
+  ctx.lazy_cr[val.crfd] = (ctx.gpr[val.ra] & mask, val.ds, ctx.xer & XER_SO)
+  return IterReason.IterOk
+
+def cmp_lazy(val, vm: VirtualMachine) -> IterReason:
+  ctx = vm.context
+  if ctx.lazy_xer is not None:
+    ctx.resolve_xer()
+  if val.l:
+    ctx.lazy_cr[val.crfd] = (u64_to_s64(ctx.gpr[val.ra]), u64_to_s64(ctx.gpr[val.rb]), ctx.xer & XER_SO)
+  else:
+    ctx.lazy_cr[val.crfd] = (u32_to_s32(ctx.gpr[val.ra]), u32_to_s32(ctx.gpr[val.rb]), ctx.xer & XER_SO)
+  return IterReason.IterOk
+
+def cmpl_lazy(val, vm: VirtualMachine) -> IterReason:
+  ctx = vm.context
+  if ctx.lazy_xer is not None:
+    ctx.resolve_xer()
+  mask = 0xFFFFFFFFFFFFFFFF if val.l else 0xFFFFFFFF
+  ctx.lazy_cr[val.crfd] = (ctx.gpr[val.ra] & mask, ctx.gpr[val.rb] & mask, ctx.xer & XER_SO)
+  return IterReason.IterOk
+
+def add_lazy(val, vm: VirtualMachine) -> IterReason:
+  ctx = vm.context
+  ra = ctx.gpr[val.ra] & 0xFFFFFFFFFFFFFFFF
+  rb = ctx.gpr[val.rb] & 0xFFFFFFFFFFFFFFFF
+  rt = ctx.gpr[val.rt] = ra + rb
+  
+  if val.oe:
+    if ctx.lazy_xer is not None:
+      ctx.resolve_xer()
+    ctx.lazy_xer = (ra, rb, rt)
+  if val.rc:
+    # so comes from the xer after this instruction's own overflow
+    if ctx.lazy_xer is not None:
+      ctx.resolve_xer()
+    ctx.lazy_cr[0] = (rt, None, ctx.xer & XER_SO)
+  return IterReason.IterOk
+
+SPR_NAMES = {1: 'xer', 8: 'lr', 9: 'ctr'}
+
+def mfspr(val, vm: VirtualMachine) -> IterReason:
+  match (((val.spr >> 5) & 0x1F) | (val.spr & 0x1F)):
+    case 1: # xer
+      vm.context.gpr[val.rt] = vm.context.get_xer()
+    case 8: # lr
+      vm.context.gpr[val.rt] = vm.context.lr
+    case 9: # ctr
+      vm.context.gpr[val.rt] = vm.context.ctr
+  
+  return IterReason.IterOk
+
+def fmt_mfspr(val, vm):
+  spr = SPR_NAMES.get(((val.spr >> 5) & 0x1F) | (val.spr & 0x1F))
+  if spr is None:
+    return f'mfspr r{val.rt}, {val.spr}'
+  return f'mf{spr} r{val.rt}'
+
+def mtspr(val, vm: VirtualMachine) -> IterReason:
+  match (((val.spr >> 5) & 0x1F) | (val.spr & 0x1F)):
+    case 1: # xer
+      vm.context.lazy_xer = None
+      vm.context.xer = pyint_to_u32(vm.context.gpr[val.rt])
+    case 8: # lr
+      vm.context.lr = vm.context.gpr[val.rt]
+    case 9: # ctr
+      vm.context.ctr = vm.context.gpr[val.rt]
+  
+  return IterReason.IterOk
+
+def fmt_mtspr(val, vm):
+  spr = SPR_NAMES.get(((val.spr >> 5) & 0x1F) | (val.spr & 0x1F))
+  if spr is None:
+    return f'mtspr r{val.rt}, {val.spr}'
+  return f'mt{spr} r{val.rt}'
+
+def mfcr(val, vm: VirtualMachine) -> IterReason:
+  vm.context.gpr[val.rt] = vm.context.get_cr()
+  return IterReason.IterOk
+
+def fmt_mfcr(val, vm):
+  return f'mfcr r{val.rt}'
+
+def mtcrf(val, vm: VirtualMachine) -> IterReason:
+  mask = 0
+  for field in range(8):
+    if val.fxm & (0x80 >> field):
+      mask |= 0xF << cr_shift(field)
+  
+  vm.context.cr = (vm.context.get_cr() & ~mask) | (vm.context.gpr[val.rs] & mask)
+  return IterReason.IterOk
+
+def fmt_mtcrf(val, vm):
+  if val.fxm == 0xFF:
+    return f'mtcr r{val.rs}'
+  return f'mtcrf {hex(val.fxm)}, r{val.rs}'
+
+def mcrf(val, vm: VirtualMachine) -> IterReason:
+  vm.context.set_cr_field(val.crfd, vm.context.get_cr_field(val.crfs))
+  return IterReason.IterOk
+
+def fmt_mcrf(val, vm):
+  return f'mcrf cr{val.crfd}, cr{val.crfs}'
+
+def bclr(val, vm: VirtualMachine) -> IterReason:
+  if not branch_condition(val.bo, val.bl, vm.context):
+    return IterReason.IterOk
+  
+  target = vm.context.lr
+  if val.lk:
+    vm.context.lr = vm.context.iar + 1
+  
+  if target == 0:
+    return IterReason.IterReturn
+  
+  vm.context.iar = target
+  return IterReason.IterContinue
+
+def fmt_bclr(val, vm):
+  key = bc_mnemonic(val.bo, val.bl)
+  if key == 'b':
+    return 'blrl' if val.lk else 'blr'
+  return f"{key}lr{'l' if val.lk else ''} cr{val.bl >> 2}"
+
+def bcctr(val, vm: VirtualMachine) -> IterReason:
+  # BO never decrements ctr here, the target is in it; unlike lr, ctr holds a
+  # byte address since it is only ever loaded from a register
+  if not branch_condition(val.bo | 0b00100, val.bl, vm.context):
+    return IterReason.IterOk
+  
+  target = (vm.context.ctr & 0xFFFFFFFC) >> 2
+  if val.lk:
+    vm.context.lr = vm.context.iar + 1
+  
+  vm.context.iar = target
+  return IterReason.IterContinue
+
+def fmt_bcctr(val, vm):
+  key = bc_mnemonic(val.bo | 0b00100, val.bl)
+  if key == 'b':
+    return 'bctrl' if val.lk else 'bctr'
+  return f"{key}ctr{'l' if val.lk else ''} cr{val.bl >> 2}"
+
+# vmx and vmx128: one handler per operation, shared by the VX/VA forms that
+# reach v0-v31 and the VMX128 forms that reach all 128 registers. lanes are
+# numpy views of Registers.vr, so element 0 is the most significant as in
+# the guest
+
+LVSL_BYTES = np.arange(32, dtype=np.uint8)
+
+def u5_to_s5(value):
+  return value - ((value & 0x10) << 1)
+
+def vector_address(val, vm: VirtualMachine):
+  return ((vm.context.gpr[val.ra] if val.ra else 0) + vm.context.gpr[val.rb]) & 0xFFFFFFFF
+
+def lvx(val, vm: VirtualMachine) -> IterReason:
+  address = vector_address(val, vm) & ~0xF
+  vm.context.vr[val.vd] = np.frombuffer(vm.read(address, 0, 16, val.ra), dtype=np.uint8)
+  return IterReason.IterOk
+
+def stvx(val, vm: VirtualMachine) -> IterReason:
+  address = vector_address(val, vm) & ~0xF
+  vm.write(address, 0, vm.context.vr[val.vd].tobytes(), val.ra)
+  return IterReason.IterOk
+
+def lvewx(val, vm: VirtualMachine) -> IterReason:
+  address = vector_address(val, vm) & ~0x3
+  lane = address & 0xC
+  vm.context.vr[val.vd, lane:lane+4] = np.frombuffer(vm.read(address, 0, 4, val.ra), dtype=np.uint8)
+  return IterReason.IterOk
+
+def stvewx(val, vm: VirtualMachine) -> IterReason:
+  address = vector_address(val, vm) & ~0x3
+  lane = address & 0xC
+  vm.write(address, 0, vm.context.vr[val.vd, lane:lane+4].tobytes(), val.ra)
+  return IterReason.IterOk
+
+def lvlx(val, vm: VirtualMachine) -> IterReason:
+  # the bytes up to the next 16-byte boundary, left justified
+  address = vector_address(val, vm)
+  count = 16 - (address & 0xF)
+  vr = vm.context.vr
+  vr[val.vd, :count] = np.frombuffer(vm.read(address, 0, count, val.ra), dtype=np.uint8)
+  vr[val.vd, count:] = 0
+  return IterReason.IterOk
+
+def lvrx(val, vm: VirtualMachine) -> IterReason:
+  # the bytes from the previous 16-byte boundary, right justified
+  address = vector_address(val, vm)
+  count = address & 0xF
+  vr = vm.context.vr
+  vr[val.vd, :16-count] = 0
+  if count:
+    vr[val.vd, 16-count:] = np.frombuffer(vm.read(address - count, 0, count, val.ra), dtype=np.uint8)
+  return IterReason.IterOk
+
+def stvlx(val, vm: VirtualMachine) -> IterReason:
+  address = vector_address(val, vm)
+  vm.write(address, 0, vm.context.vr[val.vd, :16-(address & 0xF)].tobytes(), val.ra)
+  return IterReason.IterOk
+
+def stvrx(val, vm: VirtualMachine) -> IterReason:
+  address = vector_address(val, vm)
+  count = address & 0xF
+  if count:
+    vm.write(address - count, 0, vm.context.vr[val.vd, 16-count:].tobytes(), val.ra)
+  return IterReason.IterOk
+
+def lvsl(val, vm: VirtualMachine) -> IterReason:
+  shift = vector_address(val, vm) & 0xF
+  vm.context.vr[val.vd] = LVSL_BYTES[shift:shift+16]
+  return IterReason.IterOk
+
+def lvsr(val, vm: VirtualMachine) -> IterReason:
+  shift = vector_address(val, vm) & 0xF
+  vm.context.vr[val.vd] = LVSL_BYTES[16-shift:32-shift]
+  return IterReason.IterOk
+
+def vperm(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = np.concatenate((vr[val.va], vr[val.vb]))[vr[val.vc] & 0x1F]
+  return IterReason.IterOk
+
+def vsldoi(val, vm: VirtualMachine) -> IterReason:
+  # the shift count sits where the VA-form keeps vc
+  vr = vm.context.vr
+  shift = val.vc & 0xF
+  vr[val.vd] = np.concatenate((vr[val.va], vr[val.vb]))[shift:shift+16]
+  return IterReason.IterOk
+
+def vpermwi128(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  perm = val.perm
+  words[val.vd] = words[val.vb][[(perm >> 6) & 3, (perm >> 4) & 3, (perm >> 2) & 3, perm & 3]]
+  return IterReason.IterOk
+
+def vmrghw(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  words[val.vd] = np.stack((words[val.va, :2], words[val.vb, :2]), axis=1).ravel()
+  return IterReason.IterOk
+
+def vmrglw(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  words[val.vd] = np.stack((words[val.va, 2:], words[val.vb, 2:]), axis=1).ravel()
+  return IterReason.IterOk
+
+def vspltb(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = vr[val.vb, val.imm & 0xF]
+  return IterReason.IterOk
+
+def vsplth(val, vm: VirtualMachine) -> IterReason:
+  halves = vm.context.vr.view(VR_U16)
+  halves[val.vd] = halves[val.vb, val.imm & 0x7]
+  return IterReason.IterOk
+
+def vspltw(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  words[val.vd] = words[val.vb, val.imm & 0x3]
+  return IterReason.IterOk
+
+def vspltisb(val, vm: VirtualMachine) -> IterReason:
+  vm.context.vr.view(np.int8)[val.vd] = u5_to_s5(val.imm)
+  return IterReason.IterOk
+
+def vspltish(val, vm: VirtualMachine) -> IterReason:
+  vm.context.vr.view(VR_S16)[val.vd] = u5_to_s5(val.imm)
+  return IterReason.IterOk
+
+def vspltisw(val, vm: VirtualMachine) -> IterReason:
+  vm.context.vr.view(VR_S32)[val.vd] = u5_to_s5(val.imm)
+  return IterReason.IterOk
+
+def vand(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = vr[val.va] & vr[val.vb]
+  return IterReason.IterOk
+
+def vandc(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = vr[val.va] & ~vr[val.vb]
+  return IterReason.IterOk
+
+def vor(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = vr[val.va] | vr[val.vb]
+  return IterReason.IterOk
+
+def vxor(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = vr[val.va] ^ vr[val.vb]
+  return IterReason.IterOk
+
+def vnor(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = ~(vr[val.va] | vr[val.vb])
+  return IterReason.IterOk
+
+def vsel(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr[val.vd] = (vr[val.va] & ~vr[val.vc]) | (vr[val.vb] & vr[val.vc])
+  return IterReason.IterOk
+
+def vsel128(val, vm: VirtualMachine) -> IterReason:
+  # vmx128 has no fourth register, vd is the mask
+  vr = vm.context.vr
+  vr[val.vd] = (vr[val.va] & ~vr[val.vd]) | (vr[val.vb] & vr[val.vd])
+  return IterReason.IterOk
+
+def vadduwm(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  words[val.vd] = words[val.va] + words[val.vb]
+  return IterReason.IterOk
+
+def vsubuwm(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  words[val.vd] = words[val.va] - words[val.vb]
+  return IterReason.IterOk
+
+# float lanes: inf and nan are results, not host warnings. multiply-adds go
+# through float64 so the product is exact and only the sum rounds
+
+def vaddfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.va] + floats[val.vb]
+  return IterReason.IterOk
+
+def vsubfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.va] - floats[val.vb]
+  return IterReason.IterOk
+
+def vmulfp128(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.va] * floats[val.vb]
+  return IterReason.IterOk
+
+def vmaddfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.va].astype(np.float64) * floats[val.vc] + floats[val.vb]
+  return IterReason.IterOk
+
+def vnmsubfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.vb] - floats[val.va].astype(np.float64) * floats[val.vc]
+  return IterReason.IterOk
+
+def vmaddfp128(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.va].astype(np.float64) * floats[val.vb] + floats[val.vd]
+  return IterReason.IterOk
+
+def vmaddcfp128(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.va].astype(np.float64) * floats[val.vd] + floats[val.vb]
+  return IterReason.IterOk
+
+def vnmsubfp128(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = floats[val.vd] - floats[val.va].astype(np.float64) * floats[val.vb]
+  return IterReason.IterOk
+
+def vmsum3fp128(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = np.dot(floats[val.va, :3].astype(np.float64), floats[val.vb, :3])
+  return IterReason.IterOk
+
+def vmsum4fp128(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = np.dot(floats[val.va].astype(np.float64), floats[val.vb])
+  return IterReason.IterOk
+
+def vmaxfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  floats[val.vd] = np.maximum(floats[val.va], floats[val.vb])
+  return IterReason.IterOk
+
+def vminfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  floats[val.vd] = np.minimum(floats[val.va], floats[val.vb])
+  return IterReason.IterOk
+
+def vrefp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = np.float32(1.0) / floats[val.vb]
+  return IterReason.IterOk
+
+def vrsqrtefp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  with np.errstate(all='ignore'):
+    floats[val.vd] = np.float32(1.0) / np.sqrt(floats[val.vb])
+  return IterReason.IterOk
+
+def vcfsx(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr.view(VR_F32)[val.vd] = vr.view(VR_S32)[val.vb] / float(1 << val.imm)
+  return IterReason.IterOk
+
+def vcfux(val, vm: VirtualMachine) -> IterReason:
+  vr = vm.context.vr
+  vr.view(VR_F32)[val.vd] = vr.view(VR_U32)[val.vb] / float(1 << val.imm)
+  return IterReason.IterOk
+
+def convert_saturate(val, vm: VirtualMachine, low, high, dtype):
+  # truncate toward zero, clamp and set VSCR[SAT]; nan converts to 0. Done
+  # in float64, where float32 would round 0x7FFFFFFF up past the clamp
+  vr = vm.context.vr
+  scaled = vr.view(VR_F32)[val.vb].astype(np.float64) * float(1 << val.imm)
+  scaled[np.isnan(scaled)] = 0.0
+  clamped = np.clip(np.trunc(scaled), low, high)
+  if (clamped != np.trunc(scaled)).any():
+    vm.context.vscr |= VSCR_SAT
+  vr.view(dtype)[val.vd] = clamped
+  return IterReason.IterOk
+
+def vctsxs(val, vm: VirtualMachine) -> IterReason:
+  return convert_saturate(val, vm, -0x80000000, 0x7FFFFFFF, VR_S32)
+
+def vctuxs(val, vm: VirtualMachine) -> IterReason:
+  return convert_saturate(val, vm, 0, 0xFFFFFFFF, VR_U32)
+
+def vector_compare(val, vm: VirtualMachine, mask):
+  vm.context.vr.view(VR_U32)[val.vd] = np.where(mask, 0xFFFFFFFF, 0)
+  if val.rc:
+    # cr6: every lane true in lt, no lane true in eq
+    vm.context.set_cr_field(6, CR_LT if mask.all() else CR_EQ if not mask.any() else 0)
+  return IterReason.IterOk
+
+def vcmpeqfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  return vector_compare(val, vm, floats[val.va] == floats[val.vb])
+
+def vcmpgefp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  return vector_compare(val, vm, floats[val.va] >= floats[val.vb])
+
+def vcmpgtfp(val, vm: VirtualMachine) -> IterReason:
+  floats = vm.context.vr.view(VR_F32)
+  return vector_compare(val, vm, floats[val.va] > floats[val.vb])
+
+def vcmpequw(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  return vector_compare(val, vm, words[val.va] == words[val.vb])
+
+def vcmpgtuw(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_U32)
+  return vector_compare(val, vm, words[val.va] > words[val.vb])
+
+def vcmpgtsw(val, vm: VirtualMachine) -> IterReason:
+  words = vm.context.vr.view(VR_S32)
+  return vector_compare(val, vm, words[val.va] > words[val.vb])
+
+def vector_formatter(name, operands):
+  # operands as 'prefix:field' tokens, e.g. 'v:vd r:ra r:rb'
+  tokens = [token.split(':') for token in operands.split()]
+  def fmt_vector(val, vm):
+    text = name
+    if type(val).__name__.startswith('VX128') and not name.endswith('128'):
+      text += '128'
+    if getattr(val, 'rc', 0):
+      text += '.'
+    return f'{text} ' + ', '.join(f'{prefix}{getattr(val, field)}' for prefix, field in tokens)
+  return fmt_vector
+
+VECTOR_OPERANDS = {
+  lvx: 'v:vd r:ra r:rb',
+  stvx: 'v:vd r:ra r:rb',
+  lvewx: 'v:vd r:ra r:rb',
+  stvewx: 'v:vd r:ra r:rb',
+  lvlx: 'v:vd r:ra r:rb',
+  lvrx: 'v:vd r:ra r:rb',
+  stvlx: 'v:vd r:ra r:rb',
+  stvrx: 'v:vd r:ra r:rb',
+  lvsl: 'v:vd r:ra r:rb',
+  lvsr: 'v:vd r:ra r:rb',
+  vperm: 'v:vd v:va v:vb v:vc',
+  vsldoi: 'v:vd v:va v:vb :vc',
+  vpermwi128: 'v:vd v:vb :perm',
+  vmrghw: 'v:vd v:va v:vb',
+  vmrglw: 'v:vd v:va v:vb',
+  vspltb: 'v:vd v:vb :imm',
+  vsplth: 'v:vd v:vb :imm',
+  vspltw: 'v:vd v:vb :imm',
+  vspltisb: 'v:vd :imm',
+  vspltish: 'v:vd :imm',
+  vspltisw: 'v:vd :imm',
+  vand: 'v:vd v:va v:vb',
+  vandc: 'v:vd v:va v:vb',
+  vor: 'v:vd v:va v:vb',
+  vxor: 'v:vd v:va v:vb',
+  vnor: 'v:vd v:va v:vb',
+  vsel: 'v:vd v:va v:vb v:vc',
+  vsel128: 'v:vd v:va v:vb',
+  vadduwm: 'v:vd v:va v:vb',
+  vsubuwm: 'v:vd v:va v:vb',
+  vaddfp: 'v:vd v:va v:vb',
+  vsubfp: 'v:vd v:va v:vb',
+  vmulfp128: 'v:vd v:va v:vb',
+  vmaddfp: 'v:vd v:va v:vc v:vb',
+  vnmsubfp: 'v:vd v:va v:vc v:vb',
+  vmaddfp128: 'v:vd v:va v:vb',
+  vmaddcfp128: 'v:vd v:va v:vb',
+  vnmsubfp128: 'v:vd v:va v:vb',
+  vmsum3fp128: 'v:vd v:va v:vb',
+  vmsum4fp128: 'v:vd v:va v:vb',
+  vmaxfp: 'v:vd v:va v:vb',
+  vminfp: 'v:vd v:va v:vb',
+  vrefp: 'v:vd v:vb',
+  vrsqrtefp: 'v:vd v:vb',
+  vcfsx: 'v:vd v:vb :imm',
+  vcfux: 'v:vd v:vb :imm',
+  vctsxs: 'v:vd v:vb :imm',
+  vctuxs: 'v:vd v:vb :imm',
+  vcmpeqfp: 'v:vd v:va v:vb',
+  vcmpgefp: 'v:vd v:va v:vb',
+  vcmpgtfp: 'v:vd v:va v:vb',
+  vcmpequw: 'v:vd v:va v:vb',
+  vcmpgtuw: 'v:vd v:va v:vb',
+  vcmpgtsw: 'v:vd v:va v:vb',
+}
+
+# branches that can set or follow lr, watched by the profiler
+LINKING_BRANCHES = (b, bc, bclr, bcctr)
+
+# (primary opcode, extended opcode, handler, format); adding an instruction is one line here
+OPCODE_TABLE = [
+  (10, None, cmpli, 'Cmpli'),
+  (11, None, cmpi, 'Cmpi'),
+  (14, None, li, 'Li'),
+  (15, None, lis, 'Li'),
+  (16, None, bc, 'Bcx'),
+  (17, None, sc, 'Sc'),
+  (18, None, b, 'Bx'),
+  (19, 0, mcrf, 'Mcrf'),
+  (19, 16, bclr, 'Bundle19'),
+  (19, 528, bcctr, 'Bundle19'),
+  (31, 0, cmp, 'Cmp'),
+  (31, 19, mfcr, 'Mfcr'),
+  (31, 32, cmpl, 'Cmpl'),
+  (31, 144, mtcrf, 'Mtcrf'),
+  (31, 266, add, 'Addx'),
+  (31, 339, mfspr, 'Mfspr'),
+  (31, 444, or_mr, 'Or'),
+  (31, 467, mtspr, 'Mtspr'),
+  (32, None, lwz, 'Lwz'),
+  (33, None, lwzu, 'D'),
+  (34, None, lbz, 'D'),
+  (35, None, lbzu, 'D'),
+  (36, None, stw, 'Stw'),
+  (37, None, stwu, 'Stwu'),
+  (38, None, stb, 'Stb'),
+  (39, None, stbu, 'D'),
+  (40, None, lhz, 'D'),
+  (41, None, lhzu, 'D'),
+  (42, None, lha, 'D'),
+  (43, None, lhau, 'D'),
+  (44, None, sth, 'D'),
+  (45, None, sthu, 'D'),
+  (31, 21, ldx, 'Xmem'),
+  (31, 23, lwzx, 'Xmem'),
+  (31, 53, ldux, 'Xmem'),
+  (31, 55, lwzux, 'Xmem'),
+  (31, 87, lbzx, 'Xmem'),
+  (31, 119, lbzux, 'Xmem'),
+  (31, 149, stdx, 'Xmem'),
+  (31, 151, stwx, 'Xmem'),
+  (31, 181, stdux, 'Xmem'),
+  (31, 183, stwux, 'Xmem'),
+  (31, 215, stbx, 'Xmem'),
+  (31, 247, stbux, 'Xmem'),
+  (31, 279, lhzx, 'Xmem'),
+  (31, 311, lhzux, 'Xmem'),
+  (31, 341, lwax, 'Xmem'),
+  (31, 343, lhax, 'Xmem'),
+  (31, 375, lhaux, 'Xmem'),
+  (31, 407, sthx, 'Xmem'),
+  (31, 439, sthux, 'Xmem'),
+  (31, 20, lwarx, 'Xmem'),
+  (31, 84, ldarx, 'Xmem'),
+  (31, 150, stwcx, 'Xmem'),
+  (31, 214, stdcx, 'Xmem'),
+  (31, 6, lvsl, 'Vmem'),
+  (31, 38, lvsr, 'Vmem'),
+  (31, 71, lvewx, 'Vmem'),
+  (31, 103, lvx, 'Vmem'),
+  (31, 199, stvewx, 'Vmem'),
+  (31, 231, stvx, 'Vmem'),
+  (31, 519, lvlx, 'Vmem'),
+  (31, 551, lvrx, 'Vmem'),
+  (31, 647, stvlx, 'Vmem'),
+  (31, 679, stvrx, 'Vmem'),
+]
+
+# (primary opcode, pattern, mask, handler, format) over the low 11 bits of the
+# word, for opcodes whose extended opcodes do not sit in bits 1-10: the
+# DS-form doubleword loads/stores and the vector units
+PATTERN_TABLE = [
+  (58, 0, 0x3, ld, 'DS'),
+  (58, 1, 0x3, ldu, 'DS'),
+  (58, 2, 0x3, lwa, 'DS'),
+  (62, 0, 0x3, std, 'DS'),
+  (62, 1, 0x3, stdu, 'DS'),
+  (4, 10, 0x7FF, vaddfp, 'VX'),
+  (4, 74, 0x7FF, vsubfp, 'VX'),
+  (4, 128, 0x7FF, vadduwm, 'VX'),
+  (4, 140, 0x7FF, vmrghw, 'VX'),
+  (4, 266, 0x7FF, vrefp, 'VX'),
+  (4, 330, 0x7FF, vrsqrtefp, 'VX'),
+  (4, 396, 0x7FF, vmrglw, 'VX'),
+  (4, 524, 0x7FF, vspltb, 'VXI'),
+  (4, 588, 0x7FF, vsplth, 'VXI'),
+  (4, 652, 0x7FF, vspltw, 'VXI'),
+  (4, 778, 0x7FF, vcfux, 'VXI'),
+  (4, 780, 0x7FF, vspltisb, 'VXI'),
+  (4, 842, 0x7FF, vcfsx, 'VXI'),
+  (4, 844, 0x7FF, vspltish, 'VXI'),
+  (4, 906, 0x7FF, vctuxs, 'VXI'),
+  (4, 908, 0x7FF, vspltisw, 'VXI'),
+  (4, 970, 0x7FF, vctsxs, 'VXI'),
+  (4, 1028, 0x7FF, vand, 'VX'),
+  (4, 1034, 0x7FF, vmaxfp, 'VX'),
+  (4, 1092, 0x7FF, vandc, 'VX'),
+  (4, 1098, 0x7FF, vminfp, 'VX'),
+  (4, 1152, 0x7FF, vsubuwm, 'VX'),
+  (4, 1156, 0x7FF, vor, 'VX'),
+  (4, 1220, 0x7FF, vxor, 'VX'),
+  (4, 1284, 0x7FF, vnor, 'VX'),
+  (4, 134, 0x3FF, vcmpequw, 'VXR'),
+  (4, 198, 0x3FF, vcmpeqfp, 'VXR'),
+  (4, 454, 0x3FF, vcmpgefp, 'VXR'),
+  (4, 646, 0x3FF, vcmpgtuw, 'VXR'),
+  (4, 710, 0x3FF, vcmpgtfp, 'VXR'),
+  (4, 902, 0x3FF, vcmpgtsw, 'VXR'),
+  (4, 42, 0x3F, vsel, 'VA'),
+  (4, 43, 0x3F, vperm, 'VA'),
+  (4, 44, 0x3F, vsldoi, 'VA'),
+  (4, 46, 0x3F, vmaddfp, 'VA'),
+  (4, 47, 0x3F, vnmsubfp, 'VA'),
+  (4, 0x003, 0x7F3, lvsl, 'VX128_1'),
+  (4, 0x043, 0x7F3, lvsr, 'VX128_1'),
+  (4, 0x0C3, 0x7F3, lvx, 'VX128_1'),
+  (4, 0x1C3, 0x7F3, stvx, 'VX128_1'),
+  (4, 0x403, 0x7F3, lvlx, 'VX128_1'),
+  (4, 0x443, 0x7F3, lvrx, 'VX128_1'),
+  (4, 0x503, 0x7F3, stvlx, 'VX128_1'),
+  (4, 0x543, 0x7F3, stvrx, 'VX128_1'),
+  (5, 0x000, 0x210, vperm, 'VX128_2'),
+  (5, 0x010, 0x3D0, vaddfp, 'VX128'),
+  (5, 0x050, 0x3D0, vsubfp, 'VX128'),
+  (5, 0x090, 0x3D0, vmulfp128, 'VX128'),
+  (5, 0x0D0, 0x3D0, vmaddfp128, 'VX128'),
+  (5, 0x110, 0x3D0, vmaddcfp128, 'VX128'),
+  (5, 0x150, 0x3D0, vnmsubfp128, 'VX128'),
+  (5, 0x190, 0x3D0, vmsum3fp128, 'VX128'),
+  (5, 0x1D0, 0x3D0, vmsum4fp128, 'VX128'),
+  (5, 0x210, 0x3D0, vand, 'VX128'),
+  (5, 0x250, 0x3D0, vandc, 'VX128'),
+  (5, 0x290, 0x3D0, vnor, 'VX128'),
+  (5, 0x2D0, 0x3D0, vor, 'VX128'),
+  (5, 0x310, 0x3D0, vxor, 'VX128'),
+  (5, 0x350, 0x3D0, vsel128, 'VX128'),
+  (6, 0x000, 0x390, vcmpeqfp, 'VX128_R'),
+  (6, 0x080, 0x390, vcmpgefp, 'VX128_R'),
+  (6, 0x100, 0x390, vcmpgtfp, 'VX128_R'),
+  (6, 0x200, 0x390, vcmpequw, 'VX128_R'),
+  (6, 0x210, 0x630, vpermwi128, 'VX128_P'),
+  (6, 0x230, 0x7F0, vctsxs, 'VX128_3'),
+  (6, 0x270, 0x7F0, vctuxs, 'VX128_3'),
+  (6, 0x2B0, 0x7F0, vcfsx, 'VX128_3'),
+  (6, 0x2F0, 0x7F0, vcfux, 'VX128_3'),
+  (6, 0x280, 0x3D0, vmaxfp, 'VX128'),
+  (6, 0x2C0, 0x3D0, vminfp, 'VX128'),
+  (6, 0x300, 0x3D0, vmrghw, 'VX128'),
+  (6, 0x340, 0x3D0, vmrglw, 'VX128'),
+  (6, 0x630, 0x7F0, vrefp, 'VX128_3'),
+  (6, 0x670, 0x7F0, vrsqrtefp, 'VX128_3'),
+  (6, 0x730, 0x7F0, vspltw, 'VX128_3'),
+  (6, 0x770, 0x7F0, vspltisw, 'VX128_3'),
+]
+
+def fill_extended(dispatch, primary, pattern, mask, entry):
+  if dispatch[primary] is None:
+    dispatch[primary] = [None] * 2048
+  entries = dispatch[primary]
+  for key in range(2048):
+    if key & mask == pattern:
+      current = entries[key]
+      if current is not None and current != entry:
+        raise ValueError(f'{entry[0].__name__} overlaps {current[0].__name__} at {primary}/{key:#x}')
+      entries[key] = entry
+
+def build_dispatch(table, pattern_table=()):
+  # primary opcode -> (handler, unpack), or for opcodes with extended forms a
+  # 2048 entry list indexed by the low 11 bits of the word. Extended opcodes
+  # with no handler stay None and fault like any other undecodable word
+  dispatch = [None] * 64
+  for primary, extended, handler, fmt in table:
+    entry = (handler, FORMAT_TABLE[fmt].unpack)
+    if extended is None:
+      dispatch[primary] = entry
+      continue
+    
+    # the extended opcode sits in bits 1-10, rc/lk in bit 0; XO-forms keep
+    # OE in the top bit of the extended opcode
+    mask = 0x3FE if 'oe' in FORMAT_TABLE[fmt].record._fields else 0x7FE
+    fill_extended(dispatch, primary, extended << 1, mask, entry)
+  
+  for primary, pattern, mask, handler, fmt in pattern_table:
+    fill_extended(dispatch, primary, pattern, mask, (handler, FORMAT_TABLE[fmt].unpack))
+  return dispatch
+
+DISPATCH = build_dispatch(OPCODE_TABLE, PATTERN_TABLE)
+
+LAZY_HANDLERS = {
+  cmpi: cmpi_lazy,
+  cmpli: cmpli_lazy,
+  cmp: cmp_lazy,
+  cmpl: cmpl_lazy,
+  add: add_lazy,
+}
+LAZY_DISPATCH = build_dispatch([(primary, extended, LAZY_HANDLERS.get(handler, handler), fmt) for primary, extended, handler, fmt in OPCODE_TABLE], PATTERN_TABLE)
+
+def decode(value, dispatch=DISPATCH):
+  entry = dispatch[value >> 26]
+  if entry is None:
+    return None
+  if entry.__class__ is list:
+    entry = entry[value & 0x7FF]
+    if entry is None:
+      return None
+  return entry[0], entry[1](value)
+
+# superinstructions: pairs compilers emit all the time, found by
+# VirtualMachine.decode_fused and run by interpret() as one entry. Each leaves
+# iar on its second instruction before that one can fault or branch, so every
+# instruction boundary looks exactly as it would unfused
+
+FUSE_LIS_ADDI = 0
+FUSE_COMPARE_BRANCH = 1
+FUSE_MFLR_STW = 2
+FUSION_NAMES = ['lis+addi', 'cmpwi+bc', 'mflr+stw']
+
+def lis_addi(val, vm: VirtualMachine) -> IterReason:
+  # both results are constants, worked out when the pair was fused
+  high_rt, high, rt, value = val
+  ctx = vm.context
+  ctx.gpr[high_rt] = high
+  ctx.gpr[rt] = value
+  ctx.iar += 1
+  vm.fused += 1
+  vm.fusions[FUSE_LIS_ADDI] += 1
+  return IterReason.IterOk
+
+def compare_branch(vm, crfd, field, bit, expect, target, lk):
+  ctx = vm.context
+  ctx.set_cr_field(crfd, field)
+  ctx.iar += 1
+  vm.fused += 1
+  vm.fusions[FUSE_COMPARE_BRANCH] += 1
+  if bool(field & bit) != expect:
+    return IterReason.IterOk
+  if lk:
+    ctx.lr = ctx.iar + 1
+  ctx.iar = target
+  return IterReason.IterContinue
+
+def cmpwi_bc(val, vm: VirtualMachine) -> IterReason:
+  crfd, ra, immediate, bit, expect, target, lk = val
+  ctx = vm.context
+  field = compare_field(u32_to_s32(ctx.gpr[ra]), immediate, ctx.get_xer())
+  return compare_branch(vm, crfd, field, bit, expect, target, lk)
+
+def cmplwi_bc(val, vm: VirtualMachine) -> IterReason:
+  crfd, ra, immediate, bit, expect, target, lk = val
+  ctx = vm.context
+  field = compare_field(ctx.gpr[ra] & 0xFFFFFFFF, immediate, ctx.get_xer())
+  return compare_branch(vm, crfd, field, bit, expect, target, lk)
+
+def mflr_stw(val, vm: VirtualMachine) -> IterReason:
+  rt, store = val
+  ctx = vm.context
+  gpr = ctx.gpr
+  gpr[rt] = ctx.lr
+  ctx.iar += 1
+  vm.fused += 1
+  vm.fusions[FUSE_MFLR_STW] += 1
+  vm.store_u32(d_address(store, gpr), gpr[rt], store.ra)
+  return IterReason.IterOk
+
+def fuse_lis(val, second, address):
+  # lis rA, hi; addi rD, rA, lo
+  handler, low = second
+  if handler is not li or val.ra != 0 or low.ra == 0 or low.ra != val.rt:
+    return None
+  high = pyint_to_u32(u16_to_s16(val.si) << 16)
+  return lis_addi, (val.rt, high, low.rt, pyint_to_u32(high + u16_to_s16(low.si)))
+
+def fuse_compare(fused, immediate, val, second, address):
+  # a 32-bit compare against an immediate, then a bc testing that field
+  # without touching ctr
+  handler, branch = second
+  if handler is not bc or val.l or branch.bo & 0b10100 != 0b00100 or branch.bi >> 2 != val.crfd:
+    return None
+  target = bc_target(branch, address + 4) >> 2
+  return fused, (val.crfd, val.ra, immediate, CR_LT >> (branch.bi & 3), (branch.bo >> 3) & 1, target, branch.lk)
+
+def fuse_cmpi(val, second, address):
+  return fuse_compare(cmpwi_bc, u16_to_s16(val.ds), val, second, address)
+
+def fuse_cmpli(val, second, address):
+  return fuse_compare(cmplwi_bc, val.ds, val, second, address)
+
+def fuse_mflr(val, second, address):
+  # mflr rS; stw rS, d(rA)
+  handler, store = second
+  if ((val.spr >> 5) & 0x1F) | (val.spr & 0x1F) != 8 or handler is not stw or store.rt != val.rt:
+    return None
+  return mflr_stw, (val.rt, store)
+
+# first handler of a pair -> function returning the fused entry or None
+# fused entries that can branch, with the branch in their second word
+FUSED_BRANCHES = (cmpwi_bc, cmplwi_bc)
+
+FUSIONS = {
+  lis: fuse_lis,
+  cmpi: fuse_cmpi,
+  cmpli: fuse_cmpli,
+  cmpi_lazy: fuse_cmpi,
+  cmpli_lazy: fuse_cmpli,
+  mfspr: fuse_mflr,
+}
+
+def fmt_breakpoint(val, vm):
+  return 'breakpoint'
+
+def fmt_native_call(val, vm):
+  if vm is not None:
+    return f'native {val.name} = {hex(vm.context.gpr[3])}'
+  return f'native {val.name}'
+
+# category and text for each handler, only built when the tracer asks for it
+FORMATTERS = {
+  breakpoint_handler: (Category.NONE, fmt_breakpoint),
+  native_call: (Category.SYSCALL, fmt_native_call),
+  stwcx: (Category.DISASM, fmt_stwcx),
+  stdcx: (Category.DISASM, fmt_stdcx),
+  cmpli: (Category.DISASM, fmt_cmpli),
+  cmpi: (Category.DISASM, fmt_cmpi),
+  cmpli_lazy: (Category.DISASM, fmt_cmpli),
+  cmpi_lazy: (Category.DISASM, fmt_cmpi),
+  cmp_lazy: (Category.DISASM, fmt_cmp),
+  cmpl_lazy: (Category.DISASM, fmt_cmpl),
+  add_lazy: (Category.DISASM, fmt_add),
+  li: (Category.DISASM, fmt_li),
+  lis: (Category.DISASM, fmt_lis),
+  bc: (Category.BRANCH, fmt_bc),
+  sc: (Category.SYSCALL, fmt_sc),
+  b: (Category.BRANCH, fmt_b),
+  lwz: (Category.DISASM, fmt_lwz),
+  stw: (Category.DISASM, fmt_stw),
+  stwu: (Category.DISASM, fmt_stwu),
+  stb: (Category.DISASM, fmt_stb),
+  cmp: (Category.DISASM, fmt_cmp),
+  cmpl: (Category.DISASM, fmt_cmpl),
+  or_mr: (Category.DISASM, fmt_or_mr),
+  add: (Category.DISASM, fmt_add),
+  mfspr: (Category.DISASM, fmt_mfspr),
+  mtspr: (Category.DISASM, fmt_mtspr),
+  mfcr: (Category.DISASM, fmt_mfcr),
+  mtcrf: (Category.DISASM, fmt_mtcrf),
+  mcrf: (Category.DISASM, fmt_mcrf),
+  bclr: (Category.BRANCH, fmt_bclr),
+  bcctr: (Category.BRANCH, fmt_bcctr),
+}
+FORMATTERS.update({handler: (Category.DISASM, memory_formatter(handler.__name__, form)) for handler, form in MEMORY_FORMS.items()})
+FORMATTERS.update({handler: (Category.DISASM, vector_formatter(handler.__name__, operands)) for handler, operands in VECTOR_OPERANDS.items()})
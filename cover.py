@@ -0,0 +1,191 @@
+import struct
+import zlib
+import numpy as np
+from memory import PAGE_EXEC, PAGE_SHIFT
+
+# guest code coverage, filled by VirtualMachine.interpret_covered:
+#   bitmap  a byte per instruction word of [base, base + size), 1 once it ran.
+#           The loop only adds each straight run it finishes to `spans` as
+#           start << 32 | last, and the runs are marked here when read
+#   edges   AFL style hit counts of (previous block, block) pairs, hashed
+#           into EDGE_SIZE saturating bytes; a block's location is
+#           (address >> 2 ^ address >> 18) & EDGE_MASK
+# Runs merge with |, compare with diff() and export as drcov version 2 for
+# coverage viewers
+
+EDGE_SIZE = 1 << 16
+EDGE_MASK = EDGE_SIZE - 1
+DRCOV_BLOCK = struct.Struct('<IHH') # start offset, size, module id
+# drcov sizes are 16 bit, longer runs are split
+DRCOV_MAX_SIZE = 0xFFFC
+
+class Coverage:
+  def __init__(self, base, size, module=None) -> None:
+    self.base = base
+    self.size = size & ~3
+    self.module = module # path written to the drcov module table
+    self.bitmap = bytearray(self.size >> 2)
+    self.spans = set() # start << 32 | last instruction of runs not yet in bitmap
+    self.edges = bytearray(EDGE_SIZE)
+    self.previous = 0 # edge location of the last block entered, shifted
+
+  @classmethod
+  def for_vm(cls, vm):
+    # the image's code sections, or every executable region without an xex
+    xex = vm.xex
+    span = xex.code_range() if xex is not None and xex.sections else None
+    if span is None:
+      regions = [region for region in vm.memory.regions if region.perms & PAGE_EXEC]
+      if not regions:
+        raise ValueError('no executable memory to cover')
+      span = min(region.start for region in regions) << PAGE_SHIFT, max(region.end for region in regions) << PAGE_SHIFT
+    return cls(span[0], span[1] - span[0], getattr(xex, 'path', None))
+
+  def __getstate__(self):
+    # mostly zeros, so batch workers send them back compressed
+    self.flush()
+    state = self.__dict__.copy()
+    state['bitmap'] = zlib.compress(self.bitmap, 1)
+    state['edges'] = zlib.compress(self.edges, 1)
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.bitmap = bytearray(zlib.decompress(state['bitmap']))
+    self.edges = bytearray(zlib.decompress(state['edges']))
+
+  def mark(self, start, end):
+    # instructions start..end, both included
+    first = max(start - self.base, 0) >> 2
+    last = min((end - self.base) >> 2, len(self.bitmap) - 1)
+    if first <= last:
+      self.bitmap[first:last + 1] = b'\1' * (last + 1 - first)
+
+  def flush(self):
+    for span in self.spans:
+      self.mark(span >> 32, span & 0xFFFFFFFF)
+    self.spans.clear()
+
+  def clear(self):
+    self.spans.clear()
+    self.bitmap[:] = bytes(len(self.bitmap))
+    self.edges[:] = bytes(EDGE_SIZE)
+    self.previous = 0
+
+  def copy(self):
+    self.flush()
+    other = Coverage(self.base, self.size, self.module)
+    other.bitmap[:] = self.bitmap
+    other.edges[:] = self.edges
+    return other
+
+  def covered(self, address):
+    self.flush()
+    index = (address - self.base) >> 2
+    return 0 <= index < len(self.bitmap) and self.bitmap[index] != 0
+
+  @property
+  def instructions(self):
+    self.flush()
+    return len(self.bitmap) - self.bitmap.count(0)
+
+  @property
+  def edge_count(self):
+    return EDGE_SIZE - self.edges.count(0)
+
+  def runs(self, bitmap=None):
+    # [(start, end)) byte address ranges of consecutive covered instructions
+    self.flush()
+    marked = np.frombuffer(self.bitmap if bitmap is None else bitmap, np.uint8) != 0
+    changes = np.flatnonzero(np.diff(np.concatenate(([False], marked, [False])).astype(np.int8)))
+    return [(self.base + int(start) * 4, self.base + int(end) * 4) for start, end in zip(changes[::2], changes[1::2])]
+
+  def merge(self, other):
+    # covered anywhere in either, edge counts added up to 255
+    if (other.base, other.size) != (self.base, self.size):
+      raise ValueError(f'coverage of {hex(other.base)}+{hex(other.size)} cannot merge into {hex(self.base)}+{hex(self.size)}')
+    self.flush()
+    other.flush()
+    bitmap = np.frombuffer(self.bitmap, np.uint8)
+    bitmap |= np.frombuffer(other.bitmap, np.uint8)
+    edges = np.frombuffer(self.edges, np.uint8)
+    edges[:] = np.minimum(edges.astype(np.uint16) + np.frombuffer(other.edges, np.uint8), 255)
+    return self
+
+  def diff(self, other):
+    # (runs only self covers, runs only other covers)
+    self.flush()
+    other.flush()
+    mine = np.frombuffer(self.bitmap, np.uint8) != 0
+    theirs = np.frombuffer(other.bitmap, np.uint8) != 0
+    return self.runs((mine & ~theirs).view(np.uint8)), self.runs((theirs & ~mine).view(np.uint8))
+
+  def write_drcov(self, path):
+    blocks = bytearray()
+    count = 0
+    for start, end in self.runs():
+      for offset in range(start - self.base, end - self.base, DRCOV_MAX_SIZE):
+        blocks += DRCOV_BLOCK.pack(offset, min(DRCOV_MAX_SIZE, end - self.base - offset), 0)
+        count += 1
+    header = (
+      'DRCOV VERSION: 2\n'
+      'DRCOV FLAVOR: drcov\n'
+      'Module Table: version 2, count 1\n'
+      'Columns: id, base, end, entry, checksum, timestamp, path\n'
+      f' 0, {self.base:#018x}, {self.base + self.size:#018x}, 0x0000000000000000, 0x00000000, 0x00000000, {self.module or "guest"}\n'
+      f'BB Table: {count} bbs\n'
+    )
+    with open(path, 'wb') as f:
+      f.write(header.encode())
+      f.write(blocks)
+
+def read_drcov(path):
+  # Coverage of the first module of a drcov file; edges are not part of the
+  # format and come back empty
+  with open(path, 'rb') as f:
+    data = f.read()
+  lines = []
+  offset = 0
+  while not (lines and lines[-1].startswith('BB Table:')):
+    end = data.index(b'\n', offset)
+    lines.append(data[offset:end].decode())
+    offset = end + 1
+
+  table = next(index for index, line in enumerate(lines) if line.startswith('Module Table:'))
+  columns = [name.strip() for name in lines[table + 1].split(':', 1)[1].split(',')]
+  fields = [field.strip() for field in lines[table + 2].split(',', len(columns) - 1)]
+  module = dict(zip(columns, fields))
+  base, end = int(module['base'], 16), int(module['end'], 16)
+  coverage = Coverage(base, end - base, module.get('path'))
+
+  count = int(lines[-1].split(':')[1].split()[0])
+  for start, size, module_id in DRCOV_BLOCK.iter_unpack(data[offset:offset + count * DRCOV_BLOCK.size]):
+    if module_id == 0 and size:
+      coverage.mark(base + start, base + start + size - 4)
+  return coverage
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(description='merge and compare drcov coverage files')
+  parser.add_argument('paths', nargs='+', help='drcov files of one image')
+  parser.add_argument('--merge', metavar='PATH', help='write the union of every file')
+  parser.add_argument('--diff', action='store_true', help='ranges only the first or only the second file covers')
+  args = parser.parse_args()
+
+  coverages = [read_drcov(path) for path in args.paths]
+  for path, coverage in zip(args.paths, coverages):
+    print(f'{path}: {coverage.instructions} instructions in {len(coverage.runs())} ranges')
+  if args.diff:
+    if len(coverages) != 2:
+      parser.error('--diff takes two files')
+    only_first, only_second = coverages[0].diff(coverages[1])
+    for sign, runs in (('-', only_first), ('+', only_second)):
+      for start, end in runs:
+        print(f'{sign} {start:08x}-{end:08x} ({(end - start) // 4} instructions)')
+  if args.merge:
+    merged = coverages[0]
+    for coverage in coverages[1:]:
+      merged.merge(coverage)
+    merged.write_drcov(args.merge)
+    print(f'{args.merge}: {merged.instructions} instructions')
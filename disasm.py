@@ -0,0 +1,111 @@
+import numpy as np
+from collections import namedtuple
+from core import *
+
+CHUNK_WORDS = 0x10000
+
+Line = namedtuple('Line', ['address', 'value', 'handler', 'fields'])
+
+def build_tables():
+  # flat (primary << 11 | low 11 bits) -> handler id table mirroring DISPATCH,
+  # with id 0 meaning "no handler"
+  formats = {format.unpack: format for format in FORMAT_TABLE.values()}
+  entries = [None]
+  ids = {}
+  table = np.zeros(64 << 11, dtype=np.uint16)
+
+  for primary, entry in enumerate(DISPATCH):
+    if entry is None:
+      continue
+
+    for extended, item in enumerate(entry if entry.__class__ is list else [entry] * 2048):
+      if item is None:
+        continue
+      handler, unpacker = item
+      key = (handler, unpacker)
+      if key not in ids:
+        ids[key] = len(entries)
+        entries.append((handler, formats[unpacker]))
+      table[(primary << 11) | extended] = ids[key]
+
+  return entries, table
+
+HANDLER_ENTRIES, HANDLER_INDEX = build_tables()
+
+def classify(words):
+  return HANDLER_INDEX[((words >> 26) << 11) | (words & 0x7FF)]
+
+def extract(words, format):
+  # one column per named field, every word of the group at once
+  columns = []
+  for field in format.record._fields:
+    column = 0
+    for name, shift, width, offset, _ in format.layout:
+      if name == field:
+        column = column | (((words >> shift) & ((1 << width) - 1)) << offset)
+    columns.append(column.tolist())
+  return columns
+
+class Disassembler:
+  def __init__(self, data, address=0) -> None:
+    self.data = data
+    self.address = address
+
+  @classmethod
+  def from_xex(cls, xex):
+    for section in xex.sections:
+      if section.kind == SECTION_CODE:
+        offset = section.address - xex.base_address
+        yield cls(xex.image[offset:offset+section.size], section.address)
+
+  def chunks(self):
+    count = len(self.data) // 4
+    for start in range(0, count, CHUNK_WORDS):
+      size = min(CHUNK_WORDS, count - start)
+      words = np.frombuffer(self.data, dtype='>u4', count=size, offset=start * 4).astype(np.uint32)
+      yield start, words
+
+  def records(self):
+    for start, words in self.chunks():
+      ids = classify(words)
+      fields = [None] * len(words)
+
+      for index in np.unique(ids).tolist():
+        if index == 0:
+          continue
+        positions = np.flatnonzero(ids == index)
+        record = HANDLER_ENTRIES[index][1].record
+        for position, values in zip(positions.tolist(), zip(*extract(words[positions], HANDLER_ENTRIES[index][1]))):
+          fields[position] = tuple.__new__(record, values)
+
+      base = self.address + start * 4
+      values = words.tolist()
+      ids = ids.tolist()
+      for i in range(len(values)):
+        entry = HANDLER_ENTRIES[ids[i]]
+        yield Line(base + i * 4, values[i], entry[0] if entry else None, fields[i])
+
+  def lines(self):
+    for line in self.records():
+      yield f'{line.address:08x}: {line.value:08x}  {format_line(line)}'
+
+def format_line(line):
+  if line.handler is None:
+    return f'.long {hex(line.value)}'
+  return FORMATTERS[line.handler][1](line.fields, None)
+
+def disassemble(data, address=0):
+  return Disassembler(data, address).lines()
+
+if __name__ == '__main__':
+  import sys
+  from main import TEST_DATA
+  from xex import XEX
+
+  if len(sys.argv) > 1:
+    for disassembler in Disassembler.from_xex(XEX(sys.argv[1])):
+      for text in disassembler.lines():
+        print(text)
+  else:
+    for text in disassemble(TEST_DATA):
+      print(text)
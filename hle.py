@@ -0,0 +1,427 @@
+import inspect
+import re
+import struct
+import time
+from bisect import bisect_left, insort
+from memory import *
+from xex import IMPORT_THUNK
+
+STATUS_SUCCESS = 0
+STATUS_INVALID_PARAMETER = 0xC000000D
+STATUS_NO_MEMORY = 0xC0000017
+STATUS_CONFLICTING_ADDRESSES = 0xC0000018
+STATUS_MEMORY_NOT_ALLOCATED = 0xC00000A0
+STATUS_NOT_IMPLEMENTED = 0xC0000002
+
+CREATE_SUSPENDED = 0x1
+
+MEM_COMMIT = 0x1000
+MEM_RESERVE = 0x2000
+MEM_DECOMMIT = 0x4000
+MEM_RELEASE = 0x8000
+
+# the stub every import thunk is patched with: sc, then blr back to the caller
+THUNK_STUB = struct.pack('>II', 0x44000002, 0x4E800020)
+VARIABLE_SIZE = 0x100
+
+# 100ns ticks between 1601-01-01 and the unix epoch
+FILETIME_EPOCH = 116444736000000000
+TIMEBASE_FREQUENCY = 50000000
+
+class Export:
+  __slots__ = ('library', 'ordinal', 'name', 'function', 'argc')
+
+  def __init__(self, library, ordinal, name, function) -> None:
+    self.library = library
+    self.ordinal = ordinal
+    self.name = name
+    self.function = function
+    # r3 onwards, one register per parameter after the kernel
+    self.argc = len(inspect.signature(function).parameters) - 1 if function is not None else 0
+
+# (library, ordinal) -> Export, filled by @export below
+EXPORTS = {}
+
+def export(library, ordinal):
+  def register(function):
+    EXPORTS[(library, ordinal)] = Export(library, ordinal, function.__name__, function)
+    return function
+  return register
+
+class GuestHeap:
+  # first-fit allocator over a range of guest addresses; bookkeeping lives on
+  # the host so guest memory never holds allocator headers
+  def __init__(self, base, size) -> None:
+    self.base = base
+    self.end = base + size
+    self.top = base
+    self.blocks = {} # address -> size
+    self.free = [] # sorted (address, size)
+
+  def alloc(self, size, align=16):
+    size = (max(size, 1) + align - 1) & ~(align - 1)
+    for i, (address, length) in enumerate(self.free):
+      start = (address + align - 1) & ~(align - 1)
+      if start + size <= address + length:
+        del self.free[i]
+        if start > address:
+          insort(self.free, (address, start - address))
+        if start + size < address + length:
+          insort(self.free, (start + size, address + length - start - size))
+        self.blocks[start] = size
+        return start
+
+    start = (self.top + align - 1) & ~(align - 1)
+    if start + size > self.end:
+      return 0
+    self.top = start + size
+    self.blocks[start] = size
+    return start
+
+  def block_of(self, address):
+    # start of the block holding `address`, None outside every block
+    for start, size in self.blocks.items():
+      if start <= address < start + size:
+        return start
+    return None
+
+  def release(self, address):
+    size = self.blocks.pop(address, None)
+    if size is None:
+      return 0
+
+    # merge with the neighbours so the free list does not fragment forever
+    i = bisect_left(self.free, (address, 0))
+    start, end = address, address + size
+    if i < len(self.free) and self.free[i][0] == end:
+      end += self.free.pop(i)[1]
+    if i > 0 and sum(self.free[i-1]) == start:
+      start = self.free.pop(i - 1)[0]
+    if end == self.top:
+      self.top = start
+    else:
+      insort(self.free, (start, end - start))
+    return size
+
+  def save(self):
+    return self.top, dict(self.blocks), list(self.free)
+
+  def load(self, state):
+    top, blocks, free = state
+    self.top = top
+    self.blocks = dict(blocks)
+    self.free = list(free)
+
+class Kernel:
+  # resolves a xex's imports: thunks become `sc; blr` and calls dispatch
+  # through one dict lookup on the thunk address
+  def __init__(self, vm, heap_base, heap_size) -> None:
+    self.vm = vm
+    self.memory = vm.memory
+    self.heap = GuestHeap(heap_base, heap_size)
+    self.thunks = {} # thunk address -> Export
+    self.variables = {} # (library, ordinal) -> guest address
+    self.missing = set()
+    self.current_thread = 1
+    self.scheduler = None # set by scheduler.Scheduler, threads need one
+    self.blocked = False # an export put the calling thread to sleep, see core.sc
+
+  def install(self, xex):
+    for record in xex.imports(self.read_u32):
+      library = record.library.name.lower()
+      found = EXPORTS.get((library, record.ordinal))
+      if record.kind == IMPORT_THUNK:
+        self.thunks[record.address] = found or Export(library, record.ordinal, f'{library}!{record.ordinal:#x}', None)
+        self.memory.write(record.address, THUNK_STUB, force=True)
+      else:
+        address = self.variables.get((library, record.ordinal))
+        if address is None:
+          address = self.variables[(library, record.ordinal)] = self.heap.alloc(VARIABLE_SIZE)
+        self.memory.write(record.address, struct.pack('>I', address), force=True)
+
+  def syscall(self):
+    vm = self.vm
+    address = (vm.context.iar * 4) & ADDRESS_MASK
+    entry = self.thunks.get(address)
+    if entry is None:
+      return False
+
+    gpr = vm.context.gpr
+    if entry.function is None:
+      if entry.name not in self.missing:
+        self.missing.add(entry.name)
+        vm.tracer.error(f'unimplemented import {entry.name}')
+      gpr[3] = 0
+      return True
+
+    # pointers and ints alike are 32-bit in the guest abi
+    result = entry.function(self, *[value & 0xFFFFFFFF for value in gpr[3:3+entry.argc]])
+    if result is not None:
+      gpr[3] = result & 0xFFFFFFFFFFFFFFFF
+    return True
+
+  def save(self):
+    return self.heap.save()
+
+  def load(self, state):
+    self.heap.load(state)
+
+  # guest memory helpers, all big-endian
+  def read_u16(self, address):
+    return self.memory.load_u16(address)
+
+  def read_u32(self, address):
+    return self.memory.load_u32(address)
+
+  def read_u64(self, address):
+    return self.memory.load_u64(address)
+
+  def write_u16(self, address, value):
+    self.memory.store_u16(address, value)
+
+  def write_u32(self, address, value):
+    self.memory.store_u32(address, value)
+
+  def write_u64(self, address, value):
+    self.memory.store_u64(address, value)
+
+  def read_cstring(self, address, limit=0x10000):
+    return self.memory.read_cstring(address, limit)
+
+  def read_wstring(self, address, limit=0x10000):
+    chars = []
+    while len(chars) < limit:
+      char = self.read_u16(address + len(chars) * 2)
+      if char == 0:
+        break
+      chars.append(char)
+    return chars
+
+def format_guest(kernel, text, args):
+  # printf subset for DbgPrint: %d %i %u %x %X %p %c %s and %%
+  args = iter(args)
+  def convert(match):
+    flags, spec = match.group(1), match.group(2)
+    if spec == '%':
+      return '%'
+    value = next(args, 0) & 0xFFFFFFFF
+    if spec == 's':
+      return kernel.read_cstring(value).decode('latin-1') if value else '(null)'
+    if spec == 'c':
+      return chr(value & 0xFF)
+    if spec in 'di':
+      value -= (value & 0x80000000) << 1
+      spec = 'd'
+    elif spec == 'u':
+      spec = 'd'
+    elif spec == 'p':
+      flags, spec = '08', 'x'
+    return f'{value:{flags}{spec}}'
+  return re.sub(r'%([-0-9]*)l?([diuxXpcs%])', convert, text)
+
+# memory
+
+@export('xboxkrnl.exe', 0x09)
+def ExAllocatePool(kernel, size):
+  return kernel.heap.alloc(size)
+
+@export('xboxkrnl.exe', 0x0A)
+def ExAllocatePoolWithTag(kernel, size, tag):
+  return kernel.heap.alloc(size)
+
+@export('xboxkrnl.exe', 0x0B)
+def ExAllocatePoolTypeWithTag(kernel, size, tag, pool_type):
+  return kernel.heap.alloc(size)
+
+@export('xboxkrnl.exe', 0x0F)
+def ExFreePool(kernel, address):
+  kernel.heap.release(address)
+
+def virtual_range(kernel, base, size):
+  # whole pages covering [base, base + size) inside one heap block, None if
+  # the range is not part of a single reservation
+  start = kernel.heap.block_of(base)
+  if start is None:
+    return None
+  end = start + kernel.heap.blocks[start]
+  low = base & ~PAGE_MASK
+  high = end if size == 0 else (base + size + PAGE_MASK) & ~PAGE_MASK
+  if high > end:
+    return None
+  return low, high - low
+
+@export('xboxkrnl.exe', 0xCC)
+def NtAllocateVirtualMemory(kernel, base_pointer, size_pointer, allocation_type, protect, debug):
+  # a reservation is a page aligned heap block; every page of it is mapped
+  # read/write, so committing only has to check the range
+  base = kernel.read_u32(base_pointer)
+  size = kernel.read_u32(size_pointer)
+  if size == 0 or not (allocation_type & (MEM_COMMIT | MEM_RESERVE)):
+    return STATUS_INVALID_PARAMETER
+
+  if base != 0:
+    span = virtual_range(kernel, base, size)
+    if span is None or allocation_type & MEM_RESERVE:
+      return STATUS_CONFLICTING_ADDRESSES
+    address, size = span
+  else:
+    size = (size + PAGE_MASK) & ~PAGE_MASK
+    address = kernel.heap.alloc(size, PAGE_SIZE)
+    if address == 0:
+      return STATUS_NO_MEMORY
+    # virtual memory is handed out zeroed, dropping the pages does that for free
+    kernel.memory.discard(address, size)
+  kernel.write_u32(base_pointer, address)
+  kernel.write_u32(size_pointer, size)
+  return STATUS_SUCCESS
+
+@export('xboxkrnl.exe', 0xDC)
+def NtFreeVirtualMemory(kernel, base_pointer, size_pointer, free_type, debug):
+  base = kernel.read_u32(base_pointer)
+  if free_type & MEM_DECOMMIT:
+    # the range stays reserved, its pages read back as zero once committed again
+    span = virtual_range(kernel, base, kernel.read_u32(size_pointer))
+    if span is None:
+      return STATUS_MEMORY_NOT_ALLOCATED
+    address, size = span
+    kernel.memory.discard(address, size)
+  elif free_type & MEM_RELEASE:
+    address = base
+    size = kernel.heap.release(base)
+    if not size:
+      return STATUS_MEMORY_NOT_ALLOCATED
+  else:
+    return STATUS_INVALID_PARAMETER
+  kernel.write_u32(base_pointer, address)
+  kernel.write_u32(size_pointer, size)
+  return STATUS_SUCCESS
+
+@export('xboxkrnl.exe', 0x11A)
+def RtlCompareMemory(kernel, first, second, length):
+  a = kernel.memory.read(first, length)
+  b = kernel.memory.read(second, length)
+  for i in range(length):
+    if a[i] != b[i]:
+      return i
+  return length
+
+@export('xboxkrnl.exe', 0x11B)
+def RtlCompareMemoryUlong(kernel, source, length, pattern):
+  data = kernel.memory.read(source, length & ~3)
+  expected = struct.pack('>I', pattern & 0xFFFFFFFF)
+  for i in range(0, len(data), 4):
+    if data[i:i+4] != expected:
+      return i
+  return len(data)
+
+@export('xboxkrnl.exe', 0x127)
+def RtlFillMemoryUlong(kernel, destination, length, pattern):
+  kernel.memory.write(destination, struct.pack('>I', pattern & 0xFFFFFFFF) * (length >> 2))
+
+# critical sections: dispatcher header (16 bytes), then lock count,
+# recursion count and owning thread
+
+@export('xboxkrnl.exe', 0x12E)
+def RtlInitializeCriticalSection(kernel, section):
+  kernel.memory.write(section, bytes(16))
+  kernel.write_u32(section + 0x10, 0xFFFFFFFF)
+  kernel.write_u32(section + 0x14, 0)
+  kernel.write_u32(section + 0x18, 0)
+
+@export('xboxkrnl.exe', 0x12F)
+def RtlInitializeCriticalSectionAndSpinCount(kernel, section, spin_count):
+  RtlInitializeCriticalSection(kernel, section)
+  return 0
+
+@export('xboxkrnl.exe', 0x125)
+def RtlEnterCriticalSection(kernel, section):
+  owner = kernel.read_u32(section + 0x18)
+  kernel.write_u32(section + 0x10, kernel.read_u32(section + 0x10) + 1)
+  if owner not in (0, kernel.current_thread):
+    # RtlLeaveCriticalSection hands the section over before waking us; with
+    # no scheduler there is only one thread, so a foreign owner is a guest bug
+    if kernel.scheduler is not None:
+      kernel.scheduler.wait(('section', section))
+    return
+  kernel.write_u32(section + 0x18, kernel.current_thread)
+  kernel.write_u32(section + 0x14, kernel.read_u32(section + 0x14) + 1)
+
+@export('xboxkrnl.exe', 0x130)
+def RtlLeaveCriticalSection(kernel, section):
+  recursion = kernel.read_u32(section + 0x14) - 1
+  kernel.write_u32(section + 0x14, recursion)
+  kernel.write_u32(section + 0x10, kernel.read_u32(section + 0x10) - 1)
+  if recursion == 0:
+    woken = kernel.scheduler.wake(('section', section), 1) if kernel.scheduler is not None else []
+    if woken:
+      kernel.write_u32(section + 0x18, woken[0].id)
+      kernel.write_u32(section + 0x14, 1)
+    else:
+      kernel.write_u32(section + 0x18, 0)
+
+# threads, run by scheduler.Scheduler
+
+@export('xboxkrnl.exe', 0x0D)
+def ExCreateThread(kernel, handle_pointer, stack_size, id_pointer, startup, start, context, flags):
+  # with an xapi startup routine the thread enters it with (start, context)
+  if kernel.scheduler is None:
+    kernel.vm.tracer.error('ExCreateThread: no scheduler attached, thread not created')
+    return STATUS_NOT_IMPLEMENTED
+  entry, args = (startup, (start, context)) if startup else (start, (context,))
+  thread = kernel.scheduler.create_thread(entry, args, stack_size, bool(flags & CREATE_SUSPENDED))
+  if handle_pointer:
+    kernel.write_u32(handle_pointer, thread.id)
+  if id_pointer:
+    kernel.write_u32(id_pointer, thread.id)
+  return STATUS_SUCCESS
+
+@export('xboxkrnl.exe', 0x1A)
+def ExTerminateThread(kernel, code):
+  if kernel.scheduler is not None:
+    kernel.scheduler.exit(code)
+
+@export('xboxkrnl.exe', 0x5A)
+def KeDelayExecutionThread(kernel, mode, alertable, interval_pointer):
+  # LARGE_INTEGER in 100ns units: negative is relative, positive a system time
+  interval = kernel.read_u64(interval_pointer)
+  interval -= (interval & 0x8000000000000000) << 1
+  if interval < 0:
+    seconds = -interval / 1e7
+  else:
+    seconds = (interval - FILETIME_EPOCH - time.time_ns() // 100) / 1e7
+  if kernel.scheduler is not None:
+    kernel.scheduler.sleep(seconds)
+  return STATUS_SUCCESS
+
+# strings
+
+@export('xboxkrnl.exe', 0x03)
+def DbgPrint(kernel, text, a1, a2, a3, a4, a5, a6, a7):
+  message = format_guest(kernel, kernel.read_cstring(text).decode('latin-1'), (a1, a2, a3, a4, a5, a6, a7))
+  kernel.vm.tracer.error(message.rstrip('\n'))
+  return STATUS_SUCCESS
+
+@export('xboxkrnl.exe', 0x12C)
+def RtlInitAnsiString(kernel, destination, source):
+  # ANSI_STRING: u16 length, u16 maximum length, char *buffer
+  length = len(kernel.read_cstring(source)) if source else 0
+  kernel.write_u16(destination, length)
+  kernel.write_u16(destination + 2, length + 1 if source else 0)
+  kernel.write_u32(destination + 4, source)
+
+@export('xboxkrnl.exe', 0x12D)
+def RtlInitUnicodeString(kernel, destination, source):
+  length = len(kernel.read_wstring(source)) * 2 if source else 0
+  kernel.write_u16(destination, length)
+  kernel.write_u16(destination + 2, length + 2 if source else 0)
+  kernel.write_u32(destination + 4, source)
+
+# time
+
+@export('xboxkrnl.exe', 0xA5)
+def KeQueryPerformanceFrequency(kernel):
+  return TIMEBASE_FREQUENCY
+
+@export('xboxkrnl.exe', 0xA6)
+def KeQuerySystemTime(kernel, time_pointer):
+  kernel.write_u64(time_pointer, FILETIME_EPOCH + time.time_ns() // 100)
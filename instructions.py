@@ -1,291 +1,111 @@
-import ctypes
-import struct
-
-class Instruction(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('data', ctypes.c_uint32, 26),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-
-class Bx(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('lk', ctypes.c_uint32, 1),
-      ('aa', ctypes.c_uint32, 1),
-      ('ll', ctypes.c_uint32, 24),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-
-class Bcx(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('lk', ctypes.c_uint32, 1),
-      ('aa', ctypes.c_uint32, 1),
-      ('bd', ctypes.c_uint32, 14),
-      ('bi', ctypes.c_uint32, 5),
-      ('bo', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Cmpi(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('ds', ctypes.c_uint32, 16),
-      ('ra', ctypes.c_uint32, 5),
-      ('l', ctypes.c_uint32, 1),
-      ('_unused', ctypes.c_uint32, 1),
-      ('crfd', ctypes.c_uint32, 3),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Cmpli(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('ds', ctypes.c_uint32, 16),
-      ('ra', ctypes.c_uint32, 5),
-      ('l', ctypes.c_uint32, 1),
-      ('_unused', ctypes.c_uint32, 1),
-      ('crfd', ctypes.c_uint32, 3),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Cmp(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('_unused3', ctypes.c_uint32, 1),
-      ('_unused2', ctypes.c_uint32, 10),
-      ('rb', ctypes.c_uint32, 5),
-      ('ra', ctypes.c_uint32, 5),
-      ('l', ctypes.c_uint32, 1),
-      ('_unused', ctypes.c_uint32, 1),
-      ('crfd', ctypes.c_uint32, 3),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Cmpl(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('_unused3', ctypes.c_uint32, 1),
-      ('_unused2', ctypes.c_uint32, 10),
-      ('rb', ctypes.c_uint32, 5),
-      ('ra', ctypes.c_uint32, 5),
-      ('l', ctypes.c_uint32, 1),
-      ('_unused', ctypes.c_uint32, 1),
-      ('crfd', ctypes.c_uint32, 3),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Li(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('si', ctypes.c_uint32, 16),
-      ('ra', ctypes.c_uint32, 5),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Sc(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('lev', ctypes.c_uint32, 26),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Lwz(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('ds', ctypes.c_uint32, 16),
-      ('ra', ctypes.c_uint32, 5),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Stwu(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('ds', ctypes.c_uint32, 16),
-      ('ra', ctypes.c_uint32, 5),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Stw(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('ds', ctypes.c_uint32, 16),
-      ('ra', ctypes.c_uint32, 5),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Stb(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('ds', ctypes.c_uint32, 16),
-      ('ra', ctypes.c_uint32, 5),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Or(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('rc', ctypes.c_uint32, 1),
-      ('sub', ctypes.c_uint32, 10),
-      ('rb', ctypes.c_uint32, 5),
-      ('ra', ctypes.c_uint32, 5),
-      ('rs', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-  
-class Addx(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('rc', ctypes.c_uint32, 1),
-      ('sub', ctypes.c_uint32, 9),
-      ('oe', ctypes.c_uint32, 1),
-      ('rb', ctypes.c_uint32, 5),
-      ('ra', ctypes.c_uint32, 5),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-    
-class Mfspr(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('rc', ctypes.c_uint32, 1),
-      ('sub', ctypes.c_uint32, 10),
-      ('spr', ctypes.c_uint32, 10),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-    
-class Mtspr(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('rc', ctypes.c_uint32, 1),
-      ('sub', ctypes.c_uint32, 10),
-      ('spr', ctypes.c_uint32, 10),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-
-class Bundle31(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('rc', ctypes.c_uint32, 1),
-      ('sub', ctypes.c_uint32, 9),
-      ('oe', ctypes.c_uint32, 1),
-      ('rb', ctypes.c_uint32, 5),
-      ('ra', ctypes.c_uint32, 5),
-      ('rt', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
-
-class Bundle19(ctypes.Union):
-  class _Bits(ctypes.LittleEndianStructure):
-    _fields_ = [
-      ('lk', ctypes.c_uint32, 1),
-      ('sub', ctypes.c_uint32, 10),
-      ('bh', ctypes.c_uint32, 2),
-      ('reserved', ctypes.c_uint32, 3),
-      ('bl', ctypes.c_uint32, 5),
-      ('bo', ctypes.c_uint32, 5),
-      ('opcode', ctypes.c_uint32, 6)
-    ]
-
-  _fields_ = [
-    ('value', ctypes.c_uint32),
-    ('bits', _Bits)
-  ]
\ No newline at end of file
+import ctypes
+import struct
+from collections import namedtuple
+
+# instruction formats as (field, width) pairs, least significant bit first.
+# everything below is generated from this table: the ctypes unions kept for
+# older code, and the shift/mask unpackers the decoder actually uses.
+# 'vd:5' is the part of field vd starting at its bit 5, for the VMX128 forms
+# that scatter 7-bit register numbers across the word
+FORMATS = {
+  'Instruction': [('data', 26), ('opcode', 6)],
+  'Bx': [('lk', 1), ('aa', 1), ('ll', 24), ('opcode', 6)],
+  'Bcx': [('lk', 1), ('aa', 1), ('bd', 14), ('bi', 5), ('bo', 5), ('opcode', 6)],
+  'Cmpi': [('ds', 16), ('ra', 5), ('l', 1), ('_unused', 1), ('crfd', 3), ('opcode', 6)],
+  'Cmpli': [('ds', 16), ('ra', 5), ('l', 1), ('_unused', 1), ('crfd', 3), ('opcode', 6)],
+  'Cmp': [('rc', 1), ('_unused2', 10), ('rb', 5), ('ra', 5), ('l', 1), ('_unused', 1), ('crfd', 3), ('opcode', 6)],
+  'Cmpl': [('rc', 1), ('_unused2', 10), ('rb', 5), ('ra', 5), ('l', 1), ('_unused', 1), ('crfd', 3), ('opcode', 6)],
+  'Li': [('si', 16), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Sc': [('lev', 26), ('opcode', 6)],
+  'Lwz': [('ds', 16), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Stwu': [('ds', 16), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Stw': [('ds', 16), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Stb': [('ds', 16), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Or': [('rc', 1), ('sub', 10), ('rb', 5), ('ra', 5), ('rs', 5), ('opcode', 6)],
+  'Addx': [('rc', 1), ('sub', 9), ('oe', 1), ('rb', 5), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Mfspr': [('rc', 1), ('sub', 10), ('spr', 10), ('rt', 5), ('opcode', 6)],
+  'Mtspr': [('rc', 1), ('sub', 10), ('spr', 10), ('rt', 5), ('opcode', 6)],
+  'Mfcr': [('rc', 1), ('sub', 10), ('_unused', 10), ('rt', 5), ('opcode', 6)],
+  'Mtcrf': [('rc', 1), ('sub', 10), ('_unused', 1), ('fxm', 8), ('_unused2', 1), ('rs', 5), ('opcode', 6)],
+  'Mcrf': [('lk', 1), ('sub', 10), ('_unused', 7), ('crfs', 3), ('_unused2', 2), ('crfd', 3), ('opcode', 6)],
+  'Bundle31': [('rc', 1), ('sub', 9), ('oe', 1), ('rb', 5), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Bundle19': [('lk', 1), ('sub', 10), ('bh', 2), ('reserved', 3), ('bl', 5), ('bo', 5), ('opcode', 6)],
+  'D': [('ds', 16), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'DS': [('xo', 2), ('ds', 14), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Xmem': [('_rc', 1), ('sub', 10), ('rb', 5), ('ra', 5), ('rt', 5), ('opcode', 6)],
+  'Vmem': [('_rc', 1), ('sub', 10), ('rb', 5), ('ra', 5), ('vd', 5), ('opcode', 6)],
+  'VX': [('xo', 11), ('vb', 5), ('va', 5), ('vd', 5), ('opcode', 6)],
+  'VXI': [('xo', 11), ('vb', 5), ('imm', 5), ('vd', 5), ('opcode', 6)],
+  'VXR': [('xo', 10), ('rc', 1), ('vb', 5), ('va', 5), ('vd', 5), ('opcode', 6)],
+  'VA': [('xo', 6), ('vc', 5), ('vb', 5), ('va', 5), ('vd', 5), ('opcode', 6)],
+  'VX128': [('vb:5', 2), ('vd:5', 2), ('_xo', 1), ('va:5', 1), ('_xo2', 4), ('va:6', 1), ('vb:0', 5), ('va:0', 5), ('vd:0', 5), ('opcode', 6)],
+  'VX128_1': [('_xo', 2), ('vd:5', 2), ('_xo2', 7), ('rb', 5), ('ra', 5), ('vd:0', 5), ('opcode', 6)],
+  'VX128_2': [('vb:5', 2), ('vd:5', 2), ('_xo', 1), ('va:5', 1), ('vc', 3), ('_xo2', 1), ('va:6', 1), ('vb:0', 5), ('va:0', 5), ('vd:0', 5), ('opcode', 6)],
+  'VX128_3': [('vb:5', 2), ('vd:5', 2), ('_xo', 7), ('vb:0', 5), ('imm', 5), ('vd:0', 5), ('opcode', 6)],
+  'VX128_P': [('vb:5', 2), ('vd:5', 2), ('_xo', 2), ('perm:5', 3), ('_xo2', 2), ('vb:0', 5), ('perm:0', 5), ('vd:0', 5), ('opcode', 6)],
+  'VX128_R': [('vb:5', 2), ('vd:5', 2), ('_xo', 1), ('va:5', 1), ('rc', 1), ('_xo2', 3), ('va:6', 1), ('vb:0', 5), ('va:0', 5), ('vd:0', 5), ('opcode', 6)],
+}
+
+def parse_layout(fields):
+  # (record field, shift, width, offset in the record field, ctypes name)
+  layout = []
+  shift = 0
+  for field, width in fields:
+    if not field.startswith('_'):
+      name, _, offset = field.partition(':')
+      layout.append((name, shift, width, int(offset or 0), field.replace(':', '_')))
+    shift += width
+  return layout
+
+class Format:
+  def __init__(self, name, fields) -> None:
+    self.name = name
+    self.fields = fields
+    self.layout = parse_layout(fields)
+    self.record = namedtuple(name + 'Fields', list(dict.fromkeys(field for field, *_ in self.layout)))
+    self.unpack = self.make_unpacker()
+    self.union = self.make_union()
+
+  def make_unpacker(self):
+    parts = []
+    for field in self.record._fields:
+      pieces = []
+      for name, shift, width, offset, _ in self.layout:
+        if name == field:
+          piece = f'(value >> {shift}) & {hex((1 << width) - 1)}' if shift else f'value & {hex((1 << width) - 1)}'
+          pieces.append(f'(({piece}) << {offset})' if offset else piece)
+      parts.append(' | '.join(pieces))
+
+    namespace = {'new': tuple.__new__, 'record': self.record}
+    exec(f'def unpack_{self.name}(value):\n  return new(record, ({", ".join(parts)},))', namespace)
+    return namespace[f'unpack_{self.name}']
+
+  def make_union(self):
+    bits = type('_Bits', (ctypes.LittleEndianStructure,), {
+      '_fields_': [(field.replace(':', '_'), ctypes.c_uint32, width) for field, width in self.fields]
+    })
+    return type(self.name, (ctypes.Union,), {
+      '_Bits': bits,
+      '_fields_': [('value', ctypes.c_uint32), ('bits', bits)]
+    })
+
+FORMAT_TABLE = {name: Format(name, fields) for name, fields in FORMATS.items()}
+
+# ctypes unions under their historical names (Bx, Li, Bundle31, ...)
+globals().update({name: format.union for name, format in FORMAT_TABLE.items()})
+
+def record_type(fmt):
+  return FORMAT_TABLE[fmt if isinstance(fmt, str) else fmt.__name__].record
+
+def unpack(fmt, value):
+  return FORMAT_TABLE[fmt if isinstance(fmt, str) else fmt.__name__].unpack(value)
+
+def unpack_ctypes(fmt, value):
+  # the old decode path, kept for comparison benchmarks
+  val = fmt()
+  val.value = value
+  format = FORMAT_TABLE[fmt.__name__]
+  fields = dict.fromkeys(format.record._fields, 0)
+  for name, _, _, offset, member in format.layout:
+    fields[name] |= getattr(val.bits, member) << offset
+  return format.record(**fields)
@@ -1,62 +1,67 @@
-import core
-
-TEST_DATA = bytearray([
-  0x7D, 0x88, 0x02, 0xA6, 0x91, 0x81, 0xFF, 0xF8, 0x94, 0x21, 
-  0xFF, 0x90, 0x90, 0x61, 0x00, 0x84, 0x90, 0x81, 0x00, 0x8C, 
-  0x90, 0xA1, 0x00, 0x94, 0x81, 0x61, 0x00, 0x8C, 0x2B, 0x0B, 
-  0x00, 0x01, 0x41, 0x9A, 0x00, 0x10, 0x81, 0x41, 0x00, 0x8C, 
-  0x2B, 0x0A, 0x00, 0x02, 0x40, 0x9A, 0x01, 0x40, 0x3D, 0x20, 
-  0x91, 0x88, 0x39, 0x09, 0x43, 0x10, 0xE8, 0xE8, 0x00, 0x04, 
-  0x3C, 0xC0, 0x72, 0x79, 0x60, 0xC5, 0x70, 0x74, 0x3C, 0x80, 
-  0x70, 0x72, 0x60, 0x83, 0x6F, 0x63, 0x78, 0x65, 0x00, 0x0E, 
-  0x7F, 0x27, 0x28, 0x40, 0x41, 0x9A, 0x00, 0x10, 0x39, 0x60, 
-  0x00, 0x01, 0x91, 0x61, 0x00, 0x58, 0x48, 0x00, 0x00, 0x0C, 
-  0x39, 0x40, 0x00, 0x00, 0x91, 0x41, 0x00, 0x58, 0x81, 0x21, 
-  0x00, 0x58, 0x3D, 0x00, 0x91, 0x88, 0x91, 0x28, 0x43, 0x10, 
-  0x3C, 0xE0, 0x91, 0x88, 0x80, 0xC7, 0x43, 0x10, 0x2F, 0x06, 
-  0x00, 0x00, 0x41, 0x9A, 0x00, 0xB0, 0x3C, 0xA0, 0x91, 0x88, 
-  0x38, 0x85, 0x43, 0x10, 0x80, 0x64, 0x00, 0x14, 0x7C, 0x6B, 
-  0x18, 0xF8, 0x6D, 0x6A, 0x00, 0x01, 0x69, 0x4A, 0x73, 0x94, 
-  0x91, 0x41, 0x00, 0x50, 0x3D, 0x20, 0x91, 0x88, 0x39, 0x09, 
-  0x43, 0x10, 0x80, 0xE8, 0x00, 0x18, 0x7C, 0xE6, 0x38, 0xF8, 
-  0x6C, 0xC5, 0x00, 0x06, 0x68, 0xA5, 0x15, 0x39, 0x90, 0xA1, 
-  0x00, 0x54, 0x48, 0x00, 0x00, 0x10, 0x80, 0x81, 0x00, 0x54, 
-  0x38, 0x64, 0xFF, 0xFC, 0x90, 0x61, 0x00, 0x54, 0x81, 0x61, 
-  0x00, 0x54, 0x2F, 0x0B, 0x00, 0x00, 0x41, 0x98, 0x00, 0x58, 
-  0x81, 0x41, 0x00, 0x50, 0x81, 0x2A, 0x00, 0x00, 0x69, 0x28, 
-  0x05, 0x39, 0x80, 0xE1, 0x00, 0x50, 0x91, 0x07, 0x00, 0x00, 
-  0x80, 0xC1, 0x00, 0x50, 0x80, 0xA6, 0x00, 0x00, 0x80, 0x81, 
-  0x00, 0x54, 0x7C, 0xA3, 0x22, 0x78, 0x81, 0x61, 0x00, 0x50, 
-  0x90, 0x6B, 0x00, 0x00, 0x81, 0x41, 0x00, 0x50, 0x81, 0x2A, 
-  0x00, 0x00, 0x6D, 0x28, 0x00, 0x4C, 0x69, 0x08, 0x4F, 0x4C, 
-  0x80, 0xE1, 0x00, 0x50, 0x91, 0x07, 0x00, 0x00, 0x80, 0xC1, 
-  0x00, 0x50, 0x38, 0xA6, 0x00, 0x04, 0x90, 0xA1, 0x00, 0x50, 
-  0x4B, 0xFF, 0xFF, 0x98, 0x4B, 0xFE, 0x44, 0x41, 0x80, 0xA1, 
-  0x00, 0x94, 0x80, 0x81, 0x00, 0x8C, 0x80, 0x61, 0x00, 0x84, 
-  0x4B, 0xFE, 0xC2, 0xC9, 0x2F, 0x03, 0x00, 0x01, 0x41, 0x9A, 
-  0x00, 0x0C, 0x38, 0x60, 0x00, 0x00, 0x48, 0x00, 0x00, 0x5C, 
-  0x80, 0x61, 0x00, 0x84, 0x4B, 0xFE, 0x42, 0xE9, 0x2F, 0x03, 
-  0x00, 0x00, 0x41, 0x9A, 0x00, 0x0C, 0x38, 0x60, 0x00, 0x00, 
-  0x48, 0x00, 0x00, 0x44, 0x80, 0x81, 0x00, 0x8C, 0x2B, 0x04, 
-  0x00, 0x00, 0x41, 0x9A, 0x00, 0x10, 0x80, 0x61, 0x00, 0x8C, 
-  0x2B, 0x03, 0x00, 0x03, 0x40, 0x9A, 0x00, 0x28, 0x4B, 0xFE, 
-  0x43, 0x75, 0x80, 0xA1, 0x00, 0x94, 0x80, 0x81, 0x00, 0x8C, 
-  0x80, 0x61, 0x00, 0x84, 0x4B, 0xFE, 0xC2, 0x75, 0x2F, 0x03, 
-  0x00, 0x01, 0x41, 0x9A, 0x00, 0x0C, 0x38, 0x60, 0x00, 0x00, 
-  0x48, 0x00, 0x00, 0x08, 0x38, 0x60, 0x00, 0x01, 0x38, 0x21, 
-  0x00, 0x70, 0x81, 0x81, 0xFF, 0xF8, 0x7D, 0x88, 0x03, 0xA6, 
-  0x4E, 0x80, 0x00, 0x20
-])
-
-def main():
-  machine = core.VirtualMachine(None)
-  
-  machine.data = TEST_DATA
-  machine.executing = TEST_DATA
-  
-  machine.context.gpr[3] = 1
-  machine.execute()
-  pass
-
-if __name__ == '__main__':
+import sys
+import core
+from xex import XEX
+from tracing import Tracer, Category, Level
+
+TEST_DATA = bytearray([
+  0x7D, 0x88, 0x02, 0xA6, 0x91, 0x81, 0xFF, 0xF8, 0x94, 0x21, 
+  0xFF, 0x90, 0x90, 0x61, 0x00, 0x84, 0x90, 0x81, 0x00, 0x8C, 
+  0x90, 0xA1, 0x00, 0x94, 0x81, 0x61, 0x00, 0x8C, 0x2B, 0x0B, 
+  0x00, 0x01, 0x41, 0x9A, 0x00, 0x10, 0x81, 0x41, 0x00, 0x8C, 
+  0x2B, 0x0A, 0x00, 0x02, 0x40, 0x9A, 0x01, 0x40, 0x3D, 0x20, 
+  0x91, 0x88, 0x39, 0x09, 0x43, 0x10, 0xE8, 0xE8, 0x00, 0x04, 
+  0x3C, 0xC0, 0x72, 0x79, 0x60, 0xC5, 0x70, 0x74, 0x3C, 0x80, 
+  0x70, 0x72, 0x60, 0x83, 0x6F, 0x63, 0x78, 0x65, 0x00, 0x0E, 
+  0x7F, 0x27, 0x28, 0x40, 0x41, 0x9A, 0x00, 0x10, 0x39, 0x60, 
+  0x00, 0x01, 0x91, 0x61, 0x00, 0x58, 0x48, 0x00, 0x00, 0x0C, 
+  0x39, 0x40, 0x00, 0x00, 0x91, 0x41, 0x00, 0x58, 0x81, 0x21, 
+  0x00, 0x58, 0x3D, 0x00, 0x91, 0x88, 0x91, 0x28, 0x43, 0x10, 
+  0x3C, 0xE0, 0x91, 0x88, 0x80, 0xC7, 0x43, 0x10, 0x2F, 0x06, 
+  0x00, 0x00, 0x41, 0x9A, 0x00, 0xB0, 0x3C, 0xA0, 0x91, 0x88, 
+  0x38, 0x85, 0x43, 0x10, 0x80, 0x64, 0x00, 0x14, 0x7C, 0x6B, 
+  0x18, 0xF8, 0x6D, 0x6A, 0x00, 0x01, 0x69, 0x4A, 0x73, 0x94, 
+  0x91, 0x41, 0x00, 0x50, 0x3D, 0x20, 0x91, 0x88, 0x39, 0x09, 
+  0x43, 0x10, 0x80, 0xE8, 0x00, 0x18, 0x7C, 0xE6, 0x38, 0xF8, 
+  0x6C, 0xC5, 0x00, 0x06, 0x68, 0xA5, 0x15, 0x39, 0x90, 0xA1, 
+  0x00, 0x54, 0x48, 0x00, 0x00, 0x10, 0x80, 0x81, 0x00, 0x54, 
+  0x38, 0x64, 0xFF, 0xFC, 0x90, 0x61, 0x00, 0x54, 0x81, 0x61, 
+  0x00, 0x54, 0x2F, 0x0B, 0x00, 0x00, 0x41, 0x98, 0x00, 0x58, 
+  0x81, 0x41, 0x00, 0x50, 0x81, 0x2A, 0x00, 0x00, 0x69, 0x28, 
+  0x05, 0x39, 0x80, 0xE1, 0x00, 0x50, 0x91, 0x07, 0x00, 0x00, 
+  0x80, 0xC1, 0x00, 0x50, 0x80, 0xA6, 0x00, 0x00, 0x80, 0x81, 
+  0x00, 0x54, 0x7C, 0xA3, 0x22, 0x78, 0x81, 0x61, 0x00, 0x50, 
+  0x90, 0x6B, 0x00, 0x00, 0x81, 0x41, 0x00, 0x50, 0x81, 0x2A, 
+  0x00, 0x00, 0x6D, 0x28, 0x00, 0x4C, 0x69, 0x08, 0x4F, 0x4C, 
+  0x80, 0xE1, 0x00, 0x50, 0x91, 0x07, 0x00, 0x00, 0x80, 0xC1, 
+  0x00, 0x50, 0x38, 0xA6, 0x00, 0x04, 0x90, 0xA1, 0x00, 0x50, 
+  0x4B, 0xFF, 0xFF, 0x98, 0x4B, 0xFE, 0x44, 0x41, 0x80, 0xA1, 
+  0x00, 0x94, 0x80, 0x81, 0x00, 0x8C, 0x80, 0x61, 0x00, 0x84, 
+  0x4B, 0xFE, 0xC2, 0xC9, 0x2F, 0x03, 0x00, 0x01, 0x41, 0x9A, 
+  0x00, 0x0C, 0x38, 0x60, 0x00, 0x00, 0x48, 0x00, 0x00, 0x5C, 
+  0x80, 0x61, 0x00, 0x84, 0x4B, 0xFE, 0x42, 0xE9, 0x2F, 0x03, 
+  0x00, 0x00, 0x41, 0x9A, 0x00, 0x0C, 0x38, 0x60, 0x00, 0x00, 
+  0x48, 0x00, 0x00, 0x44, 0x80, 0x81, 0x00, 0x8C, 0x2B, 0x04, 
+  0x00, 0x00, 0x41, 0x9A, 0x00, 0x10, 0x80, 0x61, 0x00, 0x8C, 
+  0x2B, 0x03, 0x00, 0x03, 0x40, 0x9A, 0x00, 0x28, 0x4B, 0xFE, 
+  0x43, 0x75, 0x80, 0xA1, 0x00, 0x94, 0x80, 0x81, 0x00, 0x8C, 
+  0x80, 0x61, 0x00, 0x84, 0x4B, 0xFE, 0xC2, 0x75, 0x2F, 0x03, 
+  0x00, 0x01, 0x41, 0x9A, 0x00, 0x0C, 0x38, 0x60, 0x00, 0x00, 
+  0x48, 0x00, 0x00, 0x08, 0x38, 0x60, 0x00, 0x01, 0x38, 0x21, 
+  0x00, 0x70, 0x81, 0x81, 0xFF, 0xF8, 0x7D, 0x88, 0x03, 0xA6, 
+  0x4E, 0x80, 0x00, 0x20
+])
+
+def main():
+  if len(sys.argv) > 1:
+    machine = core.VirtualMachine(XEX(sys.argv[1]))
+  else:
+    machine = core.VirtualMachine(None)
+    machine.load(TEST_DATA, 0)
+  
+  machine.tracer = Tracer(Category.ALL, Level.DEBUG, history=64)
+  machine.context.gpr[3] = 1
+  machine.execute()
+  pass
+
+if __name__ == '__main__':
   main()
\ No newline at end of file
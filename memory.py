@@ -0,0 +1,293 @@
+import struct
+
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+ADDRESS_MASK = 0xFFFFFFFF
+
+PAGE_READ = 1
+PAGE_WRITE = 2
+PAGE_EXEC = 4
+PAGE_RW = PAGE_READ | PAGE_WRITE
+PAGE_RWX = PAGE_READ | PAGE_WRITE | PAGE_EXEC
+
+ACCESS_NAMES = {0: 'touch', PAGE_READ: 'read', PAGE_WRITE: 'write', PAGE_EXEC: 'execute'}
+
+# big-endian layouts of the typed accessors below
+U8 = struct.Struct('>B')
+U16 = struct.Struct('>H')
+S16 = struct.Struct('>h')
+U32 = struct.Struct('>I')
+S32 = struct.Struct('>i')
+U64 = struct.Struct('>Q')
+
+class AccessViolation(Exception):
+  def __init__(self, address, access) -> None:
+    super().__init__(f'access violation: {ACCESS_NAMES.get(access, access)} at {hex(address)}')
+    self.address = address
+    self.access = access
+
+class Region:
+  # reserved range of pages, filled lazily from `source` (or zeros) on first touch
+  def __init__(self, start, end, perms, source=None, source_offset=0) -> None:
+    self.start = start
+    self.end = end
+    self.perms = perms
+    self.source = source
+    self.source_offset = source_offset
+
+  def fill(self, number):
+    page = bytearray(PAGE_SIZE)
+    if self.source is not None:
+      offset = self.source_offset + ((number - self.start) << PAGE_SHIFT)
+      chunk = self.source[offset:offset+PAGE_SIZE]
+      page[:len(chunk)] = chunk
+    return page
+
+class MemorySnapshot:
+  # resident pages at snapshot time; the page objects are shared with the
+  # address space and never written again, see AddressSpace.unshare
+  __slots__ = ('pages', 'perms')
+
+  def __init__(self, pages, perms) -> None:
+    self.pages = pages
+    self.perms = perms
+
+def make_load(layout):
+  # unpack straight out of the resident page, no intermediate bytes
+  size = layout.size
+  unpack_from = layout.unpack_from
+  def load(self, address):
+    offset = address & PAGE_MASK
+    if offset + size <= PAGE_SIZE:
+      number = address >> PAGE_SHIFT
+      page = self.pages.get(number)
+      if page is None or not (self.perms[number] & PAGE_READ):
+        page = self.page(number, PAGE_READ)
+      return unpack_from(page, offset)[0]
+    return layout.unpack(self.read(address, size))[0]
+  return load
+
+def make_store(layout):
+  # pack into the page when it is resident, writable and not shared; every
+  # other case (faults, unshare, straddling) goes through write()
+  size = layout.size
+  mask = (1 << (size * 8)) - 1
+  pack_into = layout.pack_into
+  def store(self, address, value):
+    offset = address & PAGE_MASK
+    number = address >> PAGE_SHIFT
+    page = self.pages.get(number)
+    if page is None or offset + size > PAGE_SIZE or not (self.perms[number] & PAGE_WRITE):
+      self.write(address, layout.pack(value & mask))
+      return
+    pack_into(page, offset, value & mask)
+    if self.perms[number] & PAGE_EXEC and self.on_code_write is not None:
+      self.on_code_write(address, size)
+    if self.on_write is not None:
+      self.on_write(address, size, value & mask)
+  return store
+
+class AddressSpace:
+  # sparse 32-bit guest memory: resident pages live in a dict keyed by page
+  # number, everything else is only a reservation until it is touched
+  def __init__(self) -> None:
+    self.pages = {}
+    self.perms = {}
+    self.regions = []
+    self.on_code_write = None
+    self.on_write = None # every write as (address, size, value) of at most 8 bytes
+    self.base = None # snapshot the space was last taken or restored from
+    self.cow = {} # page number -> real perms of a page still shared with a snapshot
+    self.dirty = set() # pages that differ from `base`
+
+  def map(self, address, size, perms=PAGE_RW, source=None, source_offset=0):
+    if address & PAGE_MASK:
+      raise ValueError(f'unaligned mapping at {hex(address)}')
+
+    start = address >> PAGE_SHIFT
+    end = (address + size + PAGE_MASK) >> PAGE_SHIFT
+    for region in self.regions:
+      if start < region.end and region.start < end:
+        raise ValueError(f'mapping at {hex(address)} overlaps an existing region')
+
+    self.regions.append(Region(start, end, perms, source, source_offset))
+
+  def unmap(self, address, size):
+    self.discard(address, size)
+    start = address >> PAGE_SHIFT
+    self.regions = [region for region in self.regions if region.start != start]
+
+  def discard(self, address, size):
+    # drop resident pages so the next touch refills them from their region
+    for number in range(address >> PAGE_SHIFT, (address + size + PAGE_MASK) >> PAGE_SHIFT):
+      if self.pages.pop(number, None) is not None and self.base is not None:
+        self.dirty.add(number)
+      self.perms.pop(number, None)
+      self.cow.pop(number, None)
+
+  def protect(self, address, size, perms):
+    for number in range(address >> PAGE_SHIFT, (address + size + PAGE_MASK) >> PAGE_SHIFT):
+      self.page(number, 0)
+      if number in self.cow:
+        self.cow[number] = perms
+        perms &= ~PAGE_WRITE
+      self.perms[number] = perms
+      if self.base is not None:
+        self.dirty.add(number)
+
+  def region_of(self, number):
+    for region in self.regions:
+      if region.start <= number < region.end:
+        return region
+    return None
+
+  def page(self, number, access):
+    page = self.pages.get(number)
+    if page is None:
+      region = self.region_of(number)
+      if region is None:
+        raise AccessViolation(number << PAGE_SHIFT, access)
+
+      page = self.pages[number] = region.fill(number)
+      self.perms[number] = region.perms
+      if self.base is not None:
+        # a clean fill can stay across restores, it only becomes dirty once written
+        self.cow[number] = region.perms
+        self.perms[number] = region.perms & ~PAGE_WRITE
+
+    # shared pages have their write bit masked, the real perms are in cow
+    if access and not (self.cow.get(number, self.perms[number]) & access):
+      raise AccessViolation(number << PAGE_SHIFT, access)
+    return page
+
+  def read(self, address, size, access=PAGE_READ):
+    offset = address & PAGE_MASK
+    if offset + size <= PAGE_SIZE:
+      page = self.pages.get(address >> PAGE_SHIFT)
+      if page is None or not (self.perms[address >> PAGE_SHIFT] & access):
+        page = self.page(address >> PAGE_SHIFT, access)
+      return page[offset:offset+size]
+
+    # straddles pages
+    out = bytearray()
+    while size:
+      chunk = min(size, PAGE_SIZE - (address & PAGE_MASK))
+      out += self.read(address, chunk, access)
+      address = (address + chunk) & ADDRESS_MASK
+      size -= chunk
+    return out
+
+  def read_cstring(self, address, limit=0x10000):
+    # up to the terminator, a page-sized chunk at a time
+    out = bytearray()
+    while len(out) < limit:
+      chunk = self.read(address, min(PAGE_SIZE - (address & PAGE_MASK), limit - len(out)))
+      end = chunk.find(0)
+      if end >= 0:
+        out += chunk[:end]
+        break
+      out += chunk
+      address = (address + len(chunk)) & ADDRESS_MASK
+    return bytes(out)
+
+  def fetch(self, address):
+    return self.read(address, 4, PAGE_EXEC)
+
+  def write(self, address, data, force=False):
+    # force skips the write permission check, for patching read-only code
+    size = len(data)
+    offset = address & PAGE_MASK
+    if offset + size > PAGE_SIZE:
+      chunk = PAGE_SIZE - offset
+      self.write(address, data[:chunk], force)
+      self.write((address + chunk) & ADDRESS_MASK, data[chunk:], force)
+      return
+
+    number = address >> PAGE_SHIFT
+    page = self.pages.get(number)
+    perms = self.perms.get(number, 0)
+    if page is None or not (perms & PAGE_WRITE):
+      page = self.page(number, 0 if force else PAGE_WRITE)
+      if number in self.cow:
+        page = self.unshare(number)
+      perms = self.perms[number]
+
+    page[offset:offset+size] = data
+    if perms & PAGE_EXEC and self.on_code_write is not None:
+      self.on_code_write(address, size)
+    if self.on_write is not None:
+      for start in range(0, size, 8):
+        self.on_write(address + start, min(8, size - start), int.from_bytes(data[start:start+8], 'big'))
+
+  load_u8 = make_load(U8)
+  load_u16 = make_load(U16)
+  load_s16 = make_load(S16)
+  load_u32 = make_load(U32)
+  load_s32 = make_load(S32)
+  load_u64 = make_load(U64)
+  store_u8 = make_store(U8)
+  store_u16 = make_store(U16)
+  store_u32 = make_store(U32)
+  store_u64 = make_store(U64)
+
+  def unshare(self, number):
+    # first write to a page a snapshot still holds: the space gets its own copy
+    page = self.pages[number] = bytearray(self.pages[number])
+    self.perms[number] = self.cow.pop(number)
+    self.dirty.add(number)
+    return page
+
+  def snapshot(self):
+    # no data is copied: every resident page is shared with the snapshot and
+    # loses its write bit here, so the next write to it goes through unshare()
+    perms = self.perms
+    cow = self.cow
+    snapshot = MemorySnapshot(dict(self.pages), {number: cow.get(number, value) for number, value in perms.items()})
+    for number, value in snapshot.perms.items():
+      cow[number] = value
+      perms[number] = value & ~PAGE_WRITE
+
+    self.base = snapshot
+    self.dirty = set()
+    return snapshot
+
+  def restore(self, snapshot):
+    # back to the base snapshot only the dirty pages change, anything else
+    # walks every page either side has
+    if snapshot is self.base:
+      numbers = self.dirty
+    else:
+      numbers = self.pages.keys() | snapshot.pages.keys()
+
+    for number in numbers:
+      previous = self.cow.get(number, self.perms.get(number, 0))
+      page = snapshot.pages.get(number)
+      if page is None:
+        self.pages.pop(number, None)
+        self.perms.pop(number, None)
+        self.cow.pop(number, None)
+        value = 0
+      else:
+        value = snapshot.perms[number]
+        self.pages[number] = page
+        self.cow[number] = value
+        self.perms[number] = value & ~PAGE_WRITE
+
+      if (previous | value) & PAGE_EXEC and self.on_code_write is not None:
+        self.on_code_write(number << PAGE_SHIFT, PAGE_SIZE)
+
+    self.base = snapshot
+    self.dirty = set()
+
+  @property
+  def page_count(self):
+    return len(self.pages)
+
+  @property
+  def resident_bytes(self):
+    return len(self.pages) * PAGE_SIZE
+
+  @property
+  def reserved_bytes(self):
+    return sum(region.end - region.start for region in self.regions) * PAGE_SIZE
@@ -0,0 +1,204 @@
+import io
+from core import *
+from tracing import Tracer
+
+# python versions of C runtime routines, hooked over the guest's own copies
+# with VirtualMachine.hook. Each takes the vm and the argument registers and
+# returns r3, working on whole slices of guest memory
+CRT = {}
+
+def crt(name):
+  def register(function):
+    CRT[name] = function
+    return function
+  return register
+
+def compare(a, b):
+  return (a > b) - (a < b)
+
+@crt('memcpy')
+def memcpy(vm, destination, source, size):
+  if size:
+    vm.memory.write(destination, vm.memory.read(source, size))
+  return destination
+
+@crt('memmove')
+def memmove(vm, destination, source, size):
+  # read() hands back a copy, so overlapping ranges need nothing extra
+  if size:
+    vm.memory.write(destination, vm.memory.read(source, size))
+  return destination
+
+@crt('memset')
+def memset(vm, destination, value, size):
+  if size:
+    vm.memory.write(destination, bytes((value & 0xFF,)) * size)
+  return destination
+
+@crt('memcmp')
+def memcmp(vm, first, second, size):
+  if not size:
+    return 0
+  return compare(bytes(vm.memory.read(first, size)), bytes(vm.memory.read(second, size)))
+
+@crt('strlen')
+def strlen(vm, string):
+  return len(vm.memory.read_cstring(string, ADDRESS_MASK))
+
+@crt('strcmp')
+def strcmp(vm, first, second):
+  return compare(vm.memory.read_cstring(first, ADDRESS_MASK), vm.memory.read_cstring(second, ADDRESS_MASK))
+
+@crt('strncmp')
+def strncmp(vm, first, second, size):
+  return compare(vm.memory.read_cstring(first, size), vm.memory.read_cstring(second, size))
+
+@crt('strcpy')
+def strcpy(vm, destination, source):
+  vm.memory.write(destination, vm.memory.read_cstring(source, ADDRESS_MASK) + b'\0')
+  return destination
+
+# detection. The CRT is linked statically and differs between XDK versions,
+# so candidates are recognised by behaviour instead of by bytes: each routine
+# has probes that call the candidate on scratch memory and check the result.
+# A memmove also passes the memcpy probes, so it is tried first
+
+SCRATCH = HEAP_BASE + HEAP_SIZE - 0x10000
+PROBE_LIMIT = 20000 # instructions one call of a candidate may run
+PROBE_BUDGET = 2000000 # instructions all probes of one image may run
+PATTERN = bytes(range(1, 65))
+GUARD = 0xCC
+
+def call(vm, address, *args):
+  # r3 after the candidate returned to the host, None if it did anything else
+  for number, value in enumerate(args, 3):
+    vm.context.gpr[number] = value
+  vm.context.iar = address >> 2
+  vm.context.lr = 0
+  if vm.execute(PROBE_LIMIT) is not StopReason.Returned:
+    return None
+  return vm.context.gpr[3] & 0xFFFFFFFF
+
+def fill(vm, address, data):
+  vm.memory.write(address, data)
+  return address
+
+def probe_memmove(vm, address):
+  source = fill(vm, SCRATCH, PATTERN)
+  if call(vm, address, source + 3, source, 37) != source + 3:
+    return False
+  return bytes(vm.memory.read(source, 41)) == PATTERN[:3] + PATTERN[:37] + PATTERN[40:41]
+
+def probe_memcpy(vm, address):
+  source = fill(vm, SCRATCH, PATTERN)
+  destination = fill(vm, SCRATCH + 0x100, bytes([GUARD]) * 64)
+  if call(vm, address, destination + 1, source, 37) != destination + 1:
+    return False
+  return bytes(vm.memory.read(destination, 39)) == bytes([GUARD]) + PATTERN[:37] + bytes([GUARD])
+
+def probe_memset(vm, address):
+  destination = fill(vm, SCRATCH, bytes([GUARD]) * 64)
+  if call(vm, address, destination + 1, 0x5A, 37) != destination + 1:
+    return False
+  return bytes(vm.memory.read(destination, 39)) == bytes([GUARD]) + b'\x5a' * 37 + bytes([GUARD])
+
+def probe_strlen(vm, address):
+  return call(vm, address, fill(vm, SCRATCH, b'hello, world\0')) == 12 and call(vm, address, fill(vm, SCRATCH, b'\0')) == 0
+
+def probe_strcmp(vm, address):
+  first = fill(vm, SCRATCH, b'abcd\0')
+  second = fill(vm, SCRATCH + 0x40, b'abce\0')
+  equal = fill(vm, SCRATCH + 0x80, b'abcd\0')
+  less, same = call(vm, address, first, second), call(vm, address, first, equal)
+  return less is not None and less & 0x80000000 and same == 0
+
+def probe_memcmp(vm, address):
+  first = fill(vm, SCRATCH, b'abcdXY')
+  second = fill(vm, SCRATCH + 0x40, b'abceAB')
+  less, same = call(vm, address, first, second, 4), call(vm, address, first, second, 3)
+  return less is not None and less & 0x80000000 and same == 0
+
+def probe_strcpy(vm, address):
+  source = fill(vm, SCRATCH, b'copy me\0')
+  destination = fill(vm, SCRATCH + 0x40, bytes([GUARD]) * 16)
+  if call(vm, address, destination, source) != destination:
+    return False
+  return bytes(vm.memory.read(destination, 9)) == b'copy me\0' + bytes([GUARD])
+
+PROBES = [
+  ('memmove', probe_memmove),
+  ('memcpy', probe_memcpy),
+  ('memset', probe_memset),
+  ('strlen', probe_strlen),
+  ('strcpy', probe_strcpy),
+  ('strcmp', probe_strcmp),
+  ('memcmp', probe_memcmp),
+]
+
+def identify(vm, address, budget=None):
+  # (name of the first routine whose probes all pass, instructions the probes
+  # ran). The vm is put back after, and whatever would otherwise see the
+  # probes run is detached meanwhile: tracer, recorder, profiler, coverage,
+  # the scheduler and the counters a snapshot does not hold
+  start = vm.snapshot()
+  saved = (vm.tracer, vm.recorder, vm.memory.on_write, vm.profiler, vm.coverage, vm.fault, vm.fused, vm.fusions[:], vm.block_ran)
+  vm.tracer = Tracer(sink=io.StringIO())
+  vm.recorder = vm.memory.on_write = vm.profiler = vm.coverage = None
+  kernel = vm.kernel
+  if kernel is not None:
+    scheduler, missing, blocked = kernel.scheduler, set(kernel.missing), kernel.blocked
+    kernel.scheduler = None
+  spent = 0
+  try:
+    for name, probe in PROBES:
+      if budget is not None and spent >= budget:
+        break
+      try:
+        passed = probe(vm, address)
+      except Exception:
+        passed = False
+      spent += vm.instructions - start.instructions
+      vm.restore(start)
+      if passed:
+        return name, spent
+    return None, spent
+  finally:
+    vm.restore(start)
+    vm.tracer, vm.recorder, vm.memory.on_write, vm.profiler, vm.coverage, vm.fault, vm.fused, vm.fusions, vm.block_ran = saved
+    if kernel is not None:
+      kernel.scheduler, kernel.missing, kernel.blocked = scheduler, missing, blocked
+
+def detect_crt(vm, candidates, budget=PROBE_BUDGET):
+  # guest address -> routine name for each candidate function recognised,
+  # giving up once the probes ran `budget` instructions in all
+  found = {}
+  for address in candidates:
+    if budget <= 0:
+      break
+    if vm.decode_at(address & ADDRESS_MASK) is None:
+      continue
+    name, spent = identify(vm, address & ADDRESS_MASK, budget)
+    budget -= spent
+    if name is not None:
+      found[address & ADDRESS_MASK] = name
+  return found
+
+def install_crt(vm, candidates):
+  found = detect_crt(vm, candidates)
+  for address, name in found.items():
+    vm.hook(address, CRT[name], name)
+  return found
+
+if __name__ == '__main__':
+  import argparse
+  from cfg import analyze_xex
+  from xex import XEX
+
+  parser = argparse.ArgumentParser(description='find C runtime routines in a xex by probing its functions')
+  parser.add_argument('path', help='xex image')
+  args = parser.parse_args()
+
+  xex = XEX(args.path)
+  machine = VirtualMachine(xex)
+  for address, name in sorted(detect_crt(machine, sorted(analyze_xex(xex).functions)).items()):
+    print(f'{address:08x} {name}')
@@ -0,0 +1,226 @@
+import glob
+import hashlib
+import os
+import struct
+import numpy as np
+from core import *
+
+# decoded form of an image's code, saved next to the xex as a .npy table that
+# is memory mapped on later runs. One row per code word: the word itself, an
+# index into KINDS (the handler and format it decodes to) and the unpacked
+# record fields. The file name carries a hash of the decoder tables, so a
+# changed instructions.py simply misses. A header in front of the table holds
+# the xex file's size and mtime and a hash of its contents: the contents are
+# only hashed again when the size or mtime changed
+
+LAYOUT_VERSION = 2
+NO_KIND = 0xFFFF
+SUFFIX = '.decode.npy'
+MAGIC = b'XEXPRED1'
+HEADER = struct.Struct('<8sQq16s24x') # magic, size, mtime_ns, image digest; 64 bytes keeps the table aligned
+
+def decoder_kinds():
+  # every (handler, format name) pair the eager dispatch can produce, in table order
+  kinds = []
+  for primary, extended, handler, fmt in OPCODE_TABLE:
+    kinds.append((handler, fmt))
+  for primary, pattern, mask, handler, fmt in PATTERN_TABLE:
+    kinds.append((handler, fmt))
+  return list(dict.fromkeys(kinds))
+
+KINDS = decoder_kinds()
+KIND_INDEX = {(handler, FORMAT_TABLE[fmt].record): index for index, (handler, fmt) in enumerate(KINDS)}
+MAX_FIELDS = max(len(FORMAT_TABLE[fmt].record._fields) for _, fmt in KINDS)
+ROW = np.dtype([('word', '<u4'), ('kind', '<u2'), ('fields', '<u4', (MAX_FIELDS,))])
+FIELDS_OFFSET = ROW.fields['fields'][1]
+
+def kind_entry(handler, fmt):
+  # (handler, record, unpack_from for exactly the record's fields) of a kind
+  record = FORMAT_TABLE[fmt].record
+  return handler, record, struct.Struct(f'<{len(record._fields)}I').unpack_from
+
+ENTRIES = [kind_entry(handler, fmt) for handler, fmt in KINDS]
+LAZY_ENTRIES = [kind_entry(LAZY_HANDLERS.get(handler, handler), fmt) for handler, fmt in KINDS]
+
+def decoder_version():
+  # changes whenever a format, an opcode table entry or this file's layout does
+  text = repr((LAYOUT_VERSION, sorted(FORMATS.items()), [(handler.__name__, fmt) for handler, fmt in KINDS],
+    [(primary, extended, handler.__name__, fmt) for primary, extended, handler, fmt in OPCODE_TABLE],
+    [(primary, pattern, mask, handler.__name__, fmt) for primary, pattern, mask, handler, fmt in PATTERN_TABLE]))
+  return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+DECODER_VERSION = decoder_version()
+
+def image_digest(xex):
+  # reads the whole file, only done when building or when the stamp changed
+  return hashlib.blake2b(xex.data, digest_size=16).digest()
+
+def file_stamp(xex):
+  # (size, mtime) of the xex file, None when it cannot be stat'ed
+  try:
+    stat = os.stat(xex.path)
+  except OSError:
+    return None
+  return stat.st_size, stat.st_mtime_ns
+
+def cache_path(xex):
+  return f'{xex.path}.{DECODER_VERSION}{SUFFIX}'
+
+def read_header(path):
+  # (stamp, digest) saved with the table, None for a file in another format
+  try:
+    with open(path, 'rb') as f:
+      magic, size, mtime, digest = HEADER.unpack(f.read(HEADER.size))
+  except (OSError, struct.error):
+    return None
+  if magic != MAGIC:
+    return None
+  return (size, mtime), digest
+
+def cache_valid(xex, path):
+  header = read_header(path)
+  if header is None:
+    return False
+  saved, digest = header
+  stamp = file_stamp(xex)
+  if stamp is not None and stamp == saved:
+    return True
+  if image_digest(xex) != digest:
+    return False
+  if stamp is not None:
+    # same contents with a new stamp (copied, touched): skip the hash next time
+    try:
+      with open(path, 'r+b') as f:
+        f.write(HEADER.pack(MAGIC, *stamp, digest))
+    except OSError:
+      pass
+  return True
+
+def build_table(xex, start, end):
+  table = np.zeros((end - start) // 4, dtype=ROW)
+  table['kind'] = NO_KIND
+  data = xex.image[start - xex.base_address:end - xex.base_address]
+  words = np.frombuffer(data[:len(data) & ~3], dtype='>u4')
+  table['word'][:len(words)] = words
+  for index, word in enumerate(words.tolist()):
+    entry = decode(word)
+    if entry is None:
+      continue
+    handler, record = entry
+    table[index]['kind'] = KIND_INDEX[(handler, type(record))]
+    table[index]['fields'][:len(record)] = record
+  return table
+
+class Predecoded:
+  # rows of one image's code, looked up by decode_at on a miss instead of
+  # fetching and decoding the word. The first lookup in a resident page
+  # checks the page's rows against guest memory, and words that no longer
+  # match (import thunks, patches) are left to the decoder
+  def __init__(self, table, start, path=None) -> None:
+    self.table = table
+    self.buffer = table.view(np.ndarray).view(np.uint8) # rows unpacked with struct, numpy indexing costs more than the row
+    self.start = start
+    self.end = start + len(table) * 4
+    self.path = path
+    self.pages = {} # page number -> kinds of its words, NO_KIND where a word no longer matches memory
+
+  @classmethod
+  def open(cls, path, start):
+    with open(path, 'rb') as f:
+      f.seek(HEADER.size)
+      np.lib.format.read_magic(f)
+      shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+      offset = f.tell()
+    return cls(np.memmap(path, dtype, 'r', offset, shape), start, path)
+
+  def check(self, vm, number):
+    # kinds of the page's words, padded to a whole page, None if it cannot run
+    start = max(number << PAGE_SHIFT, self.start)
+    rows = self.table.view(np.ndarray)[(start - self.start) >> 2:(min((number + 1) << PAGE_SHIFT, self.end) - self.start) >> 2]
+    page = vm.memory.pages.get(number)
+    if page is None:
+      # never touched, so still the image the table was built from; the page
+      # is not filled in, which for a compressed or encrypted image would
+      # mean decoding its whole block
+      region = vm.memory.region_of(number)
+      if region is None or region.source is not vm.xex.image or not (region.perms & PAGE_EXEC):
+        return None
+      kinds = rows['kind'].tolist()
+    else:
+      try:
+        vm.memory.page(number, PAGE_EXEC)
+      except AccessViolation:
+        return None
+      words = np.frombuffer(page, '>u4', len(rows), start & PAGE_MASK)
+      kinds = np.where(rows['word'] == words, rows['kind'], NO_KIND).tolist()
+    kinds = self.pages[number] = [NO_KIND] * ((start & PAGE_MASK) >> 2) + kinds + [NO_KIND] * (PAGE_SIZE // 4 - len(kinds))
+    return kinds
+
+  def lookup(self, vm, offset):
+    # the decode cache entry for `offset`, None when the table cannot tell
+    kinds = self.pages.get(offset >> PAGE_SHIFT)
+    if kinds is None:
+      if not (self.start <= offset < self.end):
+        return None
+      kinds = self.check(vm, offset >> PAGE_SHIFT)
+      if kinds is None:
+        return None
+    kind = kinds[(offset & PAGE_MASK) >> 2]
+    if kind == NO_KIND:
+      return None
+    handler, record, unpack = LAZY_ENTRIES[kind] if vm.dispatch is LAZY_DISPATCH else ENTRIES[kind]
+    return handler, tuple.__new__(record, unpack(self.buffer, ((offset - self.start) >> 2) * ROW.itemsize + FIELDS_OFFSET))
+
+  def invalidate(self, offset, size):
+    # written pages are checked against memory again on their next lookup
+    for number in range(offset >> PAGE_SHIFT, ((offset + size - 1) >> PAGE_SHIFT) + 1):
+      self.pages.pop(number, None)
+
+def load_predecoded(xex, create=False):
+  # the saved table for this xex, built and saved first when `create` is set;
+  # None for images without a file or code, or when it cannot be saved
+  if getattr(xex, 'path', None) is None or xex.data is None:
+    return None
+  span = xex.code_range()
+  if span is None:
+    return None
+
+  # checked before anything hashes the file, so images without a cache
+  # never read more than the pages they run
+  path = cache_path(xex)
+  if not (os.path.exists(path) and cache_valid(xex, path)):
+    if not create:
+      return None
+    try:
+      save_table(path, build_table(xex, *span), file_stamp(xex), image_digest(xex))
+    except OSError:
+      return None
+    for stale in glob.glob(f'{glob.escape(xex.path)}.*{SUFFIX}'):
+      if stale != path:
+        os.remove(stale)
+  return Predecoded.open(path, span[0])
+
+def save_table(path, table, stamp, digest):
+  # written aside and renamed, so a reader never maps half a file
+  temporary = f'{path}.{os.getpid()}.tmp'
+  with open(temporary, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, *(stamp or (0, -1)), digest))
+    np.save(f, table)
+  os.replace(temporary, path)
+
+if __name__ == '__main__':
+  import argparse
+  import time
+  from xex import XEX
+
+  parser = argparse.ArgumentParser(description='build the predecode cache next to a xex')
+  parser.add_argument('path', help='xex image')
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  xex = XEX(args.path)
+  predecoded = load_predecoded(xex, create=True)
+  if predecoded is None:
+    print('no code sections')
+  else:
+    print(f'{cache_path(xex)}: {len(predecoded.table)} words in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,169 @@
+import time
+
+class Profiler:
+  # counts come from VirtualMachine.interpret_profiled; time is charged to the
+  # guest call stack at every bl/blr, so nothing is measured per instruction
+  def __init__(self, clock=time.perf_counter_ns) -> None:
+    self.clock = clock
+    self.counts = {} # address -> executions
+    self.words = {} # address -> instruction word, read the first time it runs
+    self.leaders = set() # addresses entered by a taken branch
+    self.stack = []
+    self.stacks = {} # tuple of function entries -> host ns spent with that stack
+    self.calls = {}
+    self.names = {} # address -> symbol, sub_XXXXXXXX when missing
+    self.symbols = None # SymbolMap consulted for addresses missing from names
+    self.last = 0
+
+  def reset(self):
+    symbols = self.symbols
+    self.__init__(self.clock)
+    self.symbols = symbols
+
+  def begin(self, address):
+    if not self.stack:
+      self.stack = [address]
+      self.calls[address] = self.calls.get(address, 0) + 1
+    self.leaders.add(address)
+    self.last = self.clock()
+
+  def switch(self):
+    now = self.clock()
+    key = tuple(self.stack)
+    self.stacks[key] = self.stacks.get(key, 0) + now - self.last
+    self.last = now
+
+  def call(self, address):
+    self.switch()
+    self.stack.append(address)
+    self.calls[address] = self.calls.get(address, 0) + 1
+
+  def ret(self):
+    self.switch()
+    if len(self.stack) > 1:
+      self.stack.pop()
+
+  def end(self):
+    self.switch()
+
+  def name(self, address):
+    name = self.names.get(address)
+    if name is None and self.symbols is not None and self.symbols.lookup(address) is not None:
+      name = self.symbols.symbolize(address)
+    return name or f'sub_{address:08x}'
+
+  def where(self, address):
+    # trailing symbol column of the block and address tables
+    return f'  {self.symbols.symbolize(address)}' if self.symbols is not None else ''
+
+  def opcodes(self):
+    # (primary, extended or None) -> executions; vector opcodes key on the
+    # low 11 bits of the word
+    histogram = {}
+    for address, count in self.counts.items():
+      word = self.words[address]
+      primary = word >> 26
+      key = (primary, (word >> 1) & 0x3FF if primary in (19, 31) else word & 0x7FF if primary in (4, 5, 6) else None)
+      histogram[key] = histogram.get(key, 0) + count
+    return histogram
+
+  def blocks(self):
+    # split the executed addresses at branch targets and gaps; each block
+    # is (start, instruction count, instructions executed inside it)
+    result = []
+    start = previous = None
+    size = total = 0
+    for address in sorted(self.counts):
+      if start is None or address != previous + 4 or address in self.leaders:
+        if start is not None:
+          result.append((start, size, total))
+        start, size, total = address, 0, 0
+      size += 1
+      total += self.counts[address]
+      previous = address
+    if start is not None:
+      result.append((start, size, total))
+    return result
+
+  def functions(self):
+    # function -> (calls, self ns, total ns)
+    times = {}
+    for stack, ns in self.stacks.items():
+      top = stack[-1]
+      calls, own, total = times.get(top, (self.calls.get(top, 0), 0, 0))
+      times[top] = (calls, own + ns, total)
+      for address in set(stack):
+        calls, own, total = times.get(address, (self.calls.get(address, 0), 0, 0))
+        times[address] = (calls, own, total + ns)
+    return times
+
+  def report(self, top=20):
+    from core import FORMATTERS, decode
+    lines = []
+    executed = sum(self.counts.values()) or 1
+
+    lines.append(f'{"opcode":>8} {"handler":12} {"count":>10} {"share":>7}')
+    for (primary, extended), count in sorted(self.opcodes().items(), key=lambda item: -item[1])[:top]:
+      word = (primary << 26) | ((extended << 1) if primary in (19, 31) else (extended or 0))
+      entry = decode(word)
+      name = entry[0].__name__ if entry is not None else '?'
+      key = f'{primary}' if extended is None else f'{primary}/{extended}'
+      lines.append(f'{key:>8} {name:12} {count:10} {count * 100 / executed:6.2f}%')
+
+    lines.append('')
+    lines.append(f'{"block":>10} {"insns":>6} {"executed":>10} {"share":>7}')
+    for start, size, total in sorted(self.blocks(), key=lambda block: -block[2])[:top]:
+      lines.append(f'{start:10x} {size:6} {total:10} {total * 100 / executed:6.2f}%{self.where(start)}')
+
+    lines.append('')
+    lines.append(f'{"address":>10} {"count":>10}  instruction')
+    for address, count in sorted(self.counts.items(), key=lambda item: -item[1])[:top]:
+      entry = decode(self.words[address])
+      text = FORMATTERS[entry[0]][1](entry[1], None) if entry is not None else f'.long {hex(self.words[address])}'
+      lines.append(f'{address:10x} {count:10}  {text}{self.where(address)}')
+
+    lines.append('')
+    lines.append(f'{"function":24} {"calls":>8} {"self ms":>10} {"total ms":>10}')
+    for address, (calls, own, total) in sorted(self.functions().items(), key=lambda item: -item[1][1])[:top]:
+      lines.append(f'{self.name(address):24} {calls:8} {own / 1e6:10.3f} {total / 1e6:10.3f}')
+    return '\n'.join(lines)
+
+  def collapsed(self):
+    # one "outer;inner microseconds" line per stack, the input flamegraph.pl expects
+    for stack, ns in sorted(self.stacks.items()):
+      if ns >= 1000:
+        yield f'{";".join(self.name(address) for address in stack)} {ns // 1000}'
+
+  def write_collapsed(self, path):
+    with open(path, 'w') as f:
+      for line in self.collapsed():
+        f.write(line + '\n')
+
+if __name__ == '__main__':
+  import argparse
+  import core
+  from main import TEST_DATA
+  from xex import XEX
+
+  parser = argparse.ArgumentParser(description='run a guest program under the profiler')
+  parser.add_argument('path', nargs='?', help='xex to run, the built-in test data when missing')
+  parser.add_argument('--top', type=int, default=20)
+  parser.add_argument('--collapsed', metavar='PATH', help='write collapsed stacks for flame graphs')
+  parser.add_argument('--symbols', metavar='PATH', help='linker .map or csv naming guest addresses')
+  args = parser.parse_args()
+
+  if args.path:
+    machine = core.VirtualMachine(XEX(args.path))
+  else:
+    machine = core.VirtualMachine(None)
+    machine.load(TEST_DATA, 0)
+
+  machine.profiler = Profiler()
+  if args.symbols:
+    from symbols import load_symbols
+    machine.use_symbols(load_symbols(args.symbols))
+  machine.context.gpr[3] = 1
+  machine.execute()
+  print(machine.profiler.report(args.top))
+  if args.collapsed:
+    machine.profiler.write_collapsed(args.collapsed)
@@ -0,0 +1,283 @@
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from itertools import compress
+from operator import ne
+import numpy as np
+
+# binary execution trace. The recorder keeps three streams of fixed-width
+# records in arrays and writes them out as one zlib compressed chunk every
+# `chunk` instructions:
+#   steps      u32 pairs (iar, instruction word), one per instruction
+#   registers  u64 triples (seq, register, value), each register an instruction changed
+#   writes     u64 quads (seq, address, size, value), values of at most 8 bytes
+# seq is the index of the instruction in the whole trace, and every record
+# lands in the chunk holding its instruction. On disk everything is little-endian
+
+MAGIC = b'XTRC'
+VERSION = 1
+HEADER = struct.Struct('<4sI')
+# first seq, record count of each stream, compressed size of each stream
+CHUNK = struct.Struct('<QIIIIII')
+CHUNK_STEPS = 0x10000
+
+REGISTER_NAMES = [f'r{number}' for number in range(32)] + ['lr', 'ctr', 'cr', 'xer']
+REGISTER_LR = 32
+REGISTER_CTR = 33
+REGISTER_CR = 34
+REGISTER_XER = 35
+GPR_NUMBERS = range(32)
+
+def register_number(register):
+  if isinstance(register, str):
+    return REGISTER_NAMES.index(register)
+  return register
+
+def pack(stream):
+  if sys.byteorder != 'little':
+    stream = array(stream.typecode, stream)
+    stream.byteswap()
+  return stream.tobytes()
+
+class TraceRecorder:
+  # attach() makes the vm run through interpret_recorded; close() writes the
+  # last chunk and detaches
+  def __init__(self, path, chunk=CHUNK_STEPS, level=1) -> None:
+    self.file = open(path, 'wb')
+    self.file.write(HEADER.pack(MAGIC, VERSION))
+    self.chunk = chunk
+    self.level = level
+    self.vm = None
+    self.steps = array('I')
+    self.registers = array('Q')
+    self.writes = array('Q')
+    self.words = {} # address -> instruction word, dropped on code writes
+    self.first = 0 # seq of the first instruction in the buffers
+    self.count = 0
+    self.seq = 0 # instruction the next register and memory records belong to
+    self.chunks = 0
+
+  def attach(self, vm):
+    self.vm = vm
+    vm.recorder = self
+    vm.memory.on_write = self.write
+
+  def detach(self):
+    if self.vm is not None:
+      self.vm.recorder = None
+      self.vm.memory.on_write = None
+      self.vm = None
+
+  def step(self, iar):
+    if self.count - self.first >= self.chunk:
+      self.flush()
+    word = self.words.get(iar)
+    if word is None:
+      word = self.words[iar] = self.vm.memory.load_u32(iar)
+    self.steps.extend((iar, word))
+    self.seq = self.count
+    self.count += 1
+
+  def changed(self, gpr, before):
+    registers = self.registers
+    for number in compress(GPR_NUMBERS, map(ne, gpr, before)):
+      registers.extend((self.seq, number, gpr[number] & 0xFFFFFFFFFFFFFFFF))
+
+  def changed_special(self, context, before):
+    # lr is recorded as a byte address like iar in the steps
+    for number, value in zip(range(REGISTER_LR, REGISTER_XER + 1), ((context.lr * 4) & 0xFFFFFFFF, context.ctr, context.get_cr(), context.get_xer())):
+      if value != before[number - REGISTER_LR]:
+        self.registers.extend((self.seq, number, value & 0xFFFFFFFFFFFFFFFF))
+
+  def write(self, address, size, value):
+    self.writes.extend((self.seq, address, size, value))
+
+  def invalidate(self, offset, size):
+    words = self.words
+    for address in range(offset & ~3, offset + size, 4):
+      words.pop(address, None)
+
+  def flush(self):
+    if self.count == self.first:
+      return
+    blobs = [zlib.compress(pack(stream), self.level) for stream in (self.steps, self.registers, self.writes)]
+    self.file.write(CHUNK.pack(self.first, len(self.steps) // 2, len(self.registers) // 3, len(self.writes) // 4, *map(len, blobs)))
+    for blob in blobs:
+      self.file.write(blob)
+    self.steps = array('I')
+    self.registers = array('Q')
+    self.writes = array('Q')
+    self.first = self.count
+    self.chunks += 1
+
+  def close(self):
+    self.flush()
+    self.detach()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+class Chunk:
+  __slots__ = ('first', 'count', 'offset', 'sizes', 'counts')
+
+  def __init__(self, first, count, offset, sizes, counts) -> None:
+    self.first = first
+    self.count = count
+    self.offset = offset
+    self.sizes = sizes
+    self.counts = counts
+
+class TraceReader:
+  # the file is memory mapped and only the chunk index is read up front;
+  # chunks are decompressed into numpy arrays as queries reach them
+  def __init__(self, path) -> None:
+    self.file = open(path, 'rb')
+    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version = HEADER.unpack_from(self.map, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError(f'{path} is not a version {VERSION} trace')
+
+    self.chunks = []
+    offset = HEADER.size
+    while offset + CHUNK.size <= len(self.map):
+      first, steps, registers, writes, *sizes = CHUNK.unpack_from(self.map, offset)
+      offset += CHUNK.size
+      self.chunks.append(Chunk(first, steps, offset, sizes, (registers, writes)))
+      offset += sum(sizes)
+    self.cached = None
+
+  def close(self):
+    self.cached = None
+    self.map.close()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def __len__(self):
+    return sum(chunk.count for chunk in self.chunks)
+
+  def load(self, chunk):
+    # (steps (n, 2) u32, registers (n, 3) u64, writes (n, 4) u64) of one chunk
+    if self.cached is not None and self.cached[0] is chunk:
+      return self.cached[1]
+    arrays = []
+    offset = chunk.offset
+    for size, dtype, width in zip(chunk.sizes, ('<u4', '<u8', '<u8'), (2, 3, 4)):
+      data = zlib.decompress(self.map[offset:offset+size])
+      arrays.append(np.frombuffer(data, dtype).reshape(-1, width))
+      offset += size
+    self.cached = (chunk, arrays)
+    return arrays
+
+  def steps(self, start=0, stop=None):
+    # (seq, iar, word) for every instruction in [start, stop)
+    for chunk in self.chunks:
+      if chunk.first + chunk.count <= start:
+        continue
+      if stop is not None and chunk.first >= stop:
+        break
+      steps = self.load(chunk)[0]
+      low = max(start - chunk.first, 0)
+      high = chunk.count if stop is None else min(stop - chunk.first, chunk.count)
+      for index in range(low, high):
+        yield chunk.first + index, int(steps[index, 0]), int(steps[index, 1])
+
+  def iar(self, seq):
+    for chunk in self.chunks:
+      if chunk.first <= seq < chunk.first + chunk.count:
+        return int(self.load(chunk)[0][seq - chunk.first, 0])
+    raise IndexError(seq)
+
+  def last_writer(self, address, before=None):
+    # (seq, iar, size, value) of the last write covering `address` by an
+    # instruction before seq `before`, None if nothing wrote it
+    for chunk in reversed(self.chunks):
+      if before is not None and chunk.first >= before:
+        continue
+      steps, _, writes = self.load(chunk)
+      start = writes[:, 1]
+      hits = (start <= address) & (address < start + writes[:, 2])
+      if before is not None:
+        hits &= writes[:, 0] < before
+      found = np.flatnonzero(hits)
+      if len(found):
+        seq, _, size, value = (int(field) for field in writes[found[-1]])
+        return seq, int(steps[seq - chunk.first, 0]), size, value
+    return None
+
+  def history(self, register):
+    # [(seq, iar, value)] of every change to `register`, a number or a name
+    # from REGISTER_NAMES
+    number = register_number(register)
+    result = []
+    for chunk in self.chunks:
+      steps, registers, _ = self.load(chunk)
+      for seq, _, value in registers[registers[:, 1] == number]:
+        result.append((int(seq), int(steps[int(seq) - chunk.first, 0]), int(value)))
+    return result
+
+  def path(self, start, end):
+    # addresses executed from the first time `start` runs up to the next time
+    # `end` runs after it, both included; None if the trace has no such path
+    result = None
+    for chunk in self.chunks:
+      iars = self.load(chunk)[0][:, 0]
+      if result is None:
+        found = np.flatnonzero(iars == start)
+        if not len(found):
+          continue
+        iars = iars[found[0]:]
+        result = [start]
+        iars = iars[1:]
+      found = np.flatnonzero(iars == end)
+      if len(found):
+        result += iars[:found[0] + 1].tolist()
+        return result
+      result += iars.tolist()
+    return None
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(description='query a binary execution trace')
+  parser.add_argument('path', help='trace written by TraceRecorder')
+  parser.add_argument('--writer', metavar='ADDRESS', help='last instruction to write an address')
+  parser.add_argument('--history', metavar='REGISTER', help='every change to a register, r3 or lr')
+  parser.add_argument('--path', nargs=2, metavar=('START', 'END'), dest='between', help='addresses executed between two points')
+  parser.add_argument('--symbols', metavar='PATH', help='linker .map or csv naming guest addresses')
+  args = parser.parse_args()
+
+  where = lambda address: f'{address:08x}'
+  if args.symbols:
+    from symbols import load_symbols
+    symbols = load_symbols(args.symbols)
+    where = lambda address: f'{address:08x} {symbols.symbolize(address)}'
+
+  with TraceReader(args.path) as reader:
+    print(f'{len(reader)} instructions in {len(reader.chunks)} chunks')
+    if args.writer:
+      found = reader.last_writer(int(args.writer, 16))
+      if found is None:
+        print('never written')
+      else:
+        seq, iar, size, value = found
+        print(f'#{seq} {where(iar)} wrote {value:0{size * 2}x}')
+    if args.history:
+      for seq, iar, value in reader.history(args.history):
+        print(f'#{seq} {where(iar)} {args.history} = {value:x}')
+    if args.between:
+      addresses = reader.path(int(args.between[0], 16), int(args.between[1], 16))
+      if addresses is None:
+        print('no path')
+      else:
+        print(('\n' if args.symbols else ' ').join(map(where, addresses)))
@@ -1,51 +1,160 @@
-
-from enum import IntFlag
-
-class Cr(IntFlag):
-  lt = 0,
-  gt = 1,
-  eq = 2,
-  so = 3
-
-class Registers:
-  class XER:
-    def __init__(self):
-      self.value = 0
-
-    @property
-    def so(self):
-      return (self.value >> 0) & 1
-
-    @so.setter
-    def so(self, val):
-      self.value = (self.value & ~0x1) | (val << 0)
-
-    @property
-    def ov(self):
-      return (self.value >> 1) & 1
-
-    @ov.setter
-    def ov(self, val):
-      self.value = (self.value & ~0x2) | (val << 1)
-
-    @property
-    def ca(self):
-      return (self.value >> 2) & 1
-
-    @ca.setter
-    def ca(self, val):
-      self.value = (self.value & ~0x4) | (val << 2)
-
-  class CRBit:
-    LT, GT, EQ, SO = range(4)
-
-  def __init__(self):
-    self.msr = 0
-    self.iar = 0
-    self.lr = 0
-    self.ctr = 0
-    self.gpr = [0] * 32
-    self.xer = Registers.XER()
-    self.cr = [[False, False, False, False] for _ in range(8)]  # Lists of 4 booleans
-    self.fpscr = 0.0
-    self.fpr = [0.0] * 32
\ No newline at end of file
+import numpy as np
+from enum import IntFlag
+
+class Cr(IntFlag):
+  lt = 0,
+  gt = 1,
+  eq = 2,
+  so = 3
+
+# bits of one 4-bit CR field
+CR_LT = 0b1000
+CR_GT = 0b0100
+CR_EQ = 0b0010
+CR_SO = 0b0001
+
+XER_SO = 0x80000000
+XER_OV = 0x40000000
+XER_CA = 0x20000000
+
+# vmx128: 128 registers of 16 bytes in one array, kept in guest (big-endian)
+# byte order so memory moves are plain copies; lanes are read through views
+VR_COUNT = 128
+VR_U16 = np.dtype('>u2')
+VR_S16 = np.dtype('>i2')
+VR_U32 = np.dtype('>u4')
+VR_S32 = np.dtype('>i4')
+VR_F32 = np.dtype('>f4')
+VSCR_SAT = 0x1
+
+# reservations cover one 128 byte cache line
+RESERVE_MASK = ~0x7F & 0xFFFFFFFF
+
+def cr_shift(field):
+  # cr0 is the most significant nibble
+  return 28 - (field << 2)
+
+def evaluate_field(a, b, so):
+  # a deferred cr field: a compare of a against b, or with b None the
+  # record form of an arithmetic result a
+  if b is None:
+    field = CR_EQ if a == 0 else CR_LT if a & 0x80000000 else CR_GT
+  else:
+    field = CR_LT if a < b else CR_GT if a > b else CR_EQ
+  return field | CR_SO if so else field
+
+def add_overflows(a, b, result):
+  return (a ^ ~b) & (a ^ result) & 0x80000000
+
+class Registers:
+  __slots__ = ('msr', 'iar', 'lr', 'ctr', 'gpr', 'xer', 'cr', 'fpscr', 'fpr', 'vr', 'vscr', 'reserve', 'lazy_cr', 'lazy_xer')
+
+  def __init__(self):
+    self.msr = 0
+    self.iar = 0
+    self.lr = 0
+    self.ctr = 0
+    self.gpr = [0] * 32
+    self.xer = 0
+    self.cr = 0 # 8 fields of 4 bits, cr0 in bits 31-28
+    self.fpscr = 0.0
+    self.fpr = [0.0] * 32
+    self.vr = np.zeros((VR_COUNT, 16), dtype=np.uint8)
+    self.vscr = 0
+    self.reserve = None # granule reserved by the last lwarx/ldarx, None once lost
+    # lazy flags: cr field -> (a, b, so) still to be evaluated, and the
+    # operands of the last addo whose OV/SO update is still pending
+    self.lazy_cr = {}
+    self.lazy_xer = None
+
+  def resolve_cr(self, field):
+    pending = self.lazy_cr.pop(field, None)
+    if pending is not None:
+      shift = cr_shift(field)
+      self.cr = (self.cr & ~(0xF << shift)) | (evaluate_field(*pending) << shift)
+
+  def resolve_xer(self):
+    a, b, result = self.lazy_xer
+    self.lazy_xer = None
+    if add_overflows(a, b, result):
+      self.xer |= XER_SO | XER_OV
+    else:
+      self.xer &= ~XER_OV
+
+  def flush(self):
+    # evaluate everything deferred, before the whole cr or xer is observed
+    if self.lazy_xer is not None:
+      self.resolve_xer()
+    for field in list(self.lazy_cr):
+      self.resolve_cr(field)
+
+  def get_cr(self):
+    if self.lazy_cr:
+      self.flush()
+    return self.cr
+
+  def get_xer(self):
+    if self.lazy_xer is not None:
+      self.resolve_xer()
+    return self.xer
+
+  def get_cr_field(self, field):
+    if self.lazy_cr:
+      self.resolve_cr(field)
+    return (self.cr >> cr_shift(field)) & 0xF
+
+  def set_cr_field(self, field, value):
+    if self.lazy_cr:
+      self.lazy_cr.pop(field, None)
+    shift = cr_shift(field)
+    self.cr = (self.cr & ~(0xF << shift)) | ((value & 0xF) << shift)
+
+  def get_cr_bit(self, bit):
+    # bit 0 is cr0[lt], as numbered in the BI field of branches
+    if self.lazy_cr:
+      self.resolve_cr(bit >> 2)
+    return (self.cr >> (31 - bit)) & 1
+
+  def copy(self):
+    other = Registers.__new__(Registers)
+    other.load(self)
+    return other
+
+  def load(self, other):
+    other.flush()
+    self.lazy_cr = {}
+    self.lazy_xer = None
+    self.msr = other.msr
+    self.iar = other.iar
+    self.lr = other.lr
+    self.ctr = other.ctr
+    self.gpr = other.gpr[:]
+    self.xer = other.xer
+    self.cr = other.cr
+    self.fpscr = other.fpscr
+    self.fpr = other.fpr[:]
+    self.vr = other.vr.copy()
+    self.vscr = other.vscr
+    self.reserve = other.reserve
+
+  def __eq__(self, other):
+    if not isinstance(other, Registers):
+      return NotImplemented
+    self.flush()
+    other.flush()
+    return all(np.array_equal(getattr(self, name), getattr(other, name)) if name == 'vr' else getattr(self, name) == getattr(other, name) for name in Registers.__slots__)
+
+  def diff(self, other):
+    # names of the registers that differ, for snapshot and test output
+    changed = []
+    self.flush()
+    other.flush()
+    for name in Registers.__slots__:
+      mine, theirs = getattr(self, name), getattr(other, name)
+      if isinstance(mine, list):
+        changed += [f'{name}{i}' for i, (a, b) in enumerate(zip(mine, theirs)) if a != b]
+      elif isinstance(mine, np.ndarray):
+        changed += [f'{name}{i}' for i in np.flatnonzero((mine != theirs).any(axis=1))]
+      elif mine != theirs:
+        changed.append(name)
+    return changed
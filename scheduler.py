@@ -0,0 +1,249 @@
+import asyncio
+import heapq
+import time
+from collections import deque
+from core import *
+
+# guest threads over one VirtualMachine: each thread is a Registers context
+# swapped into vm.context for a quantum of instructions at a time, round
+# robin. Kernel exports block the running thread through wait()/sleep() and
+# return to the scheduler with IterPause, so no waiting thread ever spins
+
+QUANTUM = 0x2000
+# thread stacks after the main one, a slot per thread id
+THREAD_STACKS = STACK_BASE + 0x01000000
+THREAD_STACK_SLOT = 0x00100000
+DEFAULT_STACK_SIZE = 0x10000
+
+STATUS_TIMEOUT = 0x00000102
+
+@unique
+class ThreadState(Enum):
+  Ready = 0,
+  Running = auto(),
+  Waiting = auto(), # on a wait() key, maybe with a deadline
+  Sleeping = auto(),
+  Suspended = auto(),
+  Exited = auto()
+
+class GuestThread:
+  __slots__ = ('id', 'context', 'state', 'stack', 'stack_size', 'waiting', 'deadline', 'exit_code', 'instructions')
+
+  def __init__(self, id, context, stack=None, stack_size=0) -> None:
+    self.id = id
+    self.context = context
+    self.state = ThreadState.Ready
+    self.stack = stack # None for the main thread, whose stack the vm owns
+    self.stack_size = stack_size
+    self.waiting = None
+    self.deadline = None
+    self.exit_code = None
+    self.instructions = 0
+
+  def __repr__(self):
+    return f'<thread {self.id} {self.state.name} at {hex((self.context.iar * 4) & ADDRESS_MASK)}>'
+
+class Scheduler:
+  # the current vm.context becomes thread 1; vm.kernel (when the xex has
+  # imports) gets a back reference so its exports can create and block threads
+  def __init__(self, vm: VirtualMachine, quantum=QUANTUM, clock=time.monotonic) -> None:
+    self.vm = vm
+    self.quantum = quantum
+    self.clock = clock
+    self.threads = {}
+    self.ready = deque()
+    self.sleepers = [] # heap of (deadline, sequence, thread)
+    self.waiters = {} # wait key -> deque of threads
+    self.sequence = 0
+    self.next_id = 1
+    self.current = None
+    self.switches = 0
+
+    if vm.context.gpr[1] == 0:
+      vm.context.gpr[1] = STACK_BASE + STACK_SIZE // 2
+    self.main = self.adopt(vm.context)
+    if vm.kernel is not None:
+      vm.kernel.scheduler = self
+
+  def adopt(self, context, stack=None, stack_size=0):
+    thread = GuestThread(self.next_id, context, stack, stack_size)
+    self.next_id += 1
+    self.threads[thread.id] = thread
+    self.ready.append(thread)
+    return thread
+
+  def create_thread(self, entry, args=(), stack_size=DEFAULT_STACK_SIZE, suspended=False):
+    # starts at `entry` with args in r3 onwards; returning to lr 0 ends it
+    stack = THREAD_STACKS + self.next_id * THREAD_STACK_SLOT
+    stack_size = min((max(stack_size, DEFAULT_STACK_SIZE) + PAGE_MASK) & ~PAGE_MASK, THREAD_STACK_SLOT)
+    self.vm.memory.map(stack, stack_size, PAGE_RW)
+
+    context = Registers()
+    context.iar = (entry & ADDRESS_MASK) // 4
+    context.gpr[1] = stack + stack_size - 0x100
+    for number, value in enumerate(args, 3):
+      context.gpr[number] = value & ADDRESS_MASK
+    thread = self.adopt(context, stack, stack_size)
+    if suspended:
+      self.ready.remove(thread)
+      thread.state = ThreadState.Suspended
+    return thread
+
+  def resume(self, thread):
+    if thread.state is ThreadState.Suspended:
+      self.make_ready(thread)
+
+  def make_ready(self, thread):
+    thread.state = ThreadState.Ready
+    thread.waiting = None
+    thread.deadline = None
+    self.ready.append(thread)
+
+  # called from kernel exports on behalf of the running thread
+
+  def block(self, state, deadline):
+    thread = self.current
+    thread.state = state
+    if deadline is not None:
+      thread.deadline = deadline
+      self.sequence += 1
+      heapq.heappush(self.sleepers, (deadline, self.sequence, thread))
+    if self.vm.kernel is not None:
+      self.vm.kernel.blocked = True
+
+  def sleep(self, seconds):
+    # zero only yields the rest of the quantum
+    self.block(ThreadState.Sleeping, self.clock() + max(seconds, 0))
+
+  def wait(self, key, seconds=None):
+    # until wake(key); a timeout leaves STATUS_TIMEOUT in r3
+    self.current.waiting = key
+    self.waiters.setdefault(key, deque()).append(self.current)
+    self.block(ThreadState.Waiting, None if seconds is None else self.clock() + seconds)
+
+  def wake(self, key, count=None):
+    # threads released from `key`, oldest first; r3 is left as the export set it
+    queue = self.waiters.get(key)
+    woken = []
+    while queue and (count is None or len(woken) < count):
+      thread = queue.popleft()
+      self.make_ready(thread)
+      woken.append(thread)
+    if not queue:
+      self.waiters.pop(key, None)
+    return woken
+
+  def exit(self, code):
+    self.current.exit_code = code & ADDRESS_MASK
+    self.block(ThreadState.Exited, None)
+
+  # host loop
+
+  def switch_to(self, thread):
+    if self.current is not thread:
+      if self.current is not None:
+        # another thread runs in between, so whatever it reserved is lost
+        self.current.context.reserve = None
+      self.vm.context = thread.context
+      if self.vm.kernel is not None:
+        self.vm.kernel.current_thread = thread.id
+      self.switches += 1
+    self.current = thread
+    thread.state = ThreadState.Running
+
+  def wake_sleepers(self):
+    now = self.clock()
+    while self.sleepers and self.sleepers[0][0] <= now:
+      deadline, _, thread = heapq.heappop(self.sleepers)
+      if thread.deadline != deadline or thread.state not in (ThreadState.Sleeping, ThreadState.Waiting):
+        continue
+      if thread.state is ThreadState.Waiting:
+        self.waiters[thread.waiting].remove(thread)
+        if not self.waiters[thread.waiting]:
+          del self.waiters[thread.waiting]
+        thread.context.gpr[3] = STATUS_TIMEOUT
+      self.make_ready(thread)
+
+  def finish(self, thread):
+    thread.state = ThreadState.Exited
+    if thread.exit_code is None:
+      thread.exit_code = thread.context.gpr[3] & ADDRESS_MASK
+    if thread.stack is not None:
+      self.vm.memory.unmap(thread.stack, thread.stack_size)
+    self.wake(thread)
+
+  @property
+  def alive(self):
+    return any(thread.state is not ThreadState.Exited for thread in self.threads.values())
+
+  def slices(self, max_instructions=None, max_seconds=None):
+    # generator behind run() and run_async(): yields the seconds to idle
+    # between quanta (0 after a quantum ran) and returns the StopReason
+    vm = self.vm
+    limit = NO_LIMIT if max_instructions is None else max_instructions
+    deadline = None if max_seconds is None else time.perf_counter() + max_seconds
+
+    while True:
+      self.wake_sleepers()
+      if not self.ready:
+        if not self.alive:
+          return StopReason.Returned
+        if not self.sleepers:
+          # every thread waits on something only the host can signal
+          return StopReason.Paused
+        delay = self.sleepers[0][0] - self.clock()
+        if deadline is not None:
+          remaining = deadline - time.perf_counter()
+          if remaining <= 0:
+            return StopReason.Timeout
+          delay = min(delay, remaining)
+        yield max(delay, 0)
+        continue
+
+      thread = self.ready.popleft()
+      self.switch_to(thread)
+      start = vm.instructions
+      reason = vm.run(min(self.quantum, limit))
+      executed = vm.instructions - start
+      thread.instructions += executed
+      limit -= executed
+
+      if reason is StopReason.Returned or thread.state is ThreadState.Exited:
+        self.finish(thread)
+      elif reason is StopReason.Budget:
+        self.make_ready(thread)
+      elif reason is StopReason.Paused and thread.state is not ThreadState.Running:
+        pass # blocked in a kernel export
+      else:
+        # a fault, or a pause nobody here asked for; the thread stays current
+        self.ready.appendleft(thread)
+        thread.state = ThreadState.Ready
+        return reason
+
+      if limit <= 0:
+        return StopReason.Budget
+      if deadline is not None and time.perf_counter() >= deadline:
+        return StopReason.Timeout
+      yield 0
+
+  def run(self, max_instructions=None, max_seconds=None):
+    # until every thread has exited, or a limit, fault or deadlock stops it
+    slices = self.slices(max_instructions, max_seconds)
+    while True:
+      try:
+        delay = next(slices)
+      except StopIteration as stop:
+        return stop.value
+      if delay:
+        time.sleep(delay)
+
+  async def run_async(self, max_instructions=None, max_seconds=None):
+    # same as run(), handing the event loop a turn after every quantum and
+    # sleeping on it while all threads are asleep
+    slices = self.slices(max_instructions, max_seconds)
+    while True:
+      try:
+        delay = next(slices)
+      except StopIteration as stop:
+        return stop.value
+      await asyncio.sleep(delay)
@@ -0,0 +1,118 @@
+import csv
+import re
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+
+# guest symbols from a linker map or a csv list, kept as parallel sorted
+# arrays and looked up by binary search. symbolize() sits behind an lru
+# cache, since traces and profiles ask for the same few addresses over and
+# over
+
+CACHE_SIZE = 0x10000
+# how far a symbol without a size reaches when no other symbol follows it
+LAST_EXTENT = 0x10000
+
+# msvc:  0001:00000120       ?Update@Game@@QAAXXZ       82000120 f   game.obj
+MSVC_LINE = re.compile(r'^\s*[0-9a-fA-F]{4}:[0-9a-fA-F]{8}\s+(\S+)\s+([0-9a-fA-F]{8})\b')
+# gnu ld:                0x0000000082000120                update
+GNU_LINE = re.compile(r'^\s+0x([0-9a-fA-F]+)\s+([A-Za-z_.$][\w.$@]*)\s*$')
+
+class SymbolMap:
+  def __init__(self, symbols=(), cache_size=CACHE_SIZE) -> None:
+    # symbols: (address, name, size or None)
+    self.entries = {} # address -> (name, size or None), as given
+    self.starts = array('I')
+    self.ends = array('I')
+    self.names = []
+    self.symbolize = lru_cache(cache_size)(self.format)
+    self.add(symbols)
+
+  def add(self, symbols):
+    # merges more symbols in; a name given twice for one address keeps the first
+    entries = self.entries
+    for address, name, size in symbols:
+      entries.setdefault(address & 0xFFFFFFFF, (name, size))
+
+    self.starts = array('I', sorted(entries))
+    self.names = [entries[start][0] for start in self.starts]
+    self.ends = array('I')
+    for index, start in enumerate(self.starts):
+      size = entries[start][1]
+      if size is None:
+        end = self.starts[index + 1] if index + 1 < len(self.starts) else start + LAST_EXTENT
+      else:
+        end = start + max(size, 1)
+      self.ends.append(min(end, 0xFFFFFFFF))
+    self.symbolize.cache_clear()
+
+  def __len__(self):
+    return len(self.starts)
+
+  def lookup(self, address):
+    # (name, offset) of the symbol covering `address`, None outside every symbol
+    index = bisect_right(self.starts, address) - 1
+    if index < 0 or address >= self.ends[index]:
+      return None
+    return self.names[index], address - self.starts[index]
+
+  def name(self, address):
+    # the symbol starting exactly at `address`, None otherwise
+    index = bisect_right(self.starts, address) - 1
+    if index < 0 or self.starts[index] != address:
+      return None
+    return self.names[index]
+
+  def format(self, address):
+    found = self.lookup(address)
+    if found is None:
+      return hex(address)
+    name, offset = found
+    return f'{name}+{hex(offset)}' if offset else name
+
+def parse_map(lines):
+  # (address, name, None) of every public and static symbol in a linker map
+  for line in lines:
+    match = MSVC_LINE.match(line)
+    if match is not None:
+      address = int(match.group(2), 16)
+      if address:
+        yield address, match.group(1), None
+      continue
+    match = GNU_LINE.match(line)
+    if match is not None:
+      yield int(match.group(1), 16) & 0xFFFFFFFF, match.group(2), None
+
+def parse_csv(lines):
+  # address,name[,size] rows, hex with or without 0x; a header row naming
+  # the columns may put them in any order
+  columns = {'address': 0, 'name': 1, 'size': 2}
+  for row in csv.reader(lines):
+    row = [field.strip() for field in row]
+    if not row or row[0].startswith('#'):
+      continue
+    if 'address' in (field.lower() for field in row):
+      columns = {field.lower(): index for index, field in enumerate(row)}
+      continue
+    address = int(row[columns['address']], 16)
+    size = columns.get('size')
+    size = int(row[size], 0) if size is not None and size < len(row) and row[size] else None
+    yield address, row[columns['name']], size
+
+def load_symbols(path):
+  with open(path, newline='') as f:
+    parse = parse_csv if path.lower().endswith('.csv') else parse_map
+    return SymbolMap(parse(f))
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(description='look addresses up in a symbol map')
+  parser.add_argument('path', help='linker .map or address,name[,size] csv')
+  parser.add_argument('addresses', nargs='*', help='hex addresses')
+  args = parser.parse_args()
+
+  symbols = load_symbols(args.path)
+  print(f'{len(symbols)} symbols')
+  for address in args.addresses:
+    print(f'{address}: {symbols.symbolize(int(address, 16))}')
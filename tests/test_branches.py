@@ -0,0 +1,70 @@
+import pytest
+import asm
+from bench import make_vm, CODE_BASE
+from core import *
+
+ENGINES = ['interp', 'blocks', 'interp+lazy', 'blocks+lazy']
+
+def run(words, engine, **gpr):
+  vm = make_vm(asm.assemble(words), engine)
+  for number, value in gpr.items():
+    vm.context.gpr[int(number[1:])] = value
+  vm.context.iar = CODE_BASE // 4
+  vm.context.lr = 0
+  return vm, vm.run()
+
+def test_bcctr_encoding():
+  assert asm.bctr() == 0x4E800420
+  assert asm.bctrl() == 0x4E800421
+  for word, text in [(0x4E800420, 'bctr'), (0x4E800421, 'bctrl'), (asm.bcctr(4, 2), 'bnectr cr0')]:
+    handler, val = decode(word)
+    assert handler is bcctr
+    assert FORMATTERS[handler][1](val, None) == text
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_bctrl_calls_through_ctr(engine):
+  words = [
+    asm.lis(5, CODE_BASE >> 16),
+    asm.addi(5, 5, 0x20),
+    asm.mtctr(5),
+    asm.mflr(12),
+    asm.bctrl(),
+    asm.mtlr(12),
+    asm.blr(),
+    asm.li(3, 1),
+    asm.li(3, 7), # 0x20
+    asm.blr(),
+  ]
+  vm, reason = run(words, engine)
+  assert reason is StopReason.Returned
+  assert vm.context.gpr[3] == 7
+  assert vm.instructions == 9
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('value, expected', [(0, 1), (5, 2)])
+def test_conditional_bcctr(engine, value, expected):
+  # bnectr jumps to 0x1c unless r3 == 0, and leaves ctr alone
+  words = [
+    asm.lis(5, CODE_BASE >> 16),
+    asm.addi(5, 5, 0x1C),
+    asm.mtctr(5),
+    asm.cmpwi(0, 3, 0),
+    asm.bcctr(4, 2),
+    asm.li(4, 1),
+    asm.blr(),
+    asm.li(4, 2), # 0x1c
+    asm.blr(),
+  ]
+  vm, reason = run(words, engine, r3=value)
+  assert reason is StopReason.Returned
+  assert vm.context.gpr[4] == expected
+  assert vm.context.ctr == CODE_BASE + 0x1C
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_unknown_extended_opcode_faults(engine):
+  words = [asm.li(3, 1), asm.x_form(0, 0, 0, 1), asm.li(3, 2), asm.blr()]
+  vm, reason = run(words, engine)
+  assert reason is StopReason.Fault
+  assert 'opcode 31/1 not setup' in vm.fault
+  assert vm.context.gpr[3] == 1
+  assert (vm.context.iar * 4) & ADDRESS_MASK == CODE_BASE + 4
@@ -0,0 +1,47 @@
+import asm
+from cfg import CodeView, FunctionIndex, EDGE_FALLTHROUGH
+from core import *
+
+BASE = 0x82000000
+
+def index_of(words, entries):
+  code = CodeView()
+  code.add(BASE, asm.assemble(words))
+  index = FunctionIndex(code)
+  index.discover(entries, scan_prologues=False)
+  return index
+
+def test_bctr_ends_the_function():
+  # 0x00 calls 0x10; both jump through ctr, so the blr at 0x1c is unreachable
+  words = [
+    asm.bl(0x10),
+    asm.mtctr(3),
+    asm.bctr(),
+    asm.li(3, 0),
+    asm.li(4, 1), # 0x10
+    asm.mtctr(4),
+    asm.bctr(),
+    asm.blr(), # 0x1c, never reached from 0x10
+  ]
+  index = index_of(words, [BASE])
+  first = index.functions[BASE]
+  assert first.end == BASE + 0xC
+  assert first.indirect_jumps == [BASE + 8]
+  assert first.tail_calls == set()
+  second = index.functions[BASE + 0x10]
+  assert second.end == BASE + 0x1C
+  assert second.returns == []
+  assert index.function_at(BASE + 0x1C) is None
+
+def test_bctrl_is_a_call():
+  words = [asm.mtctr(3), asm.bctrl(), asm.li(3, 0), asm.blr()]
+  function = index_of(words, [BASE]).functions[BASE]
+  assert function.indirect_calls == [BASE + 4]
+  assert function.returns == [BASE + 0xC]
+  assert list(function.blocks) == [BASE]
+
+def test_conditional_bcctr_falls_through():
+  words = [asm.cmpwi(0, 3, 0), asm.bcctr(12, 2), asm.li(3, 1), asm.blr()]
+  function = index_of(words, [BASE]).functions[BASE]
+  assert function.blocks[BASE].successors == [(BASE + 8, EDGE_FALLTHROUGH)]
+  assert function.returns == [BASE + 0xC]
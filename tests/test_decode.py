@@ -0,0 +1,62 @@
+import pytest
+import asm
+from bench import make_vm, CODE_BASE
+from core import *
+
+ENGINES = ['interp', 'blocks', 'interp+lazy', 'blocks+lazy']
+
+def text(word):
+  handler, val = decode(word)
+  return FORMATTERS[handler][1](val, None)
+
+@pytest.mark.parametrize('word, expected', [
+  (asm.li(3, -1), 'li r3, -0x1'),
+  (asm.lis(4, 0x8200), 'lis r4, 0x8200'),
+  (asm.blr(), 'blr'),
+])
+def test_known_encodings(word, expected):
+  assert text(word) == expected
+
+def test_undecodable_word():
+  assert decode(0) is None
+
+def run(words, engine):
+  vm = make_vm(asm.assemble(words), engine)
+  vm.context.iar = CODE_BASE // 4
+  vm.context.lr = 0
+  return vm, vm.execute()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_backward_conditional_branch(engine):
+  vm, reason = run([asm.li(3, 0), asm.li(4, 5), asm.addi(3, 3, 1), asm.cmpw(0, 3, 4), asm.blt(0, -8), asm.blr()], engine)
+  assert reason is StopReason.Returned
+  assert vm.context.gpr[3] == 5
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_big_endian_loads_and_stores(engine):
+  words = [
+    asm.lis(5, HEAP_BASE >> 16),
+    asm.lis(6, 0x1234),
+    asm.addi(6, 6, 0x5678),
+    asm.stwu(6, 8, 5),
+    asm.li(7, -1),
+    asm.stb(7, 1, 5),
+    asm.lwz(8, -8, 5),
+    asm.lwz(9, 0, 5),
+    asm.blr(),
+  ]
+  vm, reason = run(words, engine)
+  assert reason is StopReason.Returned
+  assert vm.context.gpr[5] == HEAP_BASE + 8
+  assert bytes(vm.memory.read(HEAP_BASE + 8, 4)) == b'\x12\xff\x56\x78'
+  assert vm.context.gpr[9] == 0x12FF5678
+  assert vm.context.gpr[8] == 0
+
+def test_code_writes_drop_cached_entries():
+  vm, _ = run([asm.li(3, 1), asm.blr()], 'interp')
+  assert CODE_BASE in vm.decode_cache.entries
+  vm.memory.write(CODE_BASE, asm.li(3, 2).to_bytes(4, 'big'))
+  assert CODE_BASE not in vm.decode_cache.entries
+  vm.context.iar = CODE_BASE // 4
+  vm.execute()
+  assert vm.context.gpr[3] == 2
@@ -0,0 +1,66 @@
+import pytest
+import asm
+from bench import make_vm, CODE_BASE
+from core import *
+from recorder import TraceRecorder, TraceReader
+
+ENGINES = ['interp', 'blocks', 'interp+lazy', 'blocks+lazy']
+
+# compares into cr1 and cr7, an overflowing addo. into cr0 and a branch on each
+PROGRAM = [
+  asm.li(3, 5),
+  asm.li(4, -2),
+  asm.cmplw(1, 3, 4),
+  asm.cmpwi(7, 4, -2),
+  asm.lis(5, 0x7FFF),
+  asm.add(6, 5, 5, oe=1, rc=1),
+  asm.li(7, 0),
+  asm.bge(0, 8),
+  asm.addi(7, 7, 1),
+  asm.bne(7, 8),
+  asm.addi(7, 7, 2),
+  asm.mfcr(8),
+  asm.mfspr(9, 1),
+  asm.blr(),
+]
+
+def run(engine):
+  vm = make_vm(asm.assemble(PROGRAM), engine)
+  vm.context.iar = CODE_BASE // 4
+  vm.context.lr = 0
+  return vm, vm.run()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_lazy_matches_eager(engine):
+  expected, _ = run('interp')
+  vm, reason = run(engine)
+  assert reason is StopReason.Returned
+  assert vm.context.gpr[:10] == expected.context.gpr[:10]
+  assert vm.context.get_cr() == expected.context.cr
+  assert vm.context.get_xer() == expected.context.xer
+  assert vm.instructions == expected.instructions
+
+def test_flag_values():
+  vm, _ = run('interp+lazy')
+  cr = vm.context.gpr[8]
+  assert cr >> 28 == 0b1001 # addo. left a negative result and set so
+  assert (cr >> 24) & 0xF == 0b1000 # 5 < 0xFFFFFFFE unsigned
+  assert cr & 0xF == 0b0010
+  assert vm.context.gpr[9] & (XER_SO | XER_OV) == XER_SO | XER_OV
+  assert vm.context.gpr[7] == 3
+
+def record(engine, path):
+  vm = make_vm(asm.assemble(PROGRAM), engine)
+  vm.context.iar = CODE_BASE // 4
+  vm.context.lr = 0
+  with TraceRecorder(path) as recorder:
+    recorder.attach(vm)
+    assert vm.run() is StopReason.Returned
+  with TraceReader(path) as reader:
+    return reader.history('cr'), reader.history('xer')
+
+def test_recorded_trace_is_the_same_with_lazy_flags(tmp_path):
+  eager = record('interp', tmp_path / 'eager.trace')
+  lazy = record('interp+lazy', tmp_path / 'lazy.trace')
+  assert lazy == eager
+  assert [iar for _, iar, _ in eager[0]][:3] == [CODE_BASE + 8, CODE_BASE + 12, CODE_BASE + 20]
@@ -0,0 +1,29 @@
+import asm
+from bench import make_vm, guest_memcpy, CODE_BASE
+from core import *
+from natives import identify, detect_crt
+from profiler import Profiler
+from recorder import TraceRecorder
+
+def test_memcpy_is_recognised():
+  vm = make_vm(asm.assemble(guest_memcpy()), 'interp')
+  assert detect_crt(vm, [CODE_BASE]) == {CODE_BASE: 'memcpy'}
+
+def test_probes_leave_no_trace(tmp_path):
+  vm = make_vm(asm.assemble(guest_memcpy()), 'interp')
+  vm.instructions = 123
+  profiler = vm.profiler = Profiler()
+  recorder = TraceRecorder(tmp_path / 'probe.trace')
+  recorder.attach(vm)
+  name, spent = identify(vm, CODE_BASE)
+  assert name == 'memcpy' and spent > 0
+  assert vm.instructions == 123
+  assert vm.recorder is recorder and vm.memory.on_write == recorder.write
+  assert vm.profiler is profiler and not profiler.counts
+  assert recorder.count == 0 and len(recorder.writes) == 0
+  recorder.close()
+
+def test_budget_stops_probing():
+  vm = make_vm(asm.assemble(guest_memcpy()), 'interp')
+  assert detect_crt(vm, [CODE_BASE], budget=1) == {}
+  assert identify(vm, CODE_BASE, budget=1)[0] is None
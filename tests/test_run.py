@@ -0,0 +1,75 @@
+import io
+import pytest
+import asm
+from bench import make_vm, CODE_BASE
+from core import *
+
+def test_execute_keeps_a_passed_stack_pointer():
+  vm = make_vm(asm.assemble([asm.mr(3, 1), asm.blr()]), 'interp')
+  vm.context.iar = CODE_BASE // 4
+  assert vm.execute() is StopReason.Returned
+  assert vm.context.gpr[3] == STACK_BASE + STACK_SIZE // 2
+  vm.context.iar = CODE_BASE // 4
+  assert vm.execute(gpr={1: 0x70001000, 4: -1}) is StopReason.Returned
+  assert vm.context.gpr[3] == 0x70001000
+  assert vm.context.gpr[4] == 0xFFFFFFFFFFFFFFFF
+
+# every way a run can go, the first four through make_vm; all must count alike
+SETUPS = ['interp', 'blocks', 'interp+lazy', 'blocks+lazy', 'unfused', 'traced', 'profiled', 'recorded', 'covered']
+
+def counted(words, setup, tmp_path):
+  from cover import Coverage
+  from profiler import Profiler
+  from recorder import TraceRecorder
+  from tracing import Tracer
+  vm = make_vm(asm.assemble(words), setup if '+' in setup or setup in ('interp', 'blocks') else 'interp')
+  if setup == 'unfused':
+    vm.fusion = False
+  elif setup == 'traced':
+    vm.tracer = Tracer(history=4, sink=io.StringIO())
+  elif setup == 'profiled':
+    vm.profiler = Profiler()
+  elif setup == 'recorded':
+    TraceRecorder(tmp_path / 'run.trace').attach(vm)
+  elif setup == 'covered':
+    vm.coverage = Coverage(CODE_BASE, 0x1000)
+  vm.context.iar = CODE_BASE // 4
+  vm.context.lr = 0
+  return vm, vm.run()
+
+LOOP = [
+  asm.li(3, 0),
+  asm.li(4, 10),
+  asm.mtctr(4),
+  asm.addi(3, 3, 2), # loop
+  asm.bdnz(-4),
+  asm.blr(),
+]
+
+@pytest.mark.parametrize('setup', SETUPS)
+def test_complete_run_count(setup, tmp_path):
+  vm, reason = counted(LOOP, setup, tmp_path)
+  assert reason is StopReason.Returned
+  assert vm.context.gpr[3] == 20
+  assert vm.instructions == 3 + 2 * 10 + 1
+
+@pytest.mark.parametrize('setup', SETUPS)
+def test_fault_is_not_counted(setup, tmp_path):
+  words = [asm.li(3, 1), asm.li(4, 2), asm.lwz(5, 0, 0), asm.li(6, 3), asm.blr()]
+  vm, reason = counted(words, setup, tmp_path)
+  assert reason is StopReason.Fault
+  assert vm.context.iar * 4 == CODE_BASE + 8
+  assert vm.instructions == 2
+
+@pytest.mark.parametrize('setup', SETUPS)
+def test_fault_opening_a_block_is_not_counted(setup, tmp_path):
+  words = [asm.li(3, 1), asm.b(4), asm.stw(3, 0, 0), asm.blr()]
+  vm, reason = counted(words, setup, tmp_path)
+  assert reason is StopReason.Fault
+  assert vm.instructions == 2
+
+def test_step_does_not_count_a_fault():
+  vm = make_vm(asm.assemble([asm.li(3, 1), asm.lwz(5, 0, 0)]), 'interp')
+  vm.context.iar = CODE_BASE // 4
+  assert vm.step(2) is StopReason.Fault
+  assert vm.instructions == 1
@@ -0,0 +1,37 @@
+import pytest
+from xex import *
+
+pytest.importorskip('cryptography')
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+SESSION_KEY = bytes(range(16))
+PE_OFFSET = 0x100
+
+def encrypted(plain):
+  # an xex with only what read_stream needs: the stream encrypted as one CBC run
+  ecb = Cipher(algorithms.AES(RETAIL_KEY), modes.ECB()).encryptor()
+  cbc = Cipher(algorithms.AES(SESSION_KEY), modes.CBC(bytes(16))).encryptor()
+  xex = XEX()
+  xex.aes_key = ecb.update(SESSION_KEY) + ecb.finalize()
+  xex.encryption = ENCRYPTION_NORMAL
+  xex.pe_data_offset = PE_OFFSET
+  xex.data = bytes(PE_OFFSET) + cbc.update(plain) + cbc.finalize()
+  xex.image = ImageSource(xex)
+  return xex
+
+def test_unaligned_basic_compressed_blocks():
+  plain = b'MZ' + bytes((index * 7) & 0xFF for index in range(0x15E))
+  xex = encrypted(plain)
+  stream_offset = 0
+  for data_size, zero_size in [(0x35, 0x20), (0x101, 0x3), (0x29, 0)]:
+    xex.image.add(data_size, stream_offset)
+    if zero_size:
+      xex.image.add(zero_size, None)
+    stream_offset += data_size
+  expected = plain[:0x35] + bytes(0x20) + plain[0x35:0x136] + bytes(3) + plain[0x136:0x15F]
+  assert xex.image[0:len(expected)] == expected
+
+@pytest.mark.parametrize('offset', [0, 5, 16, 17, 31, 0x41])
+def test_read_stream_at_any_offset(offset):
+  plain = b'MZ' + bytes(range(2, 0x80))
+  assert encrypted(plain).read_stream(offset, 0x23) == plain[offset:offset+0x23]
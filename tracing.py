@@ -0,0 +1,75 @@
+import sys
+from collections import deque
+from enum import IntEnum, IntFlag
+
+class Category(IntFlag):
+  NONE = 0
+  DISASM = 1
+  MEM = 2
+  BRANCH = 4
+  SYSCALL = 8
+  ALL = DISASM | MEM | BRANCH | SYSCALL
+
+class Level(IntEnum):
+  ERROR = 0
+  INFO = 1
+  DEBUG = 2
+
+# level a record of each category is emitted at
+CATEGORY_LEVELS = {
+  Category.DISASM: Level.INFO,
+  Category.BRANCH: Level.INFO,
+  Category.SYSCALL: Level.INFO,
+  Category.MEM: Level.DEBUG,
+}
+
+class Tracer:
+  # categories below the level threshold fold into one int mask, so callers
+  # only ever test `tracer.mask & category` before building any text
+  def __init__(self, categories=Category.NONE, level=Level.INFO, sink=None, history=0) -> None:
+    self.sink = sink if sink is not None else sys.stdout
+    self.history = None
+    self.symbols = None # SymbolMap naming the addresses of emit_at records
+    self.mask = 0
+    self.enable(categories, level)
+    self.keep_history(history)
+
+  def enable(self, categories, level=Level.INFO):
+    self.mask = 0
+    for category, category_level in CATEGORY_LEVELS.items():
+      if categories & category and category_level <= level:
+        self.mask |= int(category)
+
+  def keep_history(self, size):
+    # ring buffer of the last `size` executed instructions as (address, entry)
+    self.history = deque(maxlen=size) if size else None
+
+  @property
+  def active(self):
+    return self.mask != 0 or self.history is not None
+
+  def emit(self, category, formatter, *args):
+    if self.mask & category:
+      self.sink.write(formatter(*args) + '\n')
+
+  def emit_at(self, address, category, formatter, *args):
+    # a record about `address`, followed by the symbol it falls in
+    if self.mask & category:
+      text = formatter(*args)
+      if self.symbols is not None:
+        text = f'{text}  ; {self.symbols.symbolize(address)}'
+      self.sink.write(text + '\n')
+
+  def error(self, text):
+    self.sink.write(text + '\n')
+
+  def dump(self, sink=None):
+    from core import FORMATTERS
+    sink = sink if sink is not None else self.sink
+    for address, (handler, val) in self.history or ():
+      formatter = FORMATTERS.get(handler, (None, None))[1]
+      text = formatter(val, None) if formatter is not None else handler.__name__
+      if self.symbols is not None:
+        sink.write(f'{hex(address)} {self.symbols.symbolize(address)}: {text}\n')
+      else:
+        sink.write(f'{hex(address)}: {text}\n')
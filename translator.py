@@ -0,0 +1,204 @@
+from core import *
+
+def emit_li(val, address):
+  if val.ra == 0:
+    return [f'gpr[{val.rt}] = {pyint_to_u32(u16_to_s16(val.si))}']
+  return [f'gpr[{val.rt}] = (gpr[{val.ra}] + {u16_to_s16(val.si)}) & 0xFFFFFFFF']
+
+def emit_lis(val, address):
+  si = u16_to_s16(val.si) << 16
+  if val.ra == 0:
+    return [f'gpr[{val.rt}] = {pyint_to_u32(si)}']
+  return [f'gpr[{val.rt}] = (gpr[{val.ra}] + {si}) & 0xFFFFFFFF']
+
+def emit_or_mr(val, address):
+  return [f'gpr[{val.ra}] = gpr[{val.rs}] | gpr[{val.rb}]']
+
+def emit_add(val, address):
+  if val.oe or val.rc:
+    return None
+  return [f'gpr[{val.rt}] = (gpr[{val.ra}] & 0xFFFFFFFFFFFFFFFF) + (gpr[{val.rb}] & 0xFFFFFFFFFFFFFFFF)']
+
+def d_offset(val):
+  return (val.ds ^ 0x8000) - 0x8000
+
+def emit_d_address(val):
+  if val.ra == 0:
+    return str(pyint_to_u32(d_offset(val)))
+  return f'(gpr[{val.ra}] + {d_offset(val)}) & 0xFFFFFFFF'
+
+def emit_load(method, val, address):
+  # iar is kept exact so an access violation reports the faulting instruction
+  return [f'ctx.iar = {address // 4}', f'gpr[{val.rt}] = vm.{method}({emit_d_address(val)}, {val.ra})']
+
+def emit_store(method, val, address):
+  return [f'ctx.iar = {address // 4}', f'vm.{method}({emit_d_address(val)}, gpr[{val.rt}], {val.ra})']
+
+def emit_store_update(method, val, address):
+  if val.ra == 0:
+    return None
+  return [
+    f'ctx.iar = {address // 4}',
+    f'a = {emit_d_address(val)}',
+    f'vm.{method}(a, gpr[{val.rt}], {val.ra})',
+    f'gpr[{val.ra}] = a',
+  ]
+
+def emit_lwz(val, address):
+  return emit_load('load_u32', val, address)
+
+def emit_lbz(val, address):
+  return emit_load('load_u8', val, address)
+
+def emit_lhz(val, address):
+  return emit_load('load_u16', val, address)
+
+def emit_stw(val, address):
+  return emit_store('store_u32', val, address)
+
+def emit_stb(val, address):
+  return emit_store('store_u8', val, address)
+
+def emit_sth(val, address):
+  return emit_store('store_u16', val, address)
+
+def emit_stwu(val, address):
+  return emit_store_update('store_u32', val, address)
+
+def emit_compare(val, lhs, rhs):
+  shift = cr_shift(val.crfd)
+  return [
+    f'a = {lhs}',
+    f'field = {CR_LT} if a < {rhs} else {CR_GT} if a > {rhs} else {CR_EQ}',
+    f'ctx.cr = (ctx.cr & {~(0xF << shift) & 0xFFFFFFFF}) | ((field | (ctx.xer >> 31)) << {shift})',
+  ]
+
+def emit_cmpi(val, address):
+  if val.l:
+    return None
+  return emit_compare(val, f'u32_to_s32(gpr[{val.ra}])', u16_to_s16(val.ds))
+
+def emit_cmpli(val, address):
+  if val.l:
+    return None
+  return emit_compare(val, f'gpr[{val.ra}] & 0xFFFFFFFF', pyint_to_u32(val.ds))
+
+def emit_compare_lazy(val, lhs, rhs):
+  return [
+    'if ctx.lazy_xer is not None:',
+    '  ctx.resolve_xer()',
+    f'ctx.lazy_cr[{val.crfd}] = ({lhs}, {rhs}, ctx.xer & {XER_SO})',
+  ]
+
+def emit_cmpi_lazy(val, address):
+  if val.l:
+    return None
+  return emit_compare_lazy(val, f'u32_to_s32(gpr[{val.ra}])', u16_to_s16(val.ds))
+
+def emit_cmpli_lazy(val, address):
+  if val.l:
+    return None
+  return emit_compare_lazy(val, f'gpr[{val.ra}] & 0xFFFFFFFF', val.ds)
+
+EMITTERS = {
+  li: emit_li,
+  lis: emit_lis,
+  or_mr: emit_or_mr,
+  add: emit_add,
+  cmpi: emit_cmpi,
+  cmpli: emit_cmpli,
+  add_lazy: emit_add,
+  cmpi_lazy: emit_cmpi_lazy,
+  cmpli_lazy: emit_cmpli_lazy,
+  lwz: emit_lwz,
+  lbz: emit_lbz,
+  lhz: emit_lhz,
+  stw: emit_stw,
+  stb: emit_stb,
+  sth: emit_sth,
+  stwu: emit_stwu,
+}
+
+TERMINATORS = {b, bc, bclr, bcctr, native_call}
+
+class BlockTranslator:
+  # compiles straight-line guest code into one python function per block
+  def __init__(self, vm: VirtualMachine, max_length=64) -> None:
+    self.vm = vm
+    self.max_length = max_length
+    self.blocks = {}
+    self.pages = {}
+    self.translated = 0
+    self.invalidated = 0
+
+  def find_block(self, address):
+    entries = []
+    while len(entries) < self.max_length:
+      entry = self.vm.decode_at(address + len(entries) * 4)
+      if entry is None:
+        break
+
+      entries.append(entry)
+      if entry[0] in TERMINATORS:
+        break
+    return entries
+
+  def translate(self, address):
+    entries = self.find_block(address)
+    if not entries:
+      return None
+
+    namespace = {
+      'IterReason': IterReason,
+      'ok': IterReason.IterOk,
+      'u32_to_s32': u32_to_s32,
+    }
+    lines = [
+      'def block(vm):',
+      '  ctx = vm.context',
+      '  gpr = ctx.gpr',
+    ]
+
+    last = len(entries) - 1
+    for i, (handler, val) in enumerate(entries):
+      iar = address // 4 + i
+      body = None
+      if i != last and handler in EMITTERS:
+        body = EMITTERS[handler](val, address + i * 4)
+
+      if body is None:
+        # fall back to the interpreter handler with its fields bound as constants
+        namespace[f'h{i}'] = handler
+        namespace[f'v{i}'] = val
+        body = [f'ctx.iar = {iar}']
+        if i == last:
+          body.append(f'return h{i}(v{i}, vm)')
+        else:
+          # a handler in the middle of a block can still pause the run
+          body += [f'reason = h{i}(v{i}, vm)', 'if reason is not ok:', f'  vm.block_ran = {i + 1}', '  return reason']
+      elif i == last:
+        body += [f'ctx.iar = {iar}', 'return IterReason.IterOk']
+
+      lines += ['  ' + line for line in body]
+
+    exec(compile('\n'.join(lines), f'<block {hex(address)}>', 'exec'), namespace)
+    block = namespace['block']
+    block.length = len(entries)
+
+    self.blocks[address] = block
+    end = address + len(entries) * 4
+    for page in range(address >> PAGE_SHIFT, ((end - 1) >> PAGE_SHIFT) + 1):
+      self.pages.setdefault(page, set()).add(address)
+
+    self.translated += 1
+    return block
+
+  def invalidate(self, offset, size):
+    for page in range(offset >> PAGE_SHIFT, ((offset + size - 1) >> PAGE_SHIFT) + 1):
+      for address in self.pages.pop(page, ()):
+        if self.blocks.pop(address, None) is not None:
+          self.invalidated += 1
+
+  def clear(self):
+    self.blocks.clear()
+    self.pages.clear()
@@ -1,5 +1,303 @@
-class XEX:
-  def __init__(self) -> None:
-    self.base_address = 0
-    self.pe_data_offset = 0
-    pass
\ No newline at end of file
+import mmap
+import struct
+from bisect import bisect_right
+
+XEX2_MAGIC = b'XEX2'
+
+HEADER_RESOURCE_INFO = 0x000002FF
+HEADER_FILE_FORMAT_INFO = 0x000003FF
+HEADER_ORIGINAL_BASE_ADDRESS = 0x00010001
+HEADER_ENTRY_POINT = 0x00010100
+HEADER_IMAGE_BASE_ADDRESS = 0x00010201
+HEADER_IMPORT_LIBRARIES = 0x000103FF
+HEADER_ORIGINAL_PE_NAME = 0x000183FF
+HEADER_DEFAULT_STACK_SIZE = 0x00020200
+HEADER_DEFAULT_HEAP_SIZE = 0x00020401
+HEADER_SYSTEM_FLAGS = 0x00030000
+HEADER_EXECUTION_INFO = 0x00040006
+
+ENCRYPTION_NONE = 0
+ENCRYPTION_NORMAL = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_BASIC = 1
+COMPRESSION_NORMAL = 2
+COMPRESSION_DELTA = 3
+
+SECTION_CODE = 1
+SECTION_DATA = 2
+SECTION_READONLY = 3
+
+IMAGE_FLAG_SMALL_PAGES = 0x10000000
+
+IMPORT_VARIABLE = 0
+IMPORT_THUNK = 1
+
+RETAIL_KEY = bytes([0x20, 0xB1, 0x85, 0xA5, 0x9D, 0x28, 0xFD, 0xC3, 0x40, 0x58, 0x3F, 0xBB, 0x08, 0x96, 0xBF, 0x91])
+DEVKIT_KEY = bytes(16)
+
+# uncompressed images are still split so that decryption stays lazy
+UNCOMPRESSED_BLOCK_SIZE = 0x10000
+
+class XEXError(Exception):
+  pass
+
+class Import:
+  def __init__(self, library, ordinal, kind, address) -> None:
+    self.library = library
+    self.ordinal = ordinal
+    self.kind = kind
+    self.address = address
+
+class ImportLibrary:
+  def __init__(self, name, id, version, version_min, records) -> None:
+    self.name = name
+    self.id = id
+    self.version = version
+    self.version_min = version_min
+    self.records = records
+
+class Section:
+  def __init__(self, address, size, kind) -> None:
+    self.address = address
+    self.size = size
+    self.kind = kind
+
+class ImageSource:
+  # the base file as seen from the guest: sliced like a bytes object, but each
+  # compressed/encrypted block is only decoded the first time it is touched
+  def __init__(self, xex) -> None:
+    self.xex = xex
+    self.starts = []
+    self.segments = []
+    self.blocks = {}
+    self.size = 0
+    self.session_key = None
+
+  def add(self, size, stream_offset):
+    # stream_offset of None means a run of zeros
+    self.starts.append(self.size)
+    self.segments.append((self.size, size, stream_offset))
+    self.size += size
+
+  def __len__(self):
+    return self.size
+
+  def block(self, index):
+    data = self.blocks.get(index)
+    if data is None:
+      start, size, stream_offset = self.segments[index]
+      if stream_offset is None:
+        data = bytes(size)
+      else:
+        data = self.xex.read_stream(stream_offset, size)
+      self.blocks[index] = data
+    return data
+
+  def __getitem__(self, key):
+    if not isinstance(key, slice):
+      return self[key:key+1][0]
+
+    start, stop, _ = key.indices(self.size)
+    out = bytearray()
+    index = bisect_right(self.starts, start) - 1
+    while start < stop and index < len(self.segments):
+      segment_start, size, _ = self.segments[index]
+      data = self.block(index)
+      chunk = data[start - segment_start:min(stop, segment_start + size) - segment_start]
+      out += chunk
+      start += len(chunk)
+      index += 1
+    return bytes(out)
+
+class XEX:
+  def __init__(self, path=None) -> None:
+    self.base_address = 0
+    self.pe_data_offset = 0
+    self.entry_point = 0
+    self.module_flags = 0
+    self.headers = {}
+    self.image_size = 0
+    self.image_flags = 0
+    self.aes_key = bytes(16)
+    self.encryption = ENCRYPTION_NONE
+    self.compression = COMPRESSION_NONE
+    self.sections = []
+    self.libraries = []
+    self.image = None
+    self.file = None
+    self.data = None
+    self.path = None
+    if path is not None:
+      self.open(path)
+    pass
+
+  def open(self, path):
+    self.path = path
+    self.file = open(path, 'rb')
+    self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    self.parse()
+
+  def close(self):
+    if self.data is not None:
+      self.data.close()
+      self.file.close()
+      self.data = None
+      self.file = None
+
+  def u16(self, offset):
+    return struct.unpack_from('>H', self.data, offset)[0]
+
+  def u32(self, offset):
+    return struct.unpack_from('>I', self.data, offset)[0]
+
+  def header(self, key, default=None):
+    # inline for size 0/1 keys, otherwise an offset to the header data
+    return self.headers.get(key, default)
+
+  def parse(self):
+    if self.data[0:4] != XEX2_MAGIC:
+      raise XEXError(f'not a XEX2 file (magic {bytes(self.data[0:4])!r})')
+
+    self.module_flags = self.u32(0x04)
+    self.pe_data_offset = self.u32(0x08)
+    security_offset = self.u32(0x10)
+    header_count = self.u32(0x14)
+
+    for i in range(header_count):
+      key, value = struct.unpack_from('>II', self.data, 0x18 + i * 8)
+      self.headers[key] = value
+
+    self.parse_security(security_offset)
+
+    self.entry_point = self.header(HEADER_ENTRY_POINT, 0)
+    self.base_address = self.header(HEADER_IMAGE_BASE_ADDRESS, self.base_address)
+
+    self.parse_file_format()
+    self.parse_imports()
+
+  def parse_security(self, offset):
+    self.image_size = self.u32(offset + 0x004)
+    self.image_flags = self.u32(offset + 0x10C)
+    self.base_address = self.u32(offset + 0x110)
+    self.aes_key = bytes(self.data[offset+0x150:offset+0x160])
+
+    page_size = 0x1000 if self.image_flags & IMAGE_FLAG_SMALL_PAGES else 0x10000
+    address = self.base_address
+    for i in range(self.u32(offset + 0x180)):
+      value = self.u32(offset + 0x184 + i * 24)
+      size = (value >> 4) * page_size
+      self.sections.append(Section(address, size, value & 0xF))
+      address += size
+
+  def parse_file_format(self):
+    offset = self.header(HEADER_FILE_FORMAT_INFO)
+    if offset is None:
+      raise XEXError('missing file format header')
+
+    info_size = self.u32(offset)
+    self.encryption = self.u16(offset + 4)
+    self.compression = self.u16(offset + 6)
+
+    self.image = ImageSource(self)
+    stream_size = len(self.data) - self.pe_data_offset
+
+    if self.compression == COMPRESSION_NONE:
+      for start in range(0, stream_size, UNCOMPRESSED_BLOCK_SIZE):
+        self.image.add(min(UNCOMPRESSED_BLOCK_SIZE, stream_size - start), start)
+    elif self.compression == COMPRESSION_BASIC:
+      stream_offset = 0
+      for i in range((info_size - 8) // 8):
+        data_size, zero_size = struct.unpack_from('>II', self.data, offset + 8 + i * 8)
+        if data_size:
+          self.image.add(data_size, stream_offset)
+        if zero_size:
+          self.image.add(zero_size, None)
+        stream_offset += data_size
+    elif self.compression == COMPRESSION_NORMAL:
+      raise XEXError('LZX compressed base files are not supported')
+    else:
+      raise XEXError(f'unsupported compression type {self.compression}')
+
+  def read_stream(self, offset, size):
+    # base file bytes [offset, offset + size), decrypted if needed
+    start = self.pe_data_offset + offset
+    if self.encryption == ENCRYPTION_NONE:
+      return bytes(self.data[start:start+size])
+
+    # the whole stream is one CBC run, and blocks need not end on 16 bytes:
+    # decrypt from the cipher block holding `offset`, chained to the one before
+    skip = offset & 15
+    start -= skip
+    iv = bytes(self.data[start-16:start]) if offset >= 16 else bytes(16)
+    return self.decrypt(iv, bytes(self.data[start:start+((skip + size + 15) & ~15)]))[skip:skip+size]
+
+  def decrypt(self, iv, data):
+    try:
+      from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    except ImportError:
+      raise XEXError('encrypted XEX files need the `cryptography` package')
+
+    if self.image.session_key is None:
+      # retail images decrypt to a PE header with the retail key, devkit ones with zeros
+      for key in (RETAIL_KEY, DEVKIT_KEY):
+        ecb = Cipher(algorithms.AES(key), modes.ECB()).decryptor()
+        session_key = ecb.update(self.aes_key) + ecb.finalize()
+        cbc = Cipher(algorithms.AES(session_key), modes.CBC(bytes(16))).decryptor()
+        first = self.pe_data_offset
+        if cbc.update(bytes(self.data[first:first+16]))[:2] == b'MZ':
+          break
+      self.image.session_key = session_key
+
+    cbc = Cipher(algorithms.AES(self.image.session_key), modes.CBC(iv)).decryptor()
+    return cbc.update(data) + cbc.finalize()
+
+  def parse_imports(self):
+    offset = self.header(HEADER_IMPORT_LIBRARIES)
+    if offset is None:
+      return
+
+    string_table_size = self.u32(offset + 4)
+    string_count = self.u32(offset + 8)
+
+    names = []
+    cursor = offset + 12
+    end = cursor + string_table_size
+    while cursor < end and len(names) < string_count:
+      terminator = self.data.find(b'\0', cursor, end)
+      terminator = end if terminator < 0 else terminator
+      names.append(bytes(self.data[cursor:terminator]).decode('ascii', 'replace'))
+      # names are padded to 4 bytes
+      cursor = (terminator + 4) & ~3
+
+    cursor = end
+    while cursor < offset + self.u32(offset):
+      size = self.u32(cursor)
+      id, version, version_min = struct.unpack_from('>III', self.data, cursor + 0x18)
+      name_index, count = struct.unpack_from('>HH', self.data, cursor + 0x24)
+      records = [self.u32(cursor + 0x28 + i * 4) for i in range(count)]
+      name = names[name_index] if name_index < len(names) else f'library{len(self.libraries)}'
+      self.libraries.append(ImportLibrary(name, id, version, version_min, records))
+      cursor += size
+
+  def imports(self, read_u32):
+    # the record words live in the image, so resolving them needs guest memory
+    for library in self.libraries:
+      for address in library.records:
+        value = read_u32(address)
+        yield Import(library, value & 0xFFFF, (value >> 24) & 0xFF, address)
+
+  def code_range(self):
+    # [start, end) spanning every code section, None without any
+    code = [section for section in self.sections if section.kind == SECTION_CODE]
+    if not code:
+      return None
+    return min(section.address for section in code), max(section.address + section.size for section in code)
+
+  @property
+  def original_pe_name(self):
+    offset = self.header(HEADER_ORIGINAL_PE_NAME)
+    if offset is None:
+      return None
+    size = self.u32(offset)
+    return bytes(self.data[offset+4:offset+size]).split(b'\0')[0].decode('ascii', 'replace')